@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Module for Area Of Interest (AOI) with derived forms computed once
+"""
+import geopandas
+import shapely
+from pyproj import CRS
+
+_equal_area_crs = 5070  # CONUS Albers equal area (meters)
+
+
+class AOI(object):
+    """Area Of Interest (AOI) that caches bounds, CRS codes and geometries.
+
+    Getters that take an aoi GeoDataFrame accept an AOI. Attributes not
+    defined here are passed through to the GeoDataFrame. Wrapping an AOI again
+    shares its cache, so getters can call AOI(aoi) on what they are given.
+
+    Parameters
+    ----------
+    aoi : geopandas.GeoDataFrame, geopandas.GeoSeries or AOI
+        Spatial definition for Area Of Interest (AOI), with a CRS.
+    """
+
+    def __init__(self, aoi):
+        if isinstance(aoi, AOI):
+            self.gdf = aoi.gdf
+            self._cache = aoi._cache
+            return
+        if isinstance(aoi, geopandas.GeoSeries):
+            aoi = aoi.to_frame()
+        assert isinstance(aoi, geopandas.GeoDataFrame), "Expected GeoDataFrame"
+        assert aoi.crs is not None, "AOI has no CRS"
+        self.gdf = aoi
+        self._cache = {}
+
+    def __repr__(self):
+        return f"(AOI) {len(self.gdf)} features, {self.crs.to_string()}"
+
+    def __len__(self):
+        return len(self.gdf)
+
+    def __getitem__(self, key):
+        return self.gdf[key]
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name == "gdf":
+            raise AttributeError(name)
+        return getattr(self.gdf, name)
+
+    def _cached(self, key, func):
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    @property
+    def crs(self):
+        return self.gdf.crs
+
+    @property
+    def total_bounds(self):
+        """Bounds (xmin, ymin, xmax, ymax) in AOI CRS."""
+        return self._cached("total_bounds", lambda: self.gdf.total_bounds)
+
+    @property
+    def epsg(self):
+        """EPSG code for CRS (None if not EPSG)."""
+        return self._cached("epsg", self.crs.to_epsg)
+
+    @property
+    def authority(self):
+        """Authority name and code for CRS, e.g., ('ESRI', '102039')."""
+        return self._cached("authority", self.crs.to_authority)
+
+    @property
+    def union(self):
+        """All AOI geometries as one geometry."""
+        return self._cached("union",
+                            lambda: shapely.union_all(self.gdf.geometry.values))
+
+    @property
+    def prepared(self):
+        """Union prepared for fast repeated predicates."""
+        def prepare():
+            geom = self.union
+            shapely.prepare(geom)
+            return geom
+        return self._cached("prepared", prepare)
+
+    @property
+    def equal_area(self):
+        """AOI in equal area projection with units of meters (EPSG:5070)."""
+        return self.to_crs(_equal_area_crs)
+
+    def simplified(self, tolerance):
+        """Union simplified (preserving topology) by tolerance in CRS units."""
+        return self._cached(("simplified", tolerance),
+                            lambda: shapely.simplify(self.union, tolerance))
+
+    def to_crs(self, crs):
+        """AOI reprojected to crs (cached)."""
+        crs = CRS.from_user_input(crs)
+        if crs == self.crs:
+            return self
+        return self._cached(("to_crs", crs.to_wkt()),
+                            lambda: AOI(self.gdf.to_crs(crs)))
+
+    def bounds_in(self, crs):
+        """Bounds (xmin, ymin, xmax, ymax) of AOI reprojected to crs."""
+        return self.to_crs(crs).total_bounds
+
+    def contains(self, geoms):
+        """Mask for geometries within AOI, using the prepared geometry.
+
+        Parameters
+        ----------
+        geoms : geopandas.GeoSeries or geopandas.GeoDataFrame
+            Geometries to test, reprojected to AOI CRS if needed.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask, True where geometry is within AOI.
+        """
+        if geoms.crs is not None and geoms.crs != self.crs:
+            geoms = geoms.to_crs(self.crs)
+        return shapely.contains(self.prepared, geoms.geometry.values)
+
+
+def as_gdf(aoi):
+    """Get GeoDataFrame for aoi (GeoDataFrame or AOI)."""
+    if isinstance(aoi, AOI):
+        return aoi.gdf
+    return aoi
@@ -7,6 +7,7 @@ import geopandas
 from numpy import nan
 
 from CHAPPIE import layer_query, utils
+from CHAPPIE.aoi import AOI
 
 IMLS_URL = "https://www.imls.gov/sites/default/files"
 REC_AREA_URL = "https://epa.maps.arcgis.com/sharing/rest/content/items/4f14ea9215d1498eb022317458437d19/data"
@@ -27,6 +28,7 @@ def get_historic(aoi):
     """
 
     url = 'https://services2.arcgis.com/FiaPA4ga0iQKduv3/ArcGIS/rest/services/nrhp_points_v1/FeatureServer'
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
     # out_fields = ['geometry', 'DFIRM_ID', 'FLD_AR_ID', 'FLD_ZONE', 'ZONE_SUBTY']
@@ -35,7 +37,7 @@ def get_historic(aoi):
                                 url=url,
                                 # out_fields=out_fields,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_library(aoi):
     """Get library data from IMLS.
@@ -58,11 +60,11 @@ def get_library(aoi):
 
     df = utils.get_from_zip(zip_url, expected_csvs, encoding="Windows-1252")
 
-    geom = geopandas.points_from_xy(df['LATITUDE'], df['LONGITUD'])
+    geom = geopandas.points_from_xy(df['LONGITUD'], df['LATITUDE'])
     gdf = geopandas.GeoDataFrame(df, geometry=geom, crs=4326)
     gdf.to_crs(aoi.crs, inplace=True)  # Coerce to export crs
-    # Filter by those within aoi
-    return gdf[gdf.geometry.within(aoi)]
+    # Filter by those within aoi (prepared geometry, not index aligned)
+    return gdf[AOI(aoi).contains(gdf)]
 
 
 def get_museums(aoi):
@@ -89,11 +91,11 @@ def get_museums(aoi):
     df_geoms = df[['LATITUDE', 'LONGITUDE']].copy()
     df_geoms.replace(" ", nan, inplace=True)  # Must be able to coerce to float
 
-    geom = geopandas.points_from_xy(df_geoms['LATITUDE'], df_geoms['LONGITUDE'])
+    geom = geopandas.points_from_xy(df_geoms['LONGITUDE'], df_geoms['LATITUDE'])
     gdf = geopandas.GeoDataFrame(df, geometry=geom, crs=4326)
     gdf.to_crs(aoi.crs, inplace=True)   # Coerce to export crs
-    # Filter by those within aoi
-    return gdf[gdf.geometry.within(aoi)]
+    # Filter by those within aoi (prepared geometry, not index aligned)
+    return gdf[AOI(aoi).contains(gdf)]
 
 
 def get_worship(aoi):
@@ -112,13 +114,14 @@ def get_worship(aoi):
     """
 
     url = 'https://services.arcgis.com/XG15cJAlne2vxtgt/ArcGIS/rest/services/All_Places_Of_Worship__HiFLD_Open_/FeatureServer'
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=42,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 
 def get_recreationalArea():
@@ -3,7 +3,8 @@ Module for education assets.
 
 @author: tlomba01
 """
-from CHAPPIE import layer_query
+from CHAPPIE import layer_query, utils
+from CHAPPIE.aoi import AOI
 
 BASE_URL = "https://services1.arcgis.com/Hp6G80Pky0om7QvQ/arcgis/rest/services/"
 
@@ -24,13 +25,14 @@ def get_schools_public(aoi):
     """
 
     url = f"{BASE_URL}/Public_Schools/FeatureServer"
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
     
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_schools_private(aoi):
     """Get Private School locations within AOI.
@@ -48,13 +50,14 @@ def get_schools_private(aoi):
     """
 
     url = f"{BASE_URL}/Private_Schools/FeatureServer"
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
     
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_child_care(aoi):
     """Get Child Care locations within AOI.
@@ -72,13 +75,14 @@ def get_child_care(aoi):
     """
 
     url = f"{BASE_URL}/ChildCareCenter1/FeatureServer"
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
     
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_colleges_universities(aoi):
     """Get College and University locations within AOI.
@@ -96,13 +100,14 @@ def get_colleges_universities(aoi):
     """
 
     url = f"{BASE_URL}/Colleges_and_Universities/FeatureServer"
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
     
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_supplemental_colleges(aoi):
     """Get Supplemental College locations within AOI.
@@ -120,10 +125,39 @@ def get_supplemental_colleges(aoi):
     """
 
     url = f"{BASE_URL}/Supplemental_Colleges/FeatureServer"
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
     
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
+
+
+def get_all(aoi, max_workers=None, errors="raise"):
+    """Get all education assets for Area Of Interest (AOI) concurrently.
+
+    Parameters
+    ----------
+    aoi : geopandas.GeoDataFrame
+        Spatial definition for Area Of Interest (AOI).
+    max_workers : int, optional
+        Max concurrent requests. The default is None (one per layer).
+    errors : str, optional
+        "raise" to raise the first failed request or "warn" to warn and leave
+        failed layers out. The default is "raise".
+
+    Returns
+    -------
+    dict
+        GeoDataFrame for each education asset.
+
+    """
+    getters = {"schools_public": get_schools_public,
+               "schools_private": get_schools_private,
+               "child_care": get_child_care,
+               "colleges_uni": get_colleges_universities,
+               "colleges_sup": get_supplemental_colleges}
+    return utils.fetch_many(aoi, getters, max_workers, extent_only=True,
+                            errors=errors)
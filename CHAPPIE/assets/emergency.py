@@ -3,7 +3,8 @@ Module for emergency assets.
 
 @author: tlomba01
 """
-from CHAPPIE import layer_query
+from CHAPPIE import layer_query, utils
+from CHAPPIE.aoi import AOI
 
 def get_fire_ems(aoi):
     """Get Fire EMS locations within AOI.
@@ -21,13 +22,14 @@ def get_fire_ems(aoi):
     """
 
     url = 'https://carto.nationalmap.gov/arcgis/rest/services/structures/MapServer'
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
     
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=51,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 
 def get_police(aoi):
@@ -46,10 +48,36 @@ def get_police(aoi):
     """
 
     url = 'https://services2.arcgis.com/FiaPA4ga0iQKduv3/arcgis/rest/services/Structures_Law_Enforcement_v1/FeatureServer'
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
     
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
+
+
+def get_all(aoi, max_workers=None, errors="raise"):
+    """Get all emergency assets for Area Of Interest (AOI) concurrently.
+
+    Parameters
+    ----------
+    aoi : geopandas.GeoDataFrame
+        Spatial definition for Area Of Interest (AOI).
+    max_workers : int, optional
+        Max concurrent requests. The default is None (one per layer).
+    errors : str, optional
+        "raise" to raise the first failed request or "warn" to warn and leave
+        failed layers out. The default is "raise".
+
+    Returns
+    -------
+    dict
+        GeoDataFrame for each emergency asset.
+
+    """
+    getters = {"fire_ems": get_fire_ems,
+               "police": get_police}
+    return utils.fetch_many(aoi, getters, max_workers, extent_only=True,
+                            errors=errors)
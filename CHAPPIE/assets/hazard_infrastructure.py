@@ -6,6 +6,7 @@ Module for hazard infrastructure assets.
 import pandas
 
 from CHAPPIE import layer_query
+from CHAPPIE.aoi import AOI
 
 def get_dams(aoi):
     """Get dam locations within AOI.
@@ -23,13 +24,14 @@ def get_dams(aoi):
     """
 
     url = 'https://services.arcgis.com/xOi1kZaI0eWDREZv/ArcGIS/rest/services/NTAD_Dams/FeatureServer'
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
     
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_levee(aoi):
     """Get leveed area locations within AOI.
@@ -47,13 +49,14 @@ def get_levee(aoi):
     """
 
     url = 'https://geospatial.sec.usace.army.mil/dls/rest/services/NLD/Public/FeatureServer'
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
     
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=17,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_levee_pump_stations(df):
     """Get the number of pump stations per Leveed Area.
@@ -13,6 +13,7 @@ import requests
 from numpy import nan
 
 from CHAPPIE import layer_query, utils
+from CHAPPIE.aoi import AOI
 
 _npi_url = "https://npiregistry.cms.hhs.gov/api"
 _npi_url_backup = f"{_npi_url[:-3]}RegistryBack/search"
@@ -39,13 +40,14 @@ def get_hospitals(aoi):
     """
 
     url = 'https://services2.arcgis.com/FiaPA4ga0iQKduv3/arcgis/rest/services/Medicare_Hospitals/FeatureServer'
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_urgent_care(aoi):
     """Get Urgent Care locations within AOI.
@@ -66,13 +68,14 @@ def get_urgent_care(aoi):
     #lyr=0
     # new resource while above is down
     url = 'https://maps.nccs.nasa.gov/mapping/rest/services/hifld_open/public_health/FeatureServer/'
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=4,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 
 def _get_npi_api(params):
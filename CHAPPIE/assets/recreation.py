@@ -12,6 +12,7 @@ from numpy import nan
 from shapely.geometry import LineString, Point
 
 from CHAPPIE import layer_query
+from CHAPPIE.aoi import AOI, as_gdf
 
 
 def get_padus(aoi):
@@ -30,13 +31,14 @@ def get_padus(aoi):
     """
 
     url = 'https://services.arcgis.com/v01gqwM5QqNysAAi/ArcGIS/rest/services/PADUS_Public_Access/FeatureServer'
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_parks(aoi):
     """Get USA parks within AOI.
@@ -55,13 +57,14 @@ def get_parks(aoi):
 
     url = 'https://services.arcgis.com/P3ePLMYs2RVChkJx/arcgis/rest/services/USA_Detailed_Parks/FeatureServer'
 
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_trails(aoi):
     """Get Recreational trails of the United States within AOI.
@@ -80,13 +83,14 @@ def get_trails(aoi):
 
     url = 'https://carto.nationalmap.gov/arcgis/rest/services/transportation/MapServer'
 
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=37,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 
 def get_water_access(aoi):
@@ -131,7 +135,7 @@ def get_water_access(aoi):
     # creat lines from the start/end points
     beacon_gdf = points_BEACON(beacon_df, crs_out=aoi.crs)
     #subset those location by clipping them to the aoi
-    gdf = beacon_gdf.clip(aoi)
+    gdf = beacon_gdf.clip(as_gdf(aoi))
 
     return gdf
 
@@ -3,7 +3,8 @@ Module for transit assets.
 
 @author: edamico
 """
-from CHAPPIE import layer_query
+from CHAPPIE import layer_query, utils
+from CHAPPIE.aoi import AOI
 
 BASE_URL = "https://services.arcgis.com/xOi1kZaI0eWDREZv/arcgis/rest/services"
 
@@ -23,13 +24,14 @@ def get_air(aoi):
     """
 
     url = f'{BASE_URL}/NTAD_Aviation_Facilities/FeatureServer'
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_bus(aoi):
     """Get Bus station locations within AOI.
@@ -48,13 +50,14 @@ def get_bus(aoi):
 
     url = f'{BASE_URL}/NTAD_National_Transit_Map_Stops/FeatureServer'
 
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_rail(aoi):
     """Get Amtrak station locations within AOI.
@@ -73,10 +76,37 @@ def get_rail(aoi):
 
     url = f'{BASE_URL}/NTAD_Amtrak_Stations/FeatureServer'
 
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
+
+
+def get_all(aoi, max_workers=None, errors="raise"):
+    """Get all transit assets for Area Of Interest (AOI) concurrently.
+
+    Parameters
+    ----------
+    aoi : geopandas.GeoDataFrame
+        Spatial definition for Area Of Interest (AOI).
+    max_workers : int, optional
+        Max concurrent requests. The default is None (one per layer).
+    errors : str, optional
+        "raise" to raise the first failed request or "warn" to warn and leave
+        failed layers out. The default is "raise".
+
+    Returns
+    -------
+    dict
+        GeoDataFrame for each transit asset.
+
+    """
+    getters = {"air": get_air,
+               "bus": get_bus,
+               "rail": get_rail}
+    return utils.fetch_many(aoi, getters, max_workers, extent_only=True,
+                            errors=errors)
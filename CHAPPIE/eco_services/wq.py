@@ -3,7 +3,8 @@ Module for Get Assessment Total Maximum Daily Load (TMDL) Tracking and Implement
 
 @author:  edamico
 """
-from CHAPPIE import layer_query
+from CHAPPIE import layer_query, utils
+from CHAPPIE.aoi import AOI
 
 url = 'https://gispub.epa.gov/arcgis/rest/services/OW/ATTAINS_Assessment/MapServer'
 
@@ -22,13 +23,14 @@ def get_attains_points(aoi):
 
     """
 
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_attains_lines(aoi):
     """Get ATTAINS lines within AOI.
@@ -45,13 +47,14 @@ def get_attains_lines(aoi):
 
     """
 
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=1,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_attains_polygons(aoi):
     """Get ATTAINS polygons within AOI.
@@ -68,10 +71,37 @@ def get_attains_polygons(aoi):
 
     """
 
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=2,
-                                in_crs=aoi.crs.to_epsg())
\ No newline at end of file
+                                in_crs=aoi.epsg)
+
+
+def get_all(aoi, max_workers=None, errors="raise"):
+    """Get all ATTAINS layers for Area Of Interest (AOI) concurrently.
+
+    Parameters
+    ----------
+    aoi : geopandas.GeoDataFrame
+        Spatial definition for Area Of Interest (AOI).
+    max_workers : int, optional
+        Max concurrent requests. The default is None (one per layer).
+    errors : str, optional
+        "raise" to raise the first failed request or "warn" to warn and leave
+        failed layers out. The default is "raise".
+
+    Returns
+    -------
+    dict
+        GeoDataFrame for each ATTAINS layer.
+
+    """
+    getters = {"attains_points": get_attains_points,
+               "attains_lines": get_attains_lines,
+               "attains_polygons": get_attains_polygons}
+    return utils.fetch_many(aoi, getters, max_workers, extent_only=True,
+                            errors=errors)
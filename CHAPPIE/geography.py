@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Module for Census GEOID hierarchy joins and crosswalks using integer keys
+
+GEOIDs are fixed-width, each level extending its parent (state 2 digits,
+county 5, tract 11, block group 12), so a parent key is the integer GEOID
+floor divided by a power of 10.
+"""
+import numpy
+import pandas
+
+# GEOID width (digits) for each level
+LEVELS = {"state": 2, "county": 5, "tract": 11, "block group": 12}
+
+# Census 2020 to 2010 relationship files (land area of each part)
+_rel_url = "https://www2.census.gov/geo/docs/maps-data/data/rel2020"
+_rel_names = {"tract": "tract", "block group": "blkgrp"}
+
+
+def to_int(geoids):
+    """GEOID strings to int64 keys (leading zeros dropped)."""
+    return numpy.asarray(geoids, dtype=str).astype("int64")
+
+
+def to_str(keys, level):
+    """Int keys to zero padded GEOID strings for level."""
+    return pandas.Series(keys).astype(str).str.zfill(LEVELS[level]).to_numpy()
+
+
+def level_of(geoids):
+    """Level for GEOID strings (all the same width)."""
+    widths = pandas.Series(geoids).str.len().unique()
+    assert len(widths) == 1, f"Mixed GEOID widths {list(widths)}"
+    levels = {width: level for level, width in LEVELS.items()}
+    assert widths[0] in levels, f"{widths[0]} digits is not a GEOID level"
+    return levels[widths[0]]
+
+
+def parent(keys, level, parent_level):
+    """Int keys at level rolled up to int keys at parent_level."""
+    digits = LEVELS[level] - LEVELS[parent_level]
+    assert digits >= 0, f"{parent_level} is not a parent of {level}"
+    return numpy.asarray(keys, dtype="int64") // 10 ** digits
+
+
+def components(geoids):
+    """Split GEOIDs into fixed-width integer components.
+
+    Parameters
+    ----------
+    geoids : list or pandas.Series
+        GEOID strings, all the same level.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns for each level down to the GEOID level, e.g., state (2
+        digits), county (3), tract (6) and block group (1).
+    """
+    level = level_of(geoids)
+    keys = to_int(geoids)
+    out = {}
+    width = 0
+    for name, name_width in LEVELS.items():
+        if name_width > LEVELS[level]:
+            break
+        digits = name_width - width
+        out[name] = parent(keys, level, name) % 10 ** digits
+        width = name_width
+    dtypes = {"state": "uint8", "county": "uint16", "tract": "uint32",
+              "block group": "uint8"}
+    return pandas.DataFrame(out, index=getattr(geoids, "index", None)).astype(
+        {name: dtypes[name] for name in out})
+
+
+def roll_up(df, level, geoid_col="GEOID", columns=None, agg="sum"):
+    """Aggregate rows (e.g., block groups) to a parent level (e.g., tract).
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Table with GEOID column.
+    level : str
+        Parent level in LEVELS to aggregate to.
+    geoid_col : str, optional
+        GEOID column in df. The default is "GEOID".
+    columns : list, optional
+        Columns to aggregate. The default is None (all numeric columns).
+    agg : str, optional
+        Aggregation passed to pandas groupby. The default is "sum".
+
+    Returns
+    -------
+    pandas.DataFrame
+        Aggregated values indexed by parent GEOID (geoid_col).
+    """
+    if columns is None:
+        columns = df.select_dtypes("number").columns.to_list()
+    keys = parent(to_int(df[geoid_col]), level_of(df[geoid_col]), level)
+    out = df[columns].groupby(keys).agg(agg)
+    out.index = pandas.Index(to_str(out.index, level), name=geoid_col)
+    return out
+
+
+def roll_down(df, parent_df, geoid_col="GEOID", parent_col="GEOID"):
+    """Join parent values (e.g., tract) to child rows (e.g., block groups).
+
+    Each child row gets values for the parent its GEOID is within, many to
+    one, joined on integer keys.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Child table with GEOID column (e.g., households with block group).
+    parent_df : pandas.DataFrame
+        Parent table with unique GEOID column (e.g., tract heat events).
+    geoid_col : str, optional
+        GEOID column in df. The default is "GEOID".
+    parent_col : str, optional
+        GEOID column in parent_df, dropped from result. The default is "GEOID".
+
+    Returns
+    -------
+    pandas.DataFrame
+        df with parent_df columns added (NaN where no parent).
+    """
+    level = level_of(df[geoid_col])
+    parent_level = level_of(parent_df[parent_col])
+    keys = parent(to_int(df[geoid_col]), level, parent_level)
+    parent_keys = pandas.Index(to_int(parent_df[parent_col]))
+    assert parent_keys.is_unique, f"Duplicate {parent_col} in parent_df"
+    values = parent_df.drop(columns=parent_col).set_axis(parent_keys)
+    return df.join(values.reindex(keys).set_axis(df.index))
+
+
+def get_relationship(level="tract", rel_file=None):
+    """Get Census 2020 to 2010 relationship (land area of each part).
+
+    Parameters
+    ----------
+    level : str, optional
+        "tract" or "block group". The default is "tract".
+    rel_file : str, optional
+        Local relationship file. The default is None (Census download).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Int keys "GEOID_20" and "GEOID_10" with land area of the part
+        ("AREALAND_PART") and of each whole ("AREALAND_20", "AREALAND_10").
+    """
+    name = _rel_names[level]
+    if rel_file is None:
+        rel_file = f"{_rel_url}/{name}/tab20_{name}20_{name}10_natl.txt"
+    name = name.upper()
+    cols = {f"GEOID_{name}_20": "GEOID_20",
+            f"GEOID_{name}_10": "GEOID_10",
+            "AREALAND_PART": "AREALAND_PART",
+            f"AREALAND_{name}_20": "AREALAND_20",
+            f"AREALAND_{name}_10": "AREALAND_10"}
+    rel = pandas.read_csv(rel_file, sep="|", usecols=list(cols), dtype=str)
+    rel = rel.rename(columns=cols).dropna(subset=["GEOID_20", "GEOID_10"])
+    for col in ["GEOID_20", "GEOID_10"]:
+        rel[col] = to_int(rel[col])
+    for col in ["AREALAND_PART", "AREALAND_20", "AREALAND_10"]:
+        rel[col] = rel[col].astype("float64")
+    return rel
+
+
+def crosswalk(df, relationship, from_year=2010, geoid_col="GEOID", columns=None,
+              extensive=True):
+    """Crosswalk values between 2010 and 2020 geographies.
+
+    Extensive values (counts) are split by share of land area of the source
+    (from_year) geography and summed. Intensive values (rates) are averaged
+    weighted by land area of each part.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Table with GEOID column for from_year geographies.
+    relationship : pandas.DataFrame
+        Relationship from get_relationship() for the same level.
+    from_year : int, optional
+        Year of df geographies, 2010 or 2020. The default is 2010.
+    geoid_col : str, optional
+        GEOID column in df. The default is "GEOID".
+    columns : list, optional
+        Columns to crosswalk. The default is None (all numeric columns).
+    extensive : bool, optional
+        Whether values are extensive (True) or intensive (False). The default
+        is True.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Values indexed by the other year's GEOID (geoid_col).
+    """
+    assert from_year in [2010, 2020], "Relationships are 2010 to/from 2020"
+    to_year = 2030 - from_year
+    src, dst = f"GEOID_{from_year % 100}", f"GEOID_{to_year % 100}"
+    if columns is None:
+        columns = df.select_dtypes("number").columns.to_list()
+    level = level_of(df[geoid_col])
+
+    values = df[columns].set_axis(pandas.Index(to_int(df[geoid_col])))
+    rel = relationship[relationship[src].isin(values.index)]
+    weights = rel["AREALAND_PART"].to_numpy()
+    if extensive:
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            weights = weights / rel[f"AREALAND_{from_year % 100}"].to_numpy()
+    weights = numpy.nan_to_num(weights)
+    part_values = values.reindex(rel[src]).to_numpy(dtype="float64")
+    valid = ~numpy.isnan(part_values)
+    weighted = pandas.DataFrame(
+        numpy.where(valid, part_values, 0.0) * weights[:, None], columns=columns)
+    out = weighted.groupby(rel[dst].to_numpy()).sum()
+    if not extensive:
+        totals = pandas.DataFrame(valid * weights[:, None], columns=columns)
+        out = out / totals.groupby(rel[dst].to_numpy()).sum()
+    out.index = pandas.Index(to_str(out.index, level), name=geoid_col)
+    return out
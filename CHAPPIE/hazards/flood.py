@@ -4,12 +4,19 @@ Module for flood hazards
 @author: tlomba01
 """
 
+import math
 import warnings
 
+import numpy
 import pandas
+import shapely
 from numpy import nan
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
+from shapely import STRtree
 
 from CHAPPIE import layer_query
+from CHAPPIE.aoi import AOI
 
 
 def get_fema_nfhl(aoi):
@@ -28,6 +35,7 @@ def get_fema_nfhl(aoi):
     """
 
     url = "https://services.arcgis.com/P3ePLMYs2RVChkJx/ArcGIS/rest/services/USA_Flood_Hazard_Reduced_Set_gdb/FeatureServer"
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
     # out_fields = ['geometry', 'DFIRM_ID', 'FLD_AR_ID', 'FLD_ZONE', 'ZONE_SUBTY']
@@ -37,11 +45,11 @@ def get_fema_nfhl(aoi):
         url=url,
         # out_fields=out_fields,
         layer=0,
-        in_crs=aoi.crs.to_epsg(),
+        in_crs=aoi.epsg,
     )
 
 
-def get_flood(aoi, output=None):
+def get_flood(aoi, output=None, tolerance=None, precision=None):
     """Get flood imagery statistics and histogram for polygon within AOI.
 
     Parameters
@@ -52,16 +60,35 @@ def get_flood(aoi, output=None):
     output : str, optional
         csv file path to Append data to. The default is None and does not write to csv.
 
+    tolerance : float or str, optional
+        Simplify parcel polygons by this distance (aoi CRS units) before
+        sending them. Use "pixel" to simplify to the raster pixel size.
+        The default is None and sends full resolution polygons.
+
+    precision : float, optional
+        Grid size (aoi CRS units) to quantize parcel coordinates to before
+        sending them. The default is None and does not quantize.
+
     Returns
     -------
     pandas.DataFrame
-        Table of results with Mean statistic, and parcel number (id).
+        Table of results with Mean statistic, and parcel number (id). If
+        polygons were generalized "vertices" and "vertices_sent" columns
+        report how much each was simplified.
 
     """
     url = "https://enviroatlas.epa.gov/arcgis/rest/services/Supplemental/Estimated_floodplain_CONUS_WM/ImageServer"
     parcel_id = "parcelnumb"  # unique id column name for parcel data
 
-    df = pandas.DataFrame(columns=[parcel_id, "mean"])
+    if tolerance == "pixel":
+        # Resolve once for all parcels
+        tolerance = layer_query.get_pixel_tolerance(url, aoi.crs, aoi.total_bounds)
+    generalize = bool(tolerance or precision)
+
+    cols = [parcel_id, "mean"]
+    if generalize:
+        cols += ["vertices", "vertices_sent"]
+    df = pandas.DataFrame(columns=cols)
     # Add headers to the csv at beginning once, since the rows are appended to
     # csv one by one hereafter
     # TODO: could these be added to the csv all at once at the end?
@@ -70,16 +97,143 @@ def get_flood(aoi, output=None):
 
     for i in range(len(aoi)):  # TODO: use iterrows instead?
         row = aoi.iloc[[i]]  # [[]] for df not series
-        datadict = layer_query.get_image_by_poly(aoi=aoi, url=url, row=row)
+        datadict = layer_query.get_image_by_poly(aoi=aoi,
+                                                 url=url,
+                                                 row=row,
+                                                 tolerance=tolerance,
+                                                 precision=precision)
         try:
             mean_val = datadict["statistics"][0]["mean"]
         except IndexError:
             warnings.warn(f"Response does not contain mean value: {datadict}")
             mean_val = nan
-        df.loc[i] = [row.loc[i, parcel_id], mean_val]
+        if generalize:
+            report = datadict.get("generalization", {})
+            df.loc[i] = [row.loc[i, parcel_id],
+                         mean_val,
+                         report.get("vertices", nan),
+                         report.get("vertices_sent", nan)]
+        else:
+            df.loc[i] = [row.loc[i, parcel_id], mean_val]
         # This probably could be improved by using iterrows.
         # Iterrows may obscure the geometry somewhat, but is worth revisiting.
         if output:
             df.to_csv(output, mode="a", index=False, header=False)
             df.drop(df.index, inplace=True)  #TODO: should this be before write?
     return df
+
+
+class ZoneGrid(object):
+    """Rasterized flood zones for fast lookup at points (e.g., parcel centroids).
+
+    Zone polygons are burned into a categorical grid. Cells on a zone boundary
+    are flagged and points falling in them are resolved with exact polygon
+    tests, so lookups are exact while most points only need an array index.
+    Where zone polygons overlap the first polygon in the table is used.
+    """
+
+    BOUNDARY = numpy.iinfo(numpy.uint16).max  # Cell code for boundary cells
+
+    def __init__(self, zones_gdf, resolution, zone_col="FLD_ZONE"):
+        """Build zone grid.
+
+        Parameters
+        ----------
+        zones_gdf : geopandas.GeoDataFrame
+            Zone polygons, e.g., from get_fema_nfhl().
+        resolution : float
+            Cell size in zones_gdf CRS units (e.g., 10 for 10 m cells).
+        zone_col : str, optional
+            Column with zone values. The default is "FLD_ZONE".
+
+        """
+        self.crs = zones_gdf.crs
+        self.resolution = resolution
+        self._geoms = numpy.asarray(zones_gdf.geometry.values)
+        # Categories, code 0 is reserved for no zone
+        codes, self.categories = pandas.factorize(zones_gdf[zone_col])
+        assert len(self.categories) < self.BOUNDARY - 1, "Too many zone values"
+        self._codes = codes.astype("int64") + 1
+        self._codes[codes < 0] = 0  # Null zone
+
+        xmin, ymin, xmax, ymax = zones_gdf.total_bounds
+        self.bounds = (xmin, ymin, xmax, ymax)
+        self.shape = (max(1, math.ceil((ymax - ymin) / resolution)),
+                      max(1, math.ceil((xmax - xmin) / resolution)))
+        self.transform = from_origin(xmin, ymax, resolution, resolution)
+
+        # Burn in reverse so the first polygon wins where they overlap
+        shapes = [(geom, int(code)) for geom, code in zip(self._geoms, self._codes)
+                  if geom is not None and not geom.is_empty]
+        self.grid = rasterize(shapes[::-1],
+                              out_shape=self.shape,
+                              transform=self.transform,
+                              fill=0,
+                              dtype="uint16")
+        # Flag every cell a boundary touches (and neighbors, to be safe at
+        # cell edges) for exact tests
+        edges = rasterize([(shapely.boundary(geom), 1) for geom, _ in shapes],
+                          out_shape=self.shape,
+                          transform=self.transform,
+                          fill=0,
+                          all_touched=True,
+                          dtype="uint8").astype(bool)
+        dilated = edges.copy()
+        dilated[1:, :] |= edges[:-1, :]
+        dilated[:-1, :] |= edges[1:, :]
+        dilated[:, 1:] |= edges[:, :-1]
+        dilated[:, :-1] |= edges[:, 1:]
+        self.grid[dilated] = self.BOUNDARY
+        self._tree = None  # Built on first boundary lookup
+
+    def __repr__(self):
+        return f"(ZoneGrid) {self.shape} cells, {len(self.categories)} zones"
+
+    @property
+    def boundary_fraction(self):
+        """Fraction of cells needing exact polygon tests."""
+        return (self.grid == self.BOUNDARY).mean()
+
+    def lookup(self, points):
+        """Get the zone for each point.
+
+        Parameters
+        ----------
+        points : geopandas.GeoDataFrame or geopandas.GeoSeries
+            Points to look up (e.g., parcel centroids).
+
+        Returns
+        -------
+        pandas.Series
+            Zone value for each point (points index), NaN where not in a zone.
+
+        """
+        if points.crs != self.crs:
+            points = points.to_crs(self.crs)
+        geoms = numpy.asarray(points.geometry.values)
+        coords = shapely.get_coordinates(geoms)
+        assert len(coords) == len(geoms), "Expected one coordinate per point"
+        xmin, ymax = self.bounds[0], self.bounds[3]
+        col = numpy.floor((coords[:, 0] - xmin) / self.resolution).astype("int64")
+        row = numpy.floor((ymax - coords[:, 1]) / self.resolution).astype("int64")
+        inside = (row >= 0) & (row < self.shape[0]) & (col >= 0) & (col < self.shape[1])
+
+        codes = numpy.zeros(len(geoms), dtype="int64")
+        codes[inside] = self.grid[row[inside], col[inside]]
+
+        # Exact polygon tests only for points in boundary cells
+        check = numpy.flatnonzero(codes == self.BOUNDARY)
+        if len(check) > 0:
+            if self._tree is None:
+                self._tree = STRtree(self._geoms)
+            left, right = self._tree.query(geoms[check], predicate="intersects")
+            first = numpy.full(len(check), len(self._geoms))
+            numpy.minimum.at(first, left, right)
+            matched = first < len(self._geoms)
+            codes[check] = 0
+            codes[check[matched]] = self._codes[first[matched]]
+
+        zones = pandas.Series(pandas.Categorical.from_codes(codes - 1, self.categories),
+                              index=points.index,
+                              name="zone")
+        return zones.astype(object)
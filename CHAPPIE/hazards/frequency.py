@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Module to precompute and sample national hazard frequency grids
+"""
+import json
+import math
+import os
+import warnings
+
+import geopandas
+import numpy
+import pandas
+import shapely
+from rasterio.enums import MergeAlg
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
+
+from CHAPPIE import layer_query
+from CHAPPIE.hazards import tornadoes, tropical_cyclones
+
+_grid_crs = 5070  # CONUS Albers equal area
+_conus_bounds = (-2400000, 200000, 2300000, 3200000)  # CONUS in _grid_crs
+_torn_mags = [0, 1, 2, 3, 4, 5]  # Unknown (-9) magnitudes are not counted
+
+
+def _read_tornadoes(tornadoes_gdf, year_range):
+    """Tornado tracks from GeoDataFrame or local index file."""
+    filters = tornadoes._filters(year_range)
+    if isinstance(tornadoes_gdf, str):
+        kwargs = {'filters': filters} if filters else {}
+        return geopandas.read_parquet(tornadoes_gdf, **kwargs)
+    return layer_query.apply_filters(tornadoes_gdf, filters)
+
+
+def _read_cyclones(cyclones_gdf, year_range):
+    """Hurricane tracks from GeoDataFrame or local archive directory."""
+    if isinstance(cyclones_gdf, str):
+        # Storms are selected by first year, so only prune whole decades
+        # (with a year before, for storms that span the new year)
+        if year_range is not None:
+            year_range = (year_range[0] - 1, year_range[1])
+        files = tropical_cyclones._archive_files(cyclones_gdf, year_range)
+        if not files:
+            return geopandas.GeoDataFrame(
+                columns=tropical_cyclones._out_fields + ['geometry'],
+                geometry='geometry',
+                crs=tropical_cyclones._archive_crs)
+        return pandas.concat([geopandas.read_parquet(file) for file in files],
+                             ignore_index=True)
+    return cyclones_gdf
+
+
+def _tornado_layers(tornadoes_gdf):
+    """Tornado footprints (track buffered by half-width) for each layer."""
+    gdf = tornadoes_gdf.to_crs(_grid_crs)
+    gdf = gdf[gdf['mag'].isin(_torn_mags)]
+    radius = numpy.maximum(gdf['wid'].to_numpy(dtype='float64') / 2.188, 1)
+    footprints = shapely.buffer(gdf.geometry.values, radius, quad_segs=2)
+    decades = (gdf['yr'] // 10 * 10).to_numpy()
+    layers = []
+    for mag in _torn_mags:
+        for decade in sorted(set(decades)):
+            mask = (gdf['mag'].to_numpy() == mag) & (decades == decade)
+            layers.append(({'hazard': 'tornado',
+                            'class': f'Magnitude {mag}',
+                            'decade': int(decade)},
+                           footprints[mask]))
+    return layers
+
+
+def _cyclone_layers(cyclones_gdf, year_range, resolution):
+    """Storm footprints (tracks buffered 160934 m) for each layer."""
+    gdf = cyclones_gdf.to_crs(_grid_crs)
+    # One footprint per storm, so overlapping segments count once
+    storms = gdf.groupby('SID').agg(year=('year', 'min'), wind=('USA_WIND', 'max'))
+    if year_range is not None:
+        storms = storms[storms['year'].between(*year_range)]
+    tracks = gdf.geometry.groupby(gdf['SID']).agg(shapely.union_all)
+    tracks = shapely.simplify(tracks.loc[storms.index].values, resolution / 2)
+    footprints = shapely.buffer(tracks, 160934, quad_segs=4)
+    levels = tropical_cyclones._storm_level(storms['wind'])
+    decades = (storms['year'] // 10 * 10).to_numpy()
+    layers = []
+    for code, level in enumerate(tropical_cyclones._storm_levels):
+        for decade in sorted(set(decades)):
+            mask = (levels == code) & (decades == decade)
+            layers.append(({'hazard': 'cyclone',
+                            'class': level,
+                            'decade': int(decade)},
+                           footprints[mask]))
+    return layers
+
+
+def build_grid(out_file, tornadoes_gdf=None, cyclones_gdf=None, resolution=1000,
+               bounds=_conus_bounds, year_range=None, block_rows=256):
+    """Build hazard frequency grid of event counts per cell.
+
+    Counts are by tornado magnitude and storm level, for each decade. A cell
+    counts a tornado its buffered path ('wid' / 2.188) touches and a storm
+    whose 100 mile (160934 meters) buffer covers the cell center. Counts are
+    stored as uint16 in a memory-mappable .npy (rows, cols, layers), so all
+    layers for a cell are contiguous, with layer metadata in a .json sidecar.
+
+    Parameters
+    ----------
+    out_file : str
+        Path for grid (.npy). The sidecar is written next to it (.json).
+    tornadoes_gdf : geopandas.GeoDataFrame or str, optional
+        Tornado tracks or local index from tornadoes.build_index().
+    cyclones_gdf : geopandas.GeoDataFrame or str, optional
+        Hurricane tracks or local archive from tropical_cyclones.build_archive().
+    resolution : int, optional
+        Cell size in meters. The default is 1000.
+    bounds : tuple, optional
+        Grid extent (xmin, ymin, xmax, ymax) in EPSG:5070. The default is CONUS.
+    year_range : tuple, optional
+        Inclusive (start, end) years. The default is None (all years).
+    block_rows : int, optional
+        Rows rasterized at a time. The default is 256.
+
+    Returns
+    -------
+    str
+        out_file.
+
+    """
+    assert tornadoes_gdf is not None or cyclones_gdf is not None, "No hazards"
+    layers = []
+    if tornadoes_gdf is not None:
+        layers += _tornado_layers(_read_tornadoes(tornadoes_gdf, year_range))
+    if cyclones_gdf is not None:
+        layers += _cyclone_layers(_read_cyclones(cyclones_gdf, year_range),
+                                  year_range,
+                                  resolution)
+
+    xmin, ymin, xmax, ymax = bounds
+    rows = math.ceil((ymax - ymin) / resolution)
+    cols = math.ceil((xmax - xmin) / resolution)
+    grid = numpy.lib.format.open_memmap(out_file,
+                                        mode='w+',
+                                        dtype='uint16',
+                                        shape=(rows, cols, len(layers)))
+    shape_bounds = [shapely.bounds(shapes) for _, shapes in layers]
+
+    # Rasterize blocks of rows for all layers, so each block is written once
+    for row in range(0, rows, block_rows):
+        nrows = min(block_rows, rows - row)
+        top = ymax - row * resolution
+        bottom = top - nrows * resolution
+        transform = from_origin(xmin, top, resolution, resolution)
+        block = numpy.zeros((nrows, cols, len(layers)), dtype='uint16')
+        for i, (meta, shapes) in enumerate(layers):
+            ymins, ymaxs = shape_bounds[i][:, 1], shape_bounds[i][:, 3]
+            in_block = (ymins <= top) & (ymaxs >= bottom)
+            if not in_block.any():
+                continue
+            block[:, :, i] = rasterize(shapes[in_block],
+                                       out_shape=(nrows, cols),
+                                       transform=transform,
+                                       fill=0,
+                                       all_touched=meta['hazard'] == 'tornado',
+                                       merge_alg=MergeAlg.add,
+                                       dtype='uint16')
+        grid[row:row + nrows] = block
+    grid.flush()
+    del grid
+
+    sidecar = {'crs': f'EPSG:{_grid_crs}',
+               'bounds': list(bounds),
+               'resolution': resolution,
+               'shape': [rows, cols],
+               'layers': [meta for meta, _ in layers]}
+    with open(os.path.splitext(out_file)[0] + '.json', 'w') as f:
+        json.dump(sidecar, f, indent=1)
+    return out_file
+
+
+class FrequencyGrid(object):
+    """Hazard frequency grid from build_grid(), memory-mapped for sampling.
+
+    Parameters
+    ----------
+    grid_file : str
+        Grid (.npy) from build_grid().
+    """
+
+    def __init__(self, grid_file):
+        with open(os.path.splitext(grid_file)[0] + '.json') as f:
+            sidecar = json.load(f)
+        self.crs = sidecar['crs']
+        self.bounds = sidecar['bounds']
+        self.resolution = sidecar['resolution']
+        self.layers = pandas.DataFrame(sidecar['layers'])
+        self.grid = numpy.load(grid_file, mmap_mode='r')
+
+    def __repr__(self):
+        return f"(FrequencyGrid) {self.grid.shape[:2]} cells, {len(self.layers)} layers"
+
+    def sample(self, points, hazard=None, year_range=None):
+        """Get event counts per layer at points.
+
+        Parameters
+        ----------
+        points : geopandas.GeoDataFrame or geopandas.GeoSeries
+            Points (e.g., parcel centroids). Other geometries use centroids.
+        hazard : str, optional
+            'tornado' or 'cyclone'. The default is None (both).
+        year_range : tuple, optional
+            Inclusive (start, end) years, decades overlapping are kept.
+            The default is None (all decades).
+
+        Returns
+        -------
+        pandas.DataFrame
+            Counts for each point (points index) with columns for each layer
+            (hazard, class, decade). Points outside the grid are NaN.
+
+        """
+        keep = numpy.ones(len(self.layers), dtype=bool)
+        if hazard is not None:
+            keep &= (self.layers['hazard'] == hazard).to_numpy()
+        if year_range is not None:
+            keep &= ((self.layers['decade'] + 9 >= year_range[0]) &
+                     (self.layers['decade'] <= year_range[1])).to_numpy()
+        layer_idx = numpy.flatnonzero(keep)
+
+        geoms = points.to_crs(self.crs).geometry
+        if not (geoms.geom_type == 'Point').all():
+            geoms = geoms.centroid
+        coords = shapely.get_coordinates(geoms.values)
+        xmin, ymax = self.bounds[0], self.bounds[3]
+        col = numpy.floor((coords[:, 0] - xmin) / self.resolution).astype('int64')
+        row = numpy.floor((ymax - coords[:, 1]) / self.resolution).astype('int64')
+        inside = ((row >= 0) & (row < self.grid.shape[0]) &
+                  (col >= 0) & (col < self.grid.shape[1]))
+        if not inside.all():
+            warnings.warn(f"{(~inside).sum()} points outside grid")
+
+        counts = numpy.full((len(coords), len(layer_idx)), numpy.nan)
+        # Read cells in row order so memory-mapped reads are sequential
+        order = numpy.flatnonzero(inside)
+        order = order[numpy.lexsort((col[order], row[order]))]
+        cells = self.grid[row[order], col[order]]
+        counts[order] = cells[:, layer_idx]
+
+        columns = pandas.MultiIndex.from_frame(self.layers.iloc[layer_idx])
+        return pandas.DataFrame(counts, index=points.index, columns=columns)
@@ -3,7 +3,8 @@ Module for technological hazards
 
 @author: thultgre
 """
-from CHAPPIE import layer_query
+from CHAPPIE import layer_query, utils
+from CHAPPIE.aoi import AOI
 
 def get_superfund_npl(aoi):
     """Get Superfund NPL sites within AOI.
@@ -21,13 +22,14 @@ def get_superfund_npl(aoi):
     """
 
     url = 'https://services.arcgis.com/cJ9YHowT8TU7DUyn/ArcGIS/rest/services/FAC_Superfund_Site_Boundaries_EPA_Public/FeatureServer'
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
     
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_FRS_ACRES(aoi):
     """ Get EPA's Facility Registry Service (FRS) sites that link
@@ -48,13 +50,14 @@ def get_FRS_ACRES(aoi):
  
     url = 'https://services.arcgis.com/cJ9YHowT8TU7DUyn/ArcGIS/rest/services/FRS_INTERESTS_ACRES/FeatureServer'
    
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
    
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_landfills(aoi):
     """ Get landfills for Area Of Interest (AOI).
@@ -73,13 +76,14 @@ def get_landfills(aoi):
  
     url = 'https://services.arcgis.com/cJ9YHowT8TU7DUyn/ArcGIS/rest/services/EPA_Disaster_Debris_Recovery_Data/FeatureServer'
    
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
    
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
+                                in_crs=aoi.epsg)
 
 def get_tri(aoi):
     """ Get TRI Reporting Facilities for Area Of Interest (AOI).
@@ -98,10 +102,38 @@ def get_tri(aoi):
  
     url = 'https://gispub.epa.gov/arcgis/rest/services/OCSPP/TRI_Reporting_Facilities/MapServer/'
    
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
    
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg())
\ No newline at end of file
+                                in_crs=aoi.epsg)
+
+
+def get_all(aoi, max_workers=None, errors="raise"):
+    """Get all technological hazards for Area Of Interest (AOI) concurrently.
+
+    Parameters
+    ----------
+    aoi : geopandas.GeoDataFrame
+        Spatial definition for Area Of Interest (AOI).
+    max_workers : int, optional
+        Max concurrent requests. The default is None (one per layer).
+    errors : str, optional
+        "raise" to raise the first failed request or "warn" to warn and leave
+        failed layers out. The default is "raise".
+
+    Returns
+    -------
+    dict
+        GeoDataFrame for each technological hazard.
+
+    """
+    getters = {"superfund": get_superfund_npl,
+               "brownfields": get_FRS_ACRES,
+               "landfills": get_landfills,
+               "tri": get_tri}
+    return utils.fetch_many(aoi, getters, max_workers, extent_only=True,
+                            errors=errors)
@@ -6,11 +6,19 @@ Module to query and process tornadoe hazards
 """
 import math
 import os
+from urllib.parse import quote
 
 import geopandas
+import numpy
 import pandas
+import shapely
+from shapely import STRtree
 
-from CHAPPIE import layer_query, utils
+from CHAPPIE import join, layer_query, utils
+
+_out_fields = ['yr', 'date', 'om', 'mag', 'wid']  # Fields returned by get_tornadoes
+_index_crs = 4326  # CRS for local tornado index
+_index_cache = {}  # {index_file: (mtime, filter fields and wid)}
 
 
 def get_tornadoes_all(out_dir, component='torn-aspath', years='1950-2022'):
@@ -51,15 +59,8 @@ def get_tornadoes_all(out_dir, component='torn-aspath', years='1950-2022'):
     return geopandas.read_file(f'{out_dir}{sub_dir}{sub_dir}.shp')
 
 
-def max_buffer():
-    """ Get max buffer based on max wid value in service for all records.
-
-    Returns
-    -------
-    int
-        Max buffer needed for any track in tornado tracks service.
-
-    """
+def _max_wid(where=None, group_by=None):
+    """Max wid from tornado tracks service, optionally for each group_by value."""
     baseurl = 'https://services2.arcgis.com/FiaPA4ga0iQKduv3/ArcGIS/rest/services/'
     #url_pnts = f'{baseurl}Tornadoes_1950_2017_1/FeatureServer'
     url = f'{baseurl}Tornado_Tracks_1950_2017_1/FeatureServer'  # same as above
@@ -73,16 +74,181 @@ def max_buffer():
                         "outStatisticFieldName": "max_wid"
                     }],
                     'returnGeometry': "false"}
-    query_response = feature_layer.query(**query_params)
-    return math.ceil(query_response['max_wid']/ 2.188)
+    if where:
+        query_params['where'] = quote(where)
+    if group_by:
+        query_params['groupByFieldsForStatistics'] = group_by
+    return feature_layer.query(**query_params)
+
+
+def max_buffer(where=None):
+    """ Get max buffer based on max wid value in service for all records.
+
+    Parameters
+    ----------
+    where : str, optional
+        SQL where clause to limit records. The default is None (all records).
+
+    Returns
+    -------
+    int
+        Max buffer needed for any track in tornado tracks service.
+
+    """
+    query_response = _max_wid(where)
+    if len(query_response) == 0:
+        return 0  # No records meet where
+    return math.ceil(query_response['max_wid'].max()/ 2.188)
+
+
+def _magnitude_buffers(where=None):
+    """Max buffer for tracks of each magnitude in service, {mag: buffer}."""
+    query_response = _max_wid(where, group_by='mag')
+    if len(query_response) == 0:
+        return {}  # No records meet where
+    return {int(mag): math.ceil(wid / 2.188)
+            for mag, wid in zip(query_response['mag'], query_response['max_wid'])}
+
+def build_index(tornadoes_gdf, out_file, row_group_size=2000):
+    """Write tornado tracks to a local GeoParquet index for get_tornadoes().
+
+    Tracks are sorted along a Hilbert curve and written with bbox covering
+    columns so reads filtered by bbox only touch nearby row groups.
+
+    Parameters
+    ----------
+    tornadoes_gdf : geopandas.GeoDataFrame
+        Tornado tracks, e.g., from get_tornadoes_all().
+    out_file : str
+        Path for the GeoParquet index (.parquet).
+    row_group_size : int, optional
+        Tracks per row group. The default is 2000.
+
+    Returns
+    -------
+    str
+        out_file.
+
+    """
+    missing = set(_out_fields) - set(tornadoes_gdf.columns)
+    assert not missing, f"Columns missing: {', '.join(missing)}"
+    gdf = tornadoes_gdf[_out_fields + ['geometry']].to_crs(_index_crs)
+    gdf = gdf[~(gdf.geometry.isna() | gdf.geometry.is_empty)]
+    # Match service types
+    gdf['date'] = pandas.to_datetime(gdf['date']).astype('datetime64[ms]')
+    gdf = gdf.astype({'yr': 'int32', 'om': 'int32', 'mag': 'int32', 'wid': 'int32'})
+    # Sort along space-filling curve so row groups are spatially compact
+    gdf = gdf.iloc[gdf.geometry.hilbert_distance().argsort()]
+    gdf.reset_index(drop=True).to_parquet(out_file,
+                                          write_covering_bbox=True,
+                                          row_group_size=row_group_size)
+    return out_file
+
+
+def _filters(year_range=None, min_magnitude=None):
+    """Filters as (field, operator, value) for years and magnitude."""
+    filters = []
+    if year_range is not None:
+        filters += [('yr', '>=', int(year_range[0])), ('yr', '<=', int(year_range[1]))]
+    if min_magnitude is not None:
+        filters.append(('mag', '>=', int(min_magnitude)))
+    return filters
+
+
+def _index_attributes(index_file):
+    """Filter fields and wid for local index, read once per file version."""
+    key = os.path.abspath(index_file)
+    mtime = os.path.getmtime(index_file)
+    if key not in _index_cache or _index_cache[key][0] != mtime:
+        df = pandas.read_parquet(index_file, columns=['yr', 'mag', 'wid'])
+        _index_cache[key] = (mtime, df)
+    return _index_cache[key][1]
 
-def get_tornadoes(aoi):
+
+def _index_query(aoi, buff_dist_m):
+    """Get bbox for local index (4326) and exact query geometry (aoi.crs)."""
+    query_crs = layer_query.getCRSUnits(aoi.crs)
+    assert query_crs == 'm', f"Expected units to be meters, found {query_crs}"
+    xmin, ymin, xmax, ymax = aoi.total_bounds
+    query_geom = shapely.box(xmin, ymin, xmax, ymax)
+    search = geopandas.GeoSeries([query_geom.buffer(buff_dist_m)], crs=aoi.crs)
+    bbox = tuple(search.to_crs(_index_crs).total_bounds)
+    return bbox, query_geom
+
+
+def _index_select(candidates, aoi, query_geom, buff_dist_m, filters):
+    """Exact distance and attribute filters on tracks read from local index."""
+    candidates = layer_query.apply_filters(candidates, filters)
+    dist = candidates.geometry.to_crs(aoi.crs).distance(query_geom)
+    return candidates[(dist <= buff_dist_m).values].reset_index(drop=True)
+
+
+class TornadoIndex(object):
+    """Local tornado track index held in memory for repeated AOI queries.
+
+    Parameters
+    ----------
+    index_file : str
+        GeoParquet index from build_index().
+    """
+
+    def __init__(self, index_file):
+        self.gdf = geopandas.read_parquet(index_file,
+                                          columns=_out_fields + ['geometry'])
+        self.tree = STRtree(self.gdf.geometry.values)
+        self.max_buffer = math.ceil(self.gdf['wid'].max() / 2.188)
+
+    def __repr__(self):
+        return f"(TornadoIndex) {len(self.gdf)} tracks"
+
+    def query(self, aoi, buff_dist_m=None, year_range=None, min_magnitude=None):
+        """Get tornado tracks within buff_dist_m meters of AOI extent.
+
+        Parameters
+        ----------
+        aoi : geopandas.GeoDataFrame
+            Area of interest to get tornadoes for. CRS must be in meters.
+        buff_dist_m : int, optional
+            Search distance around AOI extent. The default is None, using the
+            max buffer needed for any track in the index.
+        year_range : tuple, optional
+            Inclusive (start, end) years. The default is None (all years).
+        min_magnitude : int, optional
+            Minimum magnitude. The default is None (all magnitudes).
+
+        Returns
+        -------
+        geopandas.GeoDataFrame
+            Tornado tracks (lines) in raw format.
+
+        """
+        if buff_dist_m is None:
+            buff_dist_m = self.max_buffer
+        bbox, query_geom = _index_query(aoi, buff_dist_m)
+        idx = self.tree.query(shapely.box(*bbox))
+        candidates = self.gdf.iloc[sorted(idx)]
+        filters = _filters(year_range, min_magnitude)
+        return _index_select(candidates, aoi, query_geom, buff_dist_m, filters)
+
+
+def get_tornadoes(aoi, index=None, year_range=None, min_magnitude=None):
     """ Get tornaodes for area of interest
 
+    Filters are applied before download, as a where clause for the service or
+    as parquet filters for a local index. The service is queried once for each
+    magnitude, buffered by the widest track of that magnitude.
+
     Parameters
     ----------
     aoi : geopandas.GeoDataFrame
         area of interest to get tornadoes for
+    index : str or TornadoIndex, optional
+        Local tornado index, either GeoParquet from build_index() or a loaded
+        TornadoIndex. The default is None and queries the tornado tracks service.
+    year_range : tuple, optional
+        Inclusive (start, end) years. The default is None (all years).
+    min_magnitude : int, optional
+        Minimum magnitude. The default is None (all magnitudes).
 
     Returns
     -------
@@ -90,11 +256,27 @@ def get_tornadoes(aoi):
         Tornado tracks (lines) in raw format.
 
     """
+    if isinstance(index, TornadoIndex):
+        return index.query(aoi, year_range=year_range, min_magnitude=min_magnitude)
+    filters = _filters(year_range, min_magnitude)
+    if index is not None:
+        kwargs = {'filters': filters} if filters else {}
+        # Buffer for widest track meeting filters
+        wid = layer_query.apply_filters(_index_attributes(index), filters)['wid']
+        buff_dist_m = math.ceil(wid.max() / 2.188) if len(wid) else 0
+        bbox, query_geom = _index_query(aoi, buff_dist_m)
+        candidates = geopandas.read_parquet(index,
+                                            columns=_out_fields + ['geometry'],
+                                            bbox=bbox,
+                                            **kwargs)
+        return _index_select(candidates, aoi, query_geom, buff_dist_m, filters)
+
     baseurl = 'https://services2.arcgis.com/FiaPA4ga0iQKduv3/ArcGIS/rest/services/'
     #url_pnts = f'{baseurl}Tornadoes_1950_2017_1/FeatureServer'
     url = f'{baseurl}Tornado_Tracks_1950_2017_1/FeatureServer'
 
-    max_buff = max_buffer()
+    # Widest track for each magnitude meeting filters
+    buffers = _magnitude_buffers(layer_query.get_where(filters))
     # NOTE: assumes aoi_gdf in meters
     # TODO: assert aoi.crs in meters
     query_crs = layer_query.getCRSUnits(aoi.crs)
@@ -103,10 +285,17 @@ def get_tornadoes(aoi):
     #bbox = [xmin-max_buff, xmax+max_buff, ymin-max_buff, ymax+max_buff]
     #bbox = [xmin, xmax, ymin, ymax]
     bbox = [xmin, ymin, xmax,  ymax]
-    out_fields = ['yr', 'date', 'om', 'mag', 'wid']
     in_crs = aoi.crs.to_authority()[1]  # epsg or esri identifier
 
-    return layer_query.get_bbox(bbox, url, 0, out_fields, in_crs, max_buff)
+    # Fetch each magnitude with its own buffer, not the widest of all tracks
+    results = []
+    for mag, buff_dist_m in sorted(buffers.items()):
+        where = layer_query.get_where(filters + [('mag', '=', mag)])
+        results.append(layer_query.get_bbox(bbox, url, 0, _out_fields, in_crs,
+                                            buff_dist_m, where=where))
+    if not results:
+        return geopandas.GeoDataFrame(columns=_out_fields, geometry=[], crs=aoi.crs)
+    return pandas.concat(results, ignore_index=True)
 
 
 def process_tornadoes(tornadoes_gdf, aoi):
@@ -143,3 +332,63 @@ def process_tornadoes(tornadoes_gdf, aoi):
                    'mag': 'Magnitude'}
 
     return torn_path_aoi.rename(columns=update_cols)
+
+
+def get_exposure(tornadoes_gdf, parcels, chunk_size=100000):
+    """Get tornado exposure per parcel without buffering tracks.
+
+    A parcel is exposed to a track when its distance to the track line is
+    within the track half-width ('wid' / 2.188), the same footprint as the
+    buffered paths from process_tornadoes().
+
+    Parameters
+    ----------
+    tornadoes_gdf : geopandas.GeoDataFrame
+        Tornado tracks (lines) in raw format.
+    parcels : geopandas.GeoDataFrame
+        Parcel polygons or points. CRS must be in meters.
+    chunk_size : int, optional
+        Number of parcels per tree query. The default is 100000.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Exposure for each parcel (parcels index): count of tracks ('TornCount')
+        and max magnitude ('MaxMagnitude', NaN if none or unknown).
+
+    """
+    query_crs = layer_query.getCRSUnits(parcels.crs)
+    assert query_crs == 'm', f"Expected units to be meters, found {query_crs}"
+    tracks = tornadoes_gdf.to_crs(parcels.crs)
+    radius = tracks['wid'].to_numpy(dtype='float64') / 2.188
+
+    # Prefilter tracks by bbox distance to parcels extent
+    xmin, ymin, xmax, ymax = parcels.total_bounds
+    bounds = tracks.bounds.to_numpy()
+    dx = numpy.maximum.reduce([bounds[:, 0] - xmax, xmin - bounds[:, 2],
+                               numpy.zeros(len(bounds))])
+    dy = numpy.maximum.reduce([bounds[:, 1] - ymax, ymin - bounds[:, 3],
+                               numpy.zeros(len(bounds))])
+    keep = numpy.flatnonzero(numpy.hypot(dx, dy) <= radius)
+
+    count = numpy.zeros(len(parcels), dtype='int64')
+    max_mag = numpy.full(len(parcels), numpy.nan)
+    if len(keep) > 0:
+        track_geoms = tracks.geometry.values[keep]
+        track_radius = radius[keep]
+        # Unknown magnitude (-9) is ignored in max
+        track_mag = tracks['mag'].to_numpy(dtype='float64')[keep]
+        track_mag[track_mag < 0] = numpy.nan
+        tree = STRtree(track_geoms)
+        geoms = numpy.asarray(parcels.geometry.values)
+        for left, right in join.query_pairs(tree, geoms, "dwithin",
+                                            track_radius.max(), chunk_size):
+            # Exact per-pair test against each track's own half-width
+            dist = shapely.distance(geoms[left], track_geoms[right])
+            hit = dist <= track_radius[right]
+            left, right = left[hit], right[hit]
+            numpy.add.at(count, left, 1)
+            numpy.fmax.at(max_mag, left, track_mag[right])
+
+    return pandas.DataFrame({'TornCount': count, 'MaxMagnitude': max_mag},
+                            index=parcels.index)
@@ -8,17 +8,127 @@ Module to query and process tropical cyclone hazards
 import os
 
 import geopandas
+import numpy
+import pandas
+import shapely
+from shapely import STRtree
 
-from CHAPPIE import layer_query, utils
+from CHAPPIE import join, layer_query, utils
 
+# Saffir-Simpson wind (kts) bins and storm levels, wind >= bin is next level
+_wind_bins = [34, 64, 83, 96, 113, 137]
+_storm_levels = ["Tropical Depression", "Tropical Storm", "Category 1",
+                 "Category 2", "Category 3", "Category 4", "Category 5"]
+# Fields returned by get_cyclones
+_out_fields = ['SID', 'NAME', 'USA_WIND', 'USA_PRES', 'year', 'month', 'day']
+_archive_crs = 4326  # CRS for local archive
 
-def get_cyclones(aoi):
+
+def _storm_level(wind):
+    """Storm level code (index in _storm_levels) for wind speeds (kts).
+
+    Note: missing wind speeds are treated as Category 5.
+    """
+    return numpy.digitize(numpy.asarray(wind, dtype="float64"), _wind_bins)
+
+
+def build_archive(cyclones_gdf, out_dir, row_group_size=1000):
+    """Write hurricane tracks to a local archive for get_cyclones().
+
+    Tracks are written as GeoParquet, one file per basin and decade
+    (out_dir/<BASIN>/<decade>.parquet). Each file is sorted along a Hilbert
+    curve with bbox covering columns and small row groups, so reads filtered
+    by bbox and year only touch nearby row groups.
+
+    Parameters
+    ----------
+    cyclones_gdf : geopandas.GeoDataFrame
+        Hurricane tracks, e.g., lines from get_cyclones_all().
+    out_dir : str
+        Directory for the archive.
+    row_group_size : int, optional
+        Track segments per row group. The default is 1000.
+
+    Returns
+    -------
+    list
+        Archive files written.
+
+    """
+    missing = set(_out_fields + ['BASIN']) - set(cyclones_gdf.columns)
+    assert not missing, f"Columns missing: {', '.join(missing)}"
+    gdf = cyclones_gdf[_out_fields + ['BASIN', 'geometry']].to_crs(_archive_crs)
+    gdf = gdf[~(gdf.geometry.isna() | gdf.geometry.is_empty)]
+    # Match service types where there are no missing values
+    for col in ['USA_WIND', 'USA_PRES', 'year', 'month', 'day']:
+        if not gdf[col].isna().any():
+            gdf[col] = gdf[col].astype('int32')
+    gdf['BASIN'] = gdf['BASIN'].fillna('MM')  # IBTrACS missing basin
+    decades = (gdf['year'] // 10 * 10).astype(int)
+
+    out_files = []
+    for (basin, decade), part in gdf.groupby(['BASIN', decades]):
+        os.makedirs(os.path.join(out_dir, basin), exist_ok=True)
+        out_file = os.path.join(out_dir, basin, f'{decade}.parquet')
+        # Sort along space-filling curve so row groups are spatially compact
+        part = part.iloc[part.geometry.hilbert_distance().argsort()]
+        part.reset_index(drop=True).to_parquet(out_file,
+                                               write_covering_bbox=True,
+                                               row_group_size=row_group_size)
+        out_files.append(out_file)
+    return out_files
+
+
+def _filters(year_range=None, min_wind=None):
+    """Filters as (field, operator, value) for years and wind speed."""
+    filters = []
+    if year_range is not None:
+        filters += [('year', '>=', int(year_range[0])),
+                    ('year', '<=', int(year_range[1]))]
+    if min_wind is not None:
+        filters.append(('USA_WIND', '>=', min_wind))
+    return filters
+
+
+def _archive_files(archive, year_range=None, basins=None):
+    """Archive files for basins with decades overlapping year_range."""
+    files = []
+    for basin in sorted(os.listdir(archive)):
+        basin_dir = os.path.join(archive, basin)
+        if not os.path.isdir(basin_dir) or (basins and basin not in basins):
+            continue
+        for file in sorted(os.listdir(basin_dir)):
+            decade, ext = os.path.splitext(file)
+            if ext != '.parquet':
+                continue
+            if year_range is not None:
+                if int(decade) + 9 < year_range[0] or int(decade) > year_range[1]:
+                    continue
+            files.append(os.path.join(basin_dir, file))
+    return files
+
+
+def get_cyclones(aoi, archive=None, year_range=None, min_wind=None, basins=None):
     """Get hurricane tracks within 100 miles (160934 meters) of  AOI.
 
+    Filters are applied before download, as a where clause for the service or
+    as parquet filters for a local archive.
+
     Parameters
     ----------
     aoi : geopandas.GeoDataFrame
         Spatial definition for Area Of Interest (AOI).
+    archive : str, optional
+        Local archive directory from build_archive(). The default is None
+        and queries the IBTrACS lines service.
+    year_range : tuple, optional
+        Inclusive (start, end) years. The default is None (all years).
+    min_wind : int, optional
+        Minimum track segment wind speed (USA_WIND, kts). The default is None
+        (all segments).
+    basins : list, optional
+        IBTrACS basins (e.g., ['NA', 'EP']) to read from archive. The default
+        is None (all basins).
 
     Returns
     -------
@@ -36,14 +146,33 @@ def get_cyclones(aoi):
 
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax,  ymax]
-    out_fields = ['SID', 'NAME', 'USA_WIND', 'USA_PRES', 'year', 'month', 'day']
+
+    filters = _filters(year_range, min_wind)
+    if archive is not None:
+        # Read row groups overlapping buffered extent, then exact distance
+        query_geom = shapely.box(*bbox)
+        search = geopandas.GeoSeries([query_geom.buffer(max_buff)], crs=aoi.crs)
+        kwargs = {'bbox': tuple(search.to_crs(_archive_crs).total_bounds)}
+        if filters:
+            kwargs['filters'] = filters
+        columns = _out_fields + ['geometry']
+        parts = [geopandas.read_parquet(file, columns=columns, **kwargs)
+                 for file in _archive_files(archive, year_range, basins)]
+        if not parts:
+            return geopandas.GeoDataFrame(columns=columns,
+                                          geometry='geometry',
+                                          crs=_archive_crs)
+        cyclones_gdf = pandas.concat(parts, ignore_index=True)
+        dist = cyclones_gdf.geometry.to_crs(aoi.crs).distance(query_geom)
+        return cyclones_gdf[(dist <= max_buff).values].reset_index(drop=True)
 
     return layer_query.get_bbox(bbox,
                                 url,
                                 0,
-                                out_fields,
+                                _out_fields,
                                 aoi.crs.to_authority()[1],
-                                buff_dist_m = max_buff)
+                                buff_dist_m = max_buff,
+                                where=layer_query.get_where(filters))
 
 
 def process_cyclones(cyclones_gdf, aoi):
@@ -79,15 +208,12 @@ def process_cyclones(cyclones_gdf, aoi):
     # Fix up fields
     cyclones_gdf.reset_index(inplace=True)
     # Add storm level
-    cyclones_gdf['StormLevel'] = "Category 5"
-    cyclones_gdf.loc[cyclones_gdf.USA_WIND < 137, 'StormLevel'] = "Category 4"
-    cyclones_gdf.loc[cyclones_gdf.USA_WIND < 113, 'StormLevel'] = "Category 3"
-    cyclones_gdf.loc[cyclones_gdf.USA_WIND < 96, 'StormLevel'] = "Category 2"
-    cyclones_gdf.loc[cyclones_gdf.USA_WIND < 83, 'StormLevel'] = "Category 1"
-    cyclones_gdf.loc[cyclones_gdf.USA_WIND < 64, 'StormLevel'] = "Tropical Storm"
-    cyclones_gdf.loc[cyclones_gdf.USA_WIND < 34, 'StormLevel'] = "Tropical Depression"
+    levels = numpy.array(_storm_levels, dtype=object)
+    cyclones_gdf['StormLevel'] = levels[_storm_level(cyclones_gdf['USA_WIND'])]
     # Date
-    cyclones_gdf['Date'] = [f'{row.year}-{row.month}-{row.day}' for _, row in cyclones_gdf.iterrows()]
+    cyclones_gdf['Date'] = (cyclones_gdf['year'].astype(str) + '-' +
+                            cyclones_gdf['month'].astype(str) + '-' +
+                            cyclones_gdf['day'].astype(str))
     # Rename cols
     update_cols = {'SID': 'SID',
                    'year': 'Year',
@@ -98,6 +224,73 @@ def process_cyclones(cyclones_gdf, aoi):
     return cyclones_gdf.rename(columns=update_cols)
 
 
+def get_exposure(cyclones_gdf, parcels, buff_dist_m=160934, chunk_size=10000):
+    """Get hurricane exposure per parcel without buffering tracks.
+
+    A parcel is exposed to a storm when it is within buff_dist_m of any of the
+    storm's track segments, the same footprint as the buffered paths from
+    process_cyclones(). As there, storm wind speed is the max for the storm.
+
+    Parameters
+    ----------
+    cyclones_gdf : geopandas.GeoDataFrame
+        GeoDataFrame for hurricane tracks, e.g., from get_cyclones().
+    parcels : geopandas.GeoDataFrame
+        Parcel polygons or points. CRS must be in meters.
+    buff_dist_m : int, optional
+        Distance from track in meters. The default is 160934 (100 miles).
+    chunk_size : int, optional
+        Number of parcels per tree query. The default is 10000.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Exposure for each parcel (parcels index): count of storms
+        ('StormCount'), max storm wind ('MaxWindSpdKts') and max storm level
+        ('MaxStormLevel', None if no storms).
+
+    """
+    query_crs = layer_query.getCRSUnits(parcels.crs)
+    assert query_crs == 'm', f"Expected units to be meters, found {query_crs}"
+    tracks = cyclones_gdf.to_crs(parcels.crs)
+    # Storm wind is max for all segments
+    storm_code, storms = pandas.factorize(tracks['SID'])
+    storm_wind = pandas.Series(tracks['USA_WIND'].to_numpy(dtype='float64')).groupby(
+        storm_code).max().reindex(range(len(storms))).to_numpy()
+    storm_level = _storm_level(storm_wind)
+
+    # Prefilter segments by bbox distance to parcels extent
+    xmin, ymin, xmax, ymax = parcels.total_bounds
+    bounds = tracks.bounds.to_numpy()
+    dx = numpy.maximum.reduce([bounds[:, 0] - xmax, xmin - bounds[:, 2],
+                               numpy.zeros(len(bounds))])
+    dy = numpy.maximum.reduce([bounds[:, 1] - ymax, ymin - bounds[:, 3],
+                               numpy.zeros(len(bounds))])
+    keep = numpy.flatnonzero(numpy.hypot(dx, dy) <= buff_dist_m)
+
+    count = numpy.zeros(len(parcels), dtype='int64')
+    max_wind = numpy.full(len(parcels), numpy.nan)
+    max_level = numpy.full(len(parcels), -1, dtype='int64')
+    if len(keep) > 0:
+        tree = STRtree(tracks.geometry.values[keep])
+        segment_storm = storm_code[keep]
+        geoms = numpy.asarray(parcels.geometry.values)
+        for left, right in join.query_pairs(tree, geoms, "dwithin",
+                                            buff_dist_m, chunk_size):
+            # Unique (parcel, storm) pairs
+            pairs = numpy.unique(left * len(storms) + segment_storm[right])
+            left, storm = numpy.divmod(pairs, len(storms))
+            numpy.add.at(count, left, 1)
+            numpy.fmax.at(max_wind, left, storm_wind[storm])
+            numpy.maximum.at(max_level, left, storm_level[storm])
+
+    levels = numpy.array(_storm_levels + [None], dtype=object)  # -1 is None
+    return pandas.DataFrame({'StormCount': count,
+                             'MaxWindSpdKts': max_wind,
+                             'MaxStormLevel': levels[max_level]},
+                            index=parcels.index)
+
+
 def get_cyclones_all(out_dir, dataset=['lines', 'points']):
     """Get all hurricane points or tracks.
 
@@ -119,9 +312,10 @@ def get_cyclones_all(out_dir, dataset=['lines', 'points']):
     results = []  # use named tuple instead?
     for data in dataset:
         url = f'{base_url}IBTrACS.ALL.list.v04r00.{data}.zip'
-        temp = os.path.join(out_dir, f"{data}_temp.zip")  # temp zip out_file
-        utils.get_zip(url, temp)  # Download & extract zip
         shp = os.path.join(out_dir, f"IBTrACS.ALL.list.v04r00.{data}.shp")
+        if not os.path.exists(shp):  # Download & extract zip if needed
+            temp = os.path.join(out_dir, f"{data}_temp.zip")  # temp zip out_file
+            utils.get_zip(url, temp)
         results.append(geopandas.read_file(shp))
 
     if len(results)==1:
@@ -5,18 +5,71 @@ Get weather related natural hazards data
 @author: jbousqui
 """
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from warnings import warn
 
 import pandas
 
 from CHAPPIE import layer_query, utils
 
 _EPH_URL = "https://ephtracking.cdc.gov/apigateway/api/v1"
+_EPH_limiter = utils.RateLimiter(per_second=2)  # Shared by all EPH requests
+
+def _default_localIDs(stratificationLevelId):
+    """Default localIDs (daily max heat index, 90th percentile or 90 F)."""
+    localIDs={}
+    localIDs["TemperatureHeatIndexId"] = 2
+    # 1: Daily Maximum Temperature
+    # 2: Daily Maximum Heat Index
+    if stratificationLevelId == 2195:
+        localIDs["AbsoluteThresholdId"] = 1
+        # 1: 90 degrees F
+        # 2: 95 degrees F
+        # 3: 100 degrees F
+        # 4: 105 degrees F
+    else:
+        localIDs["RelativeThresholdId"] = 1
+        # 1: 90th Percentile
+        # 2: 95th Percentile
+        # 3: 98th Percentile
+        # 4: 99th Percentile
+    return localIDs
+
+
+def _heat_request(url, tracts, years):
+    """Request one chunk of tracts for years, None if request failed."""
+    # Request as post
+    params = {"geographicTypeIdFilter": "7",  # Census Tract
+              "geographicItemsFilter": ",".join(tracts),
+              "temporalTypeIdFilter": "1",
+              "temporalItemsFilter": ",".join(years),
+              }
+    headers = {"Content-Type": "application/json"}
+    res = utils.post_request(url,
+                             json.dumps(params),
+                             headers=headers,
+                             limiter=_EPH_limiter)
+    if 'tableResult' not in res:
+        warn(f"Heat events request failed for {len(tracts)} tracts: "
+             f"{res.get('status')}")
+        return None
+    # TODO: response seems to contain metadata and results (split)
+    return pandas.DataFrame(res['tableResult'])
+
 
-def get_heat_events(aoi, stratificationLevelId=2194, localIDs=None, years=["2023"]):
+def get_heat_events(aoi, stratificationLevelId=2194, localIDs=None, years=["2023"],
+                    chunk_size=50, max_workers=4, cache_dir=None):
     """get tract level heat event information.
 
     MetricID 1427: Annual Number of Extreme Heat Days (Full Year)
 
+    Tracts are requested in chunks, concurrently under a shared rate limit.
+    Every combination of stratificationLevelId and localIDs is fetched as
+    one plan and, when more than one, identified by added columns for
+    stratificationLevelId and each localIDs key.
+
     Note: this is currently set up to work with defaults but the API is very
     restrictive and will just return empty results for non-complimentary params.
 
@@ -24,13 +77,22 @@ def get_heat_events(aoi, stratificationLevelId=2194, localIDs=None, years=["2023
     ----------
     aoi : geopandas.GeoDataFrame
         Area of Interest as GeoDataFrame.
-    stratificationLevelId : int, optional
+    stratificationLevelId : int or list, optional
         Stratification IDs, default 2194 for Relative Threshold, use 2195
         instead for Absolute Threshold.
-    localIDs : dict, optional
-        Dict where Key is columnName and value is localId
+    localIDs : dict or list, optional
+        Dict (or list of dicts) where Key is columnName and value is localId.
+        The default is None, with defaults for each stratificationLevelId.
     years : list, optional
         List of years as string, default is for 2023 (current latest year).
+    chunk_size : int, optional
+        Tracts per request. The default is 50.
+    max_workers : int, optional
+        Max concurrent requests. The default is 4.
+    cache_dir : str, optional
+        Directory to cache results by tract, year and stratification, so only
+        missing ones are requested. The default is None (no cache).
+
     Returns
     -------
     pandas.DataFrame
@@ -47,63 +109,65 @@ def get_heat_events(aoi, stratificationLevelId=2194, localIDs=None, years=["2023
     # 2195: State x Census Tract x Temperature/Heat Index x Absolute Threshold
 
     # localIDs from type 22: f"{_EPH_URL}/stratificationtypes/1427/7/0}"
-    if not localIDs:
-        localIDs={}
-        localIDs["TemperatureHeatIndexId"] = 2
-        # 1: Daily Maximum Temperature
-        # 2: Daily Maximum Heat Index
-        # if 2194 use:
-        localIDs["RelativeThresholdId"] = 1
-        # 1: 90th Percentile
-        # 2: 95th Percentile
-        # 3: 98th Percentile
-        # 4: 99th Percentile
-        # if 2195 use:
-        # AbsoluteThresholdId = 1
-        # 1: 90 degrees F
-        # 2: 95 degrees F
-        # 3: 100 degrees F
-        # 4: 105 degrees F
-    localIDs_str = "&".join([f"{k}={v}" for k, v in localIDs.items()])
-    #TemperatureHeatIndexId=2&RelativeThresholdId=1
-
-
-    # Construct url for request
-    EPH_url = f"{_EPH_URL}/getCoreHolder/{measureId}/{stratificationLevelId}"
+    if not isinstance(stratificationLevelId, list):
+        stratificationLevelId = [stratificationLevelId]
+    if isinstance(localIDs, dict):
+        localIDs = [localIDs]
+    if localIDs:
+        plan = list(product(stratificationLevelId, localIDs))
+    else:
+        plan = [(strat, _default_localIDs(strat)) for strat in stratificationLevelId]
+    years = [str(year) for year in years]
 
     # The majority of measures do not have smoothing value.
     isSmoothed = 0  # False (1=True)
     # Do not need full core holder for most purposes.
     getFullCoreHolder = 0  # False (1=True)
-    url_tail = f"/{isSmoothed}/{getFullCoreHolder}?{localIDs_str}"
 
-    # NOTE: These can be moved down as just part of params?
-    #geographicTypeIdFilter = "7"  # Census Tract
-    #geographicItemsFilter = ",".join(tracts)  #tracts[0]
-    #temporalTypeIdFilter = "1"
-    #temporalItemsFilter = ",".join(years)
-
-    # Request as get
-    #get_body = f"{geographicTypeIdFilter}/{geographicItemsFilter}/"
-    #get_body += f"{temporalTypeIdFilter}/{temporalItemsFilter}"
-    #res = requests.get(f"{EPH_url}/{get_body}{url_tail}")
-
-    # Request as post
-    params = {"geographicTypeIdFilter": "7",
-              "geographicItemsFilter": ",".join(tracts),
-              "temporalTypeIdFilter": "1",
-              "temporalItemsFilter": ",".join(years),
-              }
-    headers = {"Content-Type": "application/json"}
-    res = utils.post_request(f"{EPH_url}{url_tail}",
-                             json.dumps(params),
-                             headers=headers)
-    # TODO: catch the following error to tell user to get token?
-    #"code":429,"errorTypeId":8,"helpURL":"http://ephtracking.cdc.gov/apihelp",
-    # "message":"Server has serviced too many non-token requests",
-    # "status":"Too Many Requests"
-    # TODO: response seems to contain metadata and results (split)
-    df = pandas.DataFrame(res['tableResult'])
+    results = []
+    for strat, ids in plan:
+        localIDs_str = "&".join([f"{k}={v}" for k, v in ids.items()])
+        #TemperatureHeatIndexId=2&RelativeThresholdId=1
+        # Construct url for request
+        EPH_url = f"{_EPH_URL}/getCoreHolder/{measureId}/{strat}"
+        url_tail = f"/{isSmoothed}/{getFullCoreHolder}?{localIDs_str}"
+
+        # Only request tracts missing a year from cache
+        cached = None
+        request_tracts, request_years = tracts, years
+        if cache_dir:
+            cache_key = localIDs_str.replace("&", "_").replace("=", "")
+            cache_file = os.path.join(cache_dir,
+                                      f"heat_{measureId}_{strat}_{cache_key}.parquet")
+            if os.path.exists(cache_file):
+                cached = pandas.read_parquet(cache_file)
+                have = set(zip(cached['geoId'], cached['temporal']))
+                missing = [(tract, year) for tract, year in product(tracts, years)
+                           if (tract, year) not in have]
+                request_tracts = sorted({tract for tract, _ in missing})
+                request_years = sorted({year for _, year in missing})
+
+        chunks = [request_tracts[i:i + chunk_size]
+                  for i in range(0, len(request_tracts), chunk_size)]
+        url = f"{EPH_url}{url_tail}"
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            fetched = list(executor.map(
+                lambda chunk: _heat_request(url, chunk, request_years),
+                chunks))
+        parts = [res for res in [cached] + fetched if res is not None]
+        df = pandas.concat(parts, ignore_index=True) if parts else pandas.DataFrame()
+
+        if cache_dir and len(df) > 0:
+            os.makedirs(cache_dir, exist_ok=True)
+            df = df.drop_duplicates(subset=['geoId', 'temporal'], keep='last')
+            df.reset_index(drop=True).to_parquet(cache_file)
+        if len(df) > 0:
+            df = df[df['geoId'].isin(tracts) & df['temporal'].isin(years)]
+        if len(plan) > 1:
+            df = df.assign(stratificationLevelId=strat, **ids)
+        results.append(df)
+
+    df = pandas.concat(results, ignore_index=True)
     if len(df)>0:
         return df
     return None
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Module for areal interpolation of source (e.g., block group) values to zones
+"""
+import json
+import os
+from warnings import warn
+
+import numpy
+import pandas
+import rasterio
+import shapely
+from rasterio.transform import xy
+from scipy import sparse
+from shapely import STRtree
+
+from CHAPPIE.join import query_pairs
+
+_area_crs = 5070  # CONUS Albers equal area, for overlap areas
+METHODS = ["area", "population", "impervious"]
+_empty_int = numpy.empty(0, dtype="int64")
+_empty_float = numpy.empty(0, dtype="float64")
+
+
+def _overlap_areas(source_geoms, zone_geoms, chunk_size):
+    """Source and zone positions with area of their intersection."""
+    tree = STRtree(zone_geoms)
+    rows, cols, areas = [_empty_int], [_empty_int], [_empty_float]
+    for left, right in query_pairs(tree, source_geoms, "intersects", None, chunk_size):
+        area = shapely.area(shapely.intersection(source_geoms[left], zone_geoms[right]))
+        keep = area > 0  # Touching only
+        rows.append(left[keep])
+        cols.append(right[keep])
+        areas.append(area[keep])
+    totals = shapely.area(source_geoms)
+    return (numpy.concatenate(rows), numpy.concatenate(cols),
+            numpy.concatenate(areas), totals)
+
+
+def _overlap_points(source_geoms, zone_geoms, points, weights, chunk_size):
+    """Source and zone positions with sum of point weights in both."""
+    # Each point counts once per source (lowest position on shared edges)
+    source = numpy.full(len(points), len(source_geoms), dtype="int64")
+    tree = STRtree(source_geoms)
+    for left, right in query_pairs(tree, points, "intersects", None, chunk_size):
+        numpy.minimum.at(source, left, right)
+    totals = numpy.bincount(source, weights, minlength=len(source_geoms) + 1)
+    # Points count in every zone they are in (zones may overlap)
+    rows, cols, sums = [_empty_int], [_empty_int], [_empty_float]
+    tree = STRtree(zone_geoms)
+    for left, right in query_pairs(tree, points, "intersects", None, chunk_size):
+        matched = source[left] < len(source_geoms)
+        rows.append(source[left][matched])
+        cols.append(right[matched])
+        sums.append(weights[left][matched])
+    return (numpy.concatenate(rows), numpy.concatenate(cols),
+            numpy.concatenate(sums), totals[:-1])
+
+
+def _raster_points(raster):
+    """Cell center points and values (excluding nodata and 0) for a raster."""
+    with rasterio.open(raster) as src:
+        band = src.read(1, masked=True)
+        rows, cols = numpy.nonzero(band.filled(0) > 0)
+        xs, ys = xy(src.transform, rows, cols)
+        crs = src.crs
+    points = shapely.points(numpy.asarray(xs), numpy.asarray(ys))
+    return points, band[rows, cols].astype("float64").filled(0), crs
+
+
+def build_weights(sources, zones, method="area", points=None, weight_col=None,
+                  raster=None, out_file=None, chunk_size=100000):
+    """Build sparse source × zone overlap weights once for areal interpolation.
+
+    Overlap is measured by:
+        "area" - area of source and zone intersection.
+        "population" - sum of points (e.g., households or parcel centroids), or
+        their weight_col (e.g., persons), in both source and zone.
+        "impervious" - sum of raster cell values (e.g., NLCD impervious) with
+        centers in both source and zone.
+
+    Parameters
+    ----------
+    sources : geopandas.GeoDataFrame
+        Source polygons with values to allocate (e.g., SVI block groups),
+        identified by index.
+    zones : geopandas.GeoDataFrame
+        Zone polygons to allocate to (e.g., parcels, watersheds), identified
+        by index.
+    method : str, optional
+        One of METHODS. The default is "area".
+    points : geopandas.GeoDataFrame, optional
+        Points for "population" method.
+    weight_col : str, optional
+        Column in points with weights. The default is None (count points).
+    raster : str, optional
+        Path to raster for "impervious" method (e.g., from nlcd.get_NLCD()).
+    out_file : str, optional
+        Weights file (.npz) to cache to. If it exists and was built with the
+        same method, source ids and zone ids it is loaded instead, otherwise
+        it is rebuilt (warned) and overwritten.
+    chunk_size : int, optional
+        Number of geometries per tree query. The default is 100000.
+
+    Returns
+    -------
+    ArealWeights
+        Weights for allocating source values to zones.
+
+    """
+    if out_file and os.path.exists(out_file):
+        cached = ArealWeights.load(out_file)
+        if (cached.method == method
+                and cached.source_ids.equals(pandas.Index(sources.index))
+                and cached.zone_ids.equals(pandas.Index(zones.index))):
+            return cached
+        warn(f"{out_file} was built for other sources, zones or method, rebuilding")
+    assert method in METHODS, f"'{method}' not in {METHODS}"
+
+    if method == "area":
+        crs = _area_crs if sources.crs.is_geographic else sources.crs
+    elif method == "population":
+        assert points is not None, "population method requires points"
+        crs = points.crs
+        if weight_col:
+            weights = points[weight_col].to_numpy(dtype="float64")
+        else:
+            weights = numpy.ones(len(points))
+        point_geoms = numpy.asarray(points.geometry.values)
+    elif method == "impervious":
+        assert raster is not None, "impervious method requires raster"
+        point_geoms, weights, crs = _raster_points(raster)
+    source_geoms = numpy.asarray(sources.to_crs(crs).geometry.values)
+    zone_geoms = numpy.asarray(zones.to_crs(crs).geometry.values)
+
+    if method == "area":
+        rows, cols, overlap, totals = _overlap_areas(source_geoms, zone_geoms,
+                                                     chunk_size)
+    else:
+        rows, cols, overlap, totals = _overlap_points(source_geoms, zone_geoms,
+                                                      point_geoms, weights, chunk_size)
+    # Duplicate pairs (e.g., multi-part geometries) are summed
+    matrix = sparse.csr_matrix((overlap, (rows, cols)),
+                               shape=(len(sources), len(zones)))
+
+    areal_weights = ArealWeights(matrix, totals, sources.index, zones.index, method)
+    if out_file:
+        areal_weights.save(out_file)
+    return areal_weights
+
+
+class ArealWeights(object):
+    """Sparse source × zone overlap weights from build_weights().
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        Overlap measure (sources, zones).
+    source_totals : numpy.ndarray
+        Measure for each whole source (e.g., source area).
+    source_ids : pandas.Index
+        Source identifiers (rows).
+    zone_ids : pandas.Index
+        Zone identifiers (columns).
+    method : str, optional
+        Method overlap was measured by. The default is "area".
+    """
+
+    def __init__(self, matrix, source_totals, source_ids, zone_ids, method="area"):
+        self.matrix = sparse.csr_matrix(matrix)
+        self.source_totals = numpy.asarray(source_totals, dtype="float64")
+        self.source_ids = pandas.Index(source_ids)
+        self.zone_ids = pandas.Index(zone_ids)
+        self.method = method
+
+    def __repr__(self):
+        return (f"(ArealWeights) {len(self.source_ids)} sources x "
+                f"{len(self.zone_ids)} zones, {self.matrix.nnz} overlaps "
+                f"({self.method})")
+
+    def save(self, out_file):
+        """Save matrix (.npz) with ids and totals in a .json sidecar."""
+        sparse.save_npz(out_file, self.matrix)
+        sidecar = {'method': self.method,
+                   'source_ids': self.source_ids.tolist(),
+                   'zone_ids': self.zone_ids.tolist(),
+                   'source_totals': self.source_totals.tolist()}
+        with open(os.path.splitext(out_file)[0] + '.json', 'w') as f:
+            json.dump(sidecar, f)
+        return out_file
+
+    @classmethod
+    def load(cls, weights_file):
+        """Load weights saved by save()."""
+        with open(os.path.splitext(weights_file)[0] + '.json') as f:
+            sidecar = json.load(f)
+        return cls(sparse.load_npz(weights_file),
+                   sidecar['source_totals'],
+                   sidecar['source_ids'],
+                   sidecar['zone_ids'],
+                   sidecar['method'])
+
+    def allocate(self, df, columns=None, extensive=True):
+        """Allocate source columns to zones, one sparse product per batch.
+
+        Extensive values (counts, e.g., ACS totals) are split by each zone's
+        share of the source measure and summed, so totals are kept where zones
+        cover sources. Intensive values (rates, e.g., SVI percents or ranks)
+        are averaged weighted by the overlap measure. Missing values are
+        excluded (count as 0 for extensive).
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            Source values, index matching sources (e.g., SVI results).
+        columns : list, optional
+            Columns to allocate. The default is None (all numeric columns).
+        extensive : bool, optional
+            Whether values are extensive (True) or intensive (False). The
+            default is True.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Allocated values for each zone (zone index).
+
+        """
+        if columns is None:
+            columns = df.select_dtypes("number").columns.to_list()
+        values = df[columns].reindex(self.source_ids).to_numpy(dtype="float64")
+        valid = ~numpy.isnan(values)
+        values = numpy.where(valid, values, 0.0)
+
+        if extensive:
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                share = numpy.nan_to_num(1.0 / self.source_totals)
+            weights = sparse.diags(share) @ self.matrix
+            allocated = weights.T @ values
+        else:
+            weights = self.matrix.T
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                allocated = (weights @ values) / (weights @ valid.astype("float64"))
+        return pandas.DataFrame(allocated, index=self.zone_ids, columns=columns)
@@ -9,12 +9,18 @@ Created on Mon Sep 25 14:41:17 2023
 @author: jbousqui
 """
 
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from warnings import warn
 
+import geopandas
+import numpy
 import pygris
-from pandas import concat
+from pandas import DataFrame, concat, read_parquet
 from pygris.data import get_census
 
+from CHAPPIE.geography import roll_down
 from CHAPPIE.layer_query import get_county
 
 
@@ -192,8 +198,8 @@ def variables(subset=None):
         else:
             return x[subset]
     else:
-        # Flatten
-        return list(set([val for sublst in list(x.values()) for val in sublst]))
+        # Flatten, unique in order
+        return list(dict.fromkeys(val for sublst in x.values() for val in sublst))
 
 
 def indicators(subset=None):
@@ -247,6 +253,74 @@ def indicators(subset=None):
     return x
 
 
+# State FIPs (50 states and DC)
+_state_fips = ["01", "02", "04", "05", "06", "08", "09", "10", "11", "12", "13",
+               "15", "16", "17", "18", "19", "20", "21", "22", "23", "24", "25",
+               "26", "27", "28", "29", "30", "31", "32", "33", "34", "35", "36",
+               "37", "38", "39", "40", "41", "42", "44", "45", "46", "47", "48",
+               "49", "50", "51", "53", "54", "55", "56"]
+
+# Census API variables per request (limit is 50)
+_max_variables = 49
+
+# Geometry level-of-detail options for SVI results
+_geometries = ["full", "cb", "simplified", "point", "none", None]
+
+# Indicators that are an ACS metric renamed, not calculated
+_renames = ["TotPop", "HousUnits", "Household"]
+
+
+@lru_cache(maxsize=None)
+def _preprocess_spec():
+    """Compile indicators from variables() into ACS column positions once.
+
+    Each indicator is one or more parts, a sum of numerator columns over a
+    denominator column (HouseBurd has renter and owner parts), so all parts
+    are one matrix product and the indicators are sums of parts.
+
+    Returns
+    -------
+    dict
+        "columns" ACS variables, "names" calculated indicators, "numerators"
+        (columns, parts) 0/1 matrix, "denominators" column position for each
+        part, "starts" first part for each indicator, "invert" mask for
+        indicators reported as 100 - percent, and "infer" single column
+        numerators/denominators that are inferred from tract when missing.
+    """
+    columns = variables()
+    col_idx = {col: i for i, col in enumerate(columns)}
+    names, numerators, denominators, starts, invert, infer = [], [], [], [], [], []
+    for name in variables("keys"):
+        metric_cols = variables(name)
+        if name in _renames or not metric_cols:
+            continue  # FIPS and Area have no preprocessing
+        if name == "HouseBurd":
+            # Renters over renter total plus owners over owner total
+            parts = [(metric_cols[1:29], metric_cols[0]),
+                     (metric_cols[30:], metric_cols[29])]
+        else:
+            # Numerator is sum of list (excluding denominator)
+            parts = [(metric_cols[1:], metric_cols[0])]
+            if len(metric_cols) == 2:
+                infer += [col for col in metric_cols if col not in infer]
+        names.append(name)
+        starts.append(len(denominators))
+        invert.append(name == "NoHSDiplo")
+        for num_cols, den_col in parts:
+            numerator = numpy.zeros(len(columns))
+            numerator[[col_idx[col] for col in num_cols]] = 1.0
+            numerators.append(numerator)
+            denominators.append(col_idx[den_col])
+    return {"columns": columns,
+            "names": names,
+            "numerators": numpy.array(numerators).T,
+            "denominators": numpy.array(denominators),
+            "starts": numpy.array(starts),
+            "invert": numpy.array(invert),
+            "infer": infer,
+            }
+
+
 def preprocess(df_in, year=2020):
     """Calculate SVI indicators from ACS metrics in DataFrame.
 
@@ -264,106 +338,194 @@ def preprocess(df_in, year=2020):
     pandas.DataFrame
         Table with added columns for calculated indicators.
     """
+    spec = _preprocess_spec()
     # Deep copy table
     df = df_in.copy()
-    # List new column names
-    # indicators = SVI_variables('keys')
-
-    # cols maths: just rename, percents where col2/col1,
-    # and difs where col2-col1/col1
-    renames = ["TotPop", "HousUnits", "Household"]
-
-    # Percent of population ([0] is TotPop)
-    pct_pop = [
-        "Poverty150",
-        "65andover",
-        "17andbelow",
-        "Hisp",
-        "Black",
-        "Asian",
-        "AIAN",
-        "NHPI",
-        "TwoRace",
-        "OtherRace",
-        "ELP",
-    ]
-    # sum/[0] but not over pop
-    pct = [
-        "Unemploy",
-        "NoHSDiplo",
-        "NoHlthIns",
-        "DisableCiv",
-        "SPH",
-        "MUStruct",
-        "MobHome",
-        "Crowd",
-        "NoVeh",
-        "GrpQuarter",
-    ]
-    pct += pct_pop  # Combine for now
-
-    for col in variables("keys"):
-        metric_cols = variables(col)
-
-        if col in renames:
-            df = df.rename(columns={metric_cols[0]: col})
-        elif col in pct:
-            if len(metric_cols) > 2:
-                # Numerator is sum of list (excluding denominator)
-                df[col] = (
-                    df[metric_cols[1:]].sum(axis=1).divide(df[metric_cols[0]]) * 100.0
-                )
-                if col == "NoHSDiplo":
-                    df[col] = [100.0 - x for x in df[col]]  # Invert
-            else:
-                # Numerator is last in list
-                num_col = metric_cols[1]  # Numerator column
-                dem_col = metric_cols[0]  # Denominator column
-                try:
-                    df[col] = df[num_col].divide(df[dem_col]) * 100.0
-                except TypeError as e:
-                    # TODO: move to function if needed for any other cols
-                    # Meant to catch when some or all of the 2 values are None
-                    numerators = df[num_col].to_list()
-                    denominators = df[dem_col].to_list()
-
-                    if None in numerators or denominators:
-                        metrics = []  # Build list of metrics to infer
-                        if None in numerators:
-                            metrics += [num_col]
-                        if None in denominators:
-                            metrics += [dem_col]
-                        for metric in metrics:
-                            # geoids where na
-                            bad_ids = df[df[metric].isna()]["GEOID"].to_list()
-                            for fip in bad_ids:
-                                # TODO: currently assumes missing bg not tract
-                                assert len(fip)>11, 'Meant for block-group'
-                                val = infer_bg_from_tract(fip, metric, year=year)[0]
-                                mask = df["GEOID"] == fip
-                                df.loc[mask, metric] = val
-                            # Warning what metrics were infered at what ids
-                            warn(
-                                f'"{metric}" infered at {bad_ids} block-groups from tract'
-                            )
-                        # Re-try
-                        df[col] = df[num_col].divide(df[dem_col]) * 100.0
-                    else:
-                        # Something else went awry
-                        raise e
-        elif col == "HouseBurd":
-            renter = df[metric_cols[1:29]].sum(axis=1).divide(df[metric_cols[0]])
-            owner = df[metric_cols[30:]].sum(axis=1).divide(df[metric_cols[29]])
-            df[col] = (renter + owner) * 100.0
-        else:
-            # TODO: throw error
-            print(f"{col} has no preprocessing assigned")
+
+    # Single column numerators/denominators missing (None) in block groups
+    # from tract, otherwise (e.g., tract input) they are left missing
+    block_groups = (df["GEOID"].str.len() == 12).to_numpy()
+    missing = [col for col in spec["infer"] if df.loc[block_groups, col].isna().any()]
+    if missing:
+        df = _infer_missing(df, missing, year)
+
+    # Percents for all indicators in one pass, missing in sums count as 0
+    values = df[spec["columns"]].to_numpy(dtype="float64")
+    valid = ~numpy.isnan(values)
+    sums = numpy.where(valid, values, 0.0) @ spec["numerators"]
+    # Missing where every numerator column is missing or denominator is 0
+    sums[valid.astype("float64") @ spec["numerators"] == 0] = numpy.nan
+    denominators = values[:, spec["denominators"]]
+    denominators[denominators == 0] = numpy.nan
+    pcts = numpy.add.reduceat(sums / denominators, spec["starts"], axis=1) * 100.0
+    pcts[:, spec["invert"]] = 100.0 - pcts[:, spec["invert"]]
+
+    df = df.rename(columns={variables(col)[0]: col for col in _renames})
     # TODO: drop original cols?
+    return concat([df, DataFrame(pcts, index=df.index, columns=spec["names"])],
+                  axis=1)
 
+
+def _infer_missing(df, metrics, year=2020):
+    """Fill missing block group metrics from tract (uniform), in batch.
+
+    Every missing (tract, metric) is retrieved with one ACS request per
+    county, then broadcast to block groups by tract GEOID prefix. Rows that
+    are not block groups are left missing.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Table with GEOID and metrics columns, updated in place.
+    metrics : list
+        ACS metric columns with missing values.
+    year : int, optional
+        5-year ACS vintage year, by default 2020
+
+    Returns
+    -------
+    pandas.DataFrame
+        df with missing metrics inferred.
+    """
+    block_groups = (df["GEOID"].str.len() == 12).to_numpy()
+    missing = df[metrics].isna() & block_groups[:, None]
+    if not missing.to_numpy().any():
+        return df
+    bad_ids = df.loc[missing.any(axis=1), "GEOID"]
+    tracts = bad_ids.str[:11]
+
+    tract_data = []
+    for county, county_tracts in tracts.groupby(tracts.str[:5]):
+        # Only metrics missing in this county
+        county_missing = missing.loc[county_tracts.index]
+        tract_data.append(get_census(
+            dataset="acs/acs5",
+            variables=[metric for metric in metrics if county_missing[metric].any()],
+            year=year,
+            params={"for": f"tract:{','.join(sorted(set(county_tracts.str[5:])))}",
+                    "in": f"state:{county[:2]};county:{county[2:]}"},
+            return_geoid=True,
+            guess_dtypes=True,
+        ))
+    tract_data = concat(tract_data).reindex(columns=["GEOID"] + metrics)
+    # Broadcast tract values to block groups by GEOID hierarchy
+    tract_values = roll_down(df[["GEOID"]], tract_data)
+
+    for metric in metrics:
+        df[metric] = df[metric].where(~missing[metric],
+                                      tract_values[metric].to_numpy())
+        # Warning what metrics were infered at what ids
+        warn(f'"{metric}" infered at {df.loc[missing[metric], "GEOID"].to_list()} '
+             'block-groups from tract')
     return df
 
 
-def get_SVI_by_aoi(aoi, level="block group", year=2020):
+def _percentile_rank(values, groups):
+    """Percentile rank, (rank - 1) / (n - 1), of each column within groups.
+
+    Ties get the lowest (min) rank and NaN are not ranked (n excludes them).
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Values to rank (rows, columns).
+    groups : numpy.ndarray
+        Integer group code for each row.
+
+    Returns
+    -------
+    numpy.ndarray
+        Percentile ranks (rows, columns), NaN where values are NaN or the
+        group has one ranked value.
+    """
+    out = numpy.full(values.shape, numpy.nan)
+    for j in range(values.shape[1]):
+        idx = numpy.flatnonzero(~numpy.isnan(values[:, j]))
+        order = idx[numpy.lexsort((values[idx, j], groups[idx]))]
+        grp, val = groups[order], values[order, j]
+        pos = numpy.arange(len(order))
+        # First position of each group and of each run of tied values
+        new_group = numpy.r_[True, grp[1:] != grp[:-1]]
+        new_value = new_group | numpy.r_[True, val[1:] != val[:-1]]
+        group_start = numpy.maximum.accumulate(numpy.where(new_group, pos, 0))
+        tie_start = numpy.maximum.accumulate(numpy.where(new_value, pos, 0))
+        sizes = numpy.diff(numpy.r_[numpy.flatnonzero(new_group), len(order)])
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            out[order, j] = ((tie_start - group_start)
+                             / (numpy.repeat(sizes, sizes) - 1))
+    return out
+
+
+def rank(df_in, groupby=None, flag=0.9, decimals=4):
+    """Rank SVI indicators CDC style (percentile ranks, themes and flags).
+
+    Following CDC/ATSDR SVI, each indicator is percentile ranked (EPL_),
+    ranks are summed by theme (SPL_THEME1-4) and re-ranked (RPL_THEME1-4),
+    theme sums are summed (SPL_THEMES) and re-ranked (RPL_THEMES). Themes
+    are indicators() domains in order, excluding Base_Data. Indicators
+    ranked at or above flag are flagged (F_), with counts by theme
+    (F_THEME1-4) and overall (F_TOTAL). Missing indicators are not ranked
+    and their themes are missing.
+
+    Parameters
+    ----------
+    df_in : pandas.DataFrame
+        Table with indicator columns, e.g., from preprocess() or get_SVI().
+    groupby : str, list or array-like, optional
+        Column(s) or values grouping rows into the universes ranked within
+        (e.g., df["GEOID"].str[:2] for state). The default is None (all rows,
+        e.g., nation).
+    flag : float, optional
+        Percentile rank at or above which indicators are flagged. The default
+        is 0.9 (top 10%).
+    decimals : int, optional
+        Decimals percentile ranks are rounded to, as CDC. The default is 4,
+        None does not round.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Table with added columns for ranks, sums and flags.
+    """
+    themes = [inds for domain, inds in indicators().items() if domain != "Base_Data"]
+    names = [ind for inds in themes for ind in inds]
+    bounds = numpy.cumsum([0] + [len(inds) for inds in themes])
+
+    if groupby is None:
+        groups = numpy.zeros(len(df_in), dtype="int64")
+    else:
+        groups = df_in.groupby(groupby, sort=False).ngroup().to_numpy()
+
+    def percentile_rank(values):
+        ranks = _percentile_rank(values, groups)
+        return ranks if decimals is None else numpy.round(ranks, decimals)
+
+    epl = percentile_rank(df_in[names].to_numpy(dtype="float64"))
+    flags = (epl >= flag).astype("int64")
+    # Theme sums (NaN if any indicator is missing), re-ranked
+    spl = numpy.add.reduceat(epl, bounds[:-1], axis=1)
+    spl = numpy.column_stack([spl, spl.sum(axis=1)])
+    rpl = percentile_rank(spl)
+    f_theme = numpy.add.reduceat(flags, bounds[:-1], axis=1)
+    f_theme = numpy.column_stack([f_theme, flags.sum(axis=1)])
+
+    theme_names = [f"THEME{i}" for i in range(1, len(themes) + 1)] + ["THEMES"]
+    ranks = DataFrame(
+        numpy.column_stack([epl, flags, spl, rpl, f_theme]),
+        index=df_in.index,
+        columns=([f"EPL_{name}" for name in names]
+                 + [f"F_{name}" for name in names]
+                 + [f"SPL_{name}" for name in theme_names]
+                 + [f"RPL_{name}" for name in theme_names]
+                 + [f"F_{name}" for name in theme_names[:-1]] + ["F_TOTAL"]),
+    )
+    flag_cols = [col for col in ranks.columns if col.startswith("F_")]
+    ranks[flag_cols] = ranks[flag_cols].astype("int64")
+    return concat([df_in, ranks], axis=1)
+
+
+def get_SVI_by_aoi(aoi, level="block group", year=2020, cache_dir=None,
+                   geometry="full", tolerance=0.001):
     """Get Social Vulnerability metrics and geographies for a given area
 
     Parameters
@@ -374,18 +536,40 @@ def get_SVI_by_aoi(aoi, level="block group", year=2020):
         Census level to calculate SVI (default "block group" or "tract")
     year : int, optional
         ACS vintage (5-year), by default 2020
+    cache_dir : str, optional
+        Folder for local ACS and geography cache (by state), by default None
+        (not cached).
+    geometry : str, optional
+        Geometry level-of-detail, by default "full" (TIGER/Line). "cb" is
+        cartographic boundary, "simplified" is full simplified by tolerance,
+        "point" is a representative point and "none" (or None) returns a
+        table without geometry.
+    tolerance : float, optional
+        Simplify tolerance (degrees, NAD83) for "simplified", by default 0.001.
 
     Returns
     -------
     geopandas.GeoDataFrame
         Table of SVI results and associated polygons
     """
+    assert level in ["tract", "block group"], f"{level} not a recognized level"
+    assert geometry in _geometries, f"{geometry} not a recognized geometry"
     # List 5-digist geoid from intersecting counties
     geoids = get_county(aoi)["GEOID"].to_list()
-    return concat([get_SVI(geoid, level, year) for geoid in geoids])
-
-
-def get_SVI(geoid, level="block group", year=2020):
+    # Counties by state, so each state is one ACS request and one download
+    states = {}
+    for geoid in geoids:
+        states.setdefault(geoid[:2], []).append(geoid[2:5])
+    with ThreadPoolExecutor(max_workers=len(states) or 1) as executor:
+        results = executor.map(
+            lambda state: _get_SVI(state, states[state], level, year, cache_dir,
+                                   geometry, tolerance),
+            states.keys())
+        return concat(list(results))
+
+
+def get_SVI(geoid, level="block group", year=2020, cache_dir=None,
+            geometry="full", tolerance=0.001):
     """Get Social Vulnerability metrics and geograhpies for a given geoid
 
     Parameters
@@ -396,6 +580,16 @@ def get_SVI(geoid, level="block group", year=2020):
         Census level to calculate SVI (default "block group" or "tract")
     year : int, optional
         ACS vintage (5-year), by default 2020
+    cache_dir : str, optional
+        Folder for local ACS and geography cache (by state), by default None
+        (not cached).
+    geometry : str, optional
+        Geometry level-of-detail, by default "full" (TIGER/Line). "cb" is
+        cartographic boundary, "simplified" is full simplified by tolerance,
+        "point" is a representative point and "none" (or None) returns a
+        table without geometry.
+    tolerance : float, optional
+        Simplify tolerance (degrees, NAD83) for "simplified", by default 0.001.
 
     Returns
     -------
@@ -403,31 +597,266 @@ def get_SVI(geoid, level="block group", year=2020):
         Table of SVI results and associated polygons
     """
     assert level in ["tract", "block group"], f"{level} not a recognized level"
+    assert geometry in _geometries, f"{geometry} not a recognized geometry"
     # format params from geo (query census BGs) or id?
     assert len(geoid) >= 5, "Currently requires GEOID/FIP of 5 or more digits"
-    state, county = geoid[:2], geoid[2:5]
-    geo_id_str = f"state:{geoid[:2]};county:{geoid[2:5]}"
+    return _get_SVI(geoid[:2], [geoid[2:5]], level, year, cache_dir,
+                    geometry, tolerance)
 
-    svi_data = get_census(
-        dataset="acs/acs5",
-        variables=variables(),
-        year=year,
-        params={"for": f"{level}:*", "in": geo_id_str},
-        return_geoid=True,
-        guess_dtypes=True,
-    )
+
+def _get_SVI(state, counties=None, level="block group", year=2020, cache_dir=None,
+             geometry="full", tolerance=0.001):
+    """Get SVI for counties in one state.
+
+    All counties are retrieved in one ACS request (in=state:XX;county:a,b,c)
+    and geometries from one state-level download.
+
+    Parameters
+    ----------
+    state : str
+        Two (2) digit state FIPs.
+    counties : list, optional
+        Three (3) digit county FIPs in state, by default None (all).
+    level : str, optional
+        Census level to calculate SVI (default "block group" or "tract")
+    year : int, optional
+        ACS vintage (5-year), by default 2020
+    cache_dir : str, optional
+        Folder for local ACS and geography cache, by default None.
+    geometry : str, optional
+        Geometry level-of-detail, by default "full" (TIGER/Line). "cb" is
+        cartographic boundary, "simplified" is full simplified by tolerance,
+        "point" is a representative point and "none" (or None) returns a
+        table without geometry.
+    tolerance : float, optional
+        Simplify tolerance (degrees, NAD83) for "simplified", by default 0.001.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        Table of SVI results and associated geometry
+    """
+    svi_data = _get_acs(state, counties, level, year, cache_dir)
     svi_results = preprocess(svi_data, year)
+    if geometry in [None, "none"]:
+        return svi_results
+
+    geos = _get_geos(state, counties, level, year, cache_dir, cb=geometry == "cb")
+    if geometry == "simplified":
+        geos = geos.set_geometry(geos.geometry.simplify(tolerance))
+    elif geometry == "point":
+        geos = geos.set_geometry(geos.geometry.representative_point())
+    # Combine with geos
+    return geos.merge(svi_results, on="GEOID")
+
+
+def build_national(year, level="block group", out_dir=".", states=None,
+                   max_workers=None, cache_dir=None, geometry="full",
+                   tolerance=0.001):
+    """Build SVI for every tract or block group, by state in a process pool.
+
+    Each state is written as GeoParquet <out_dir>/<year>/<level>/<state>.parquet.
+    States already written are skipped, so a failed or interrupted build
+    resumes where it stopped. For national percentiles read all states and
+    use rank().
+
+    Parameters
+    ----------
+    year : int
+        ACS vintage (5-year).
+    level : str, optional
+        Census level to calculate SVI (default "block group" or "tract")
+    out_dir : str, optional
+        Folder for results, by default current directory.
+    states : list, optional
+        Two (2) digit state FIPs, by default None (50 states and DC).
+    max_workers : int, optional
+        Max processes, by default None (number of processors).
+    cache_dir : str, optional
+        Folder for local ACS and geography cache, by default None.
+    geometry : str, optional
+        Geometry level-of-detail, by default "full" (TIGER/Line). "cb" is
+        cartographic boundary, "simplified" is full simplified by tolerance,
+        "point" is a representative point and "none" (or None) returns a
+        table without geometry.
+    tolerance : float, optional
+        Simplify tolerance (degrees, NAD83) for "simplified", by default 0.001.
+
+    Returns
+    -------
+    list
+        Files written for states (including those previously written).
+    """
+    assert level in ["tract", "block group"], f"{level} not a recognized level"
+    assert geometry in _geometries, f"{geometry} not a recognized geometry"
+    part_dir = os.path.join(out_dir, str(year), level.replace(" ", "_"))
+    out_files = {state: os.path.join(part_dir, f"{state}.parquet")
+                 for state in states or _state_fips}
+    todo = [state for state, out_file in out_files.items()
+            if not os.path.exists(out_file)]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_build_state, state, out_files[state],
+                                   level, year, cache_dir, geometry,
+                                   tolerance): state
+                   for state in todo}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                warn(f"{futures[future]} failed. Error: {e}")
+    return [out_file for out_file in out_files.values() if os.path.exists(out_file)]
+
+
+def _build_state(state, out_file, level="block group", year=2020, cache_dir=None,
+                 geometry="full", tolerance=0.001):
+    """Write SVI for all counties in one state (build_national worker)."""
+    _write_cache(_get_SVI(state, None, level, year, cache_dir, geometry, tolerance),
+                 out_file)
+    return out_file
+
+
+def _write_cache(df, cache_file):
+    """Write table to cache parquet, complete or not at all."""
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    temp_file = f"{cache_file}.{os.getpid()}.tmp"
+    df.to_parquet(temp_file, index=False)
+    os.replace(temp_file, cache_file)
+
+
+def _county_filters(counties):
+    """Parquet filter for county slices (None for all counties)."""
+    return {"filters": [("COUNTYFP", "in", list(counties))]} if counties else {}
+
+
+def _get_acs(state, counties=None, level="block group", year=2020, cache_dir=None):
+    """Get ACS variables() for counties in one state.
+
+    When cached, the whole state is retrieved once and stored as
+    <cache_dir>/acs/acs5/<year>/<level>/<state>.parquet, then counties are
+    read by predicate pushdown.
+
+    Parameters
+    ----------
+    state : str
+        Two (2) digit state FIPs.
+    counties : list, optional
+        Three (3) digit county FIPs in state, by default None (all).
+    level : str, optional
+        Census level (default "block group" or "tract")
+    year : int, optional
+        ACS vintage (5-year), by default 2020
+    cache_dir : str, optional
+        Folder for local cache, by default None (not cached).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Table of ACS variables with GEOID.
+    """
+    def fetch(county_str):
+        return _get_census_chunked(
+            variables(),
+            year,
+            {"for": f"{level}:*", "in": f"state:{state};county:{county_str}"},
+        )
+
+    if cache_dir is None:
+        return fetch(",".join(counties) if counties else "*")
+
+    cache_file = os.path.join(cache_dir, "acs", "acs5", str(year),
+                              level.replace(" ", "_"), f"{state}.parquet")
+    if not os.path.exists(cache_file):
+        acs_data = fetch("*")
+        acs_data["COUNTYFP"] = acs_data["GEOID"].str[2:5]
+        _write_cache(acs_data, cache_file)
+    acs_data = read_parquet(cache_file, **_county_filters(counties))
+    return acs_data.drop(columns="COUNTYFP")
+
+
+def _get_census_chunked(acs_variables, year, params, chunk_size=_max_variables,
+                        max_workers=None):
+    """Get ACS variables in chunks requested concurrently, merged on GEOID.
+
+    Parameters
+    ----------
+    acs_variables : list
+        ACS variable names.
+    year : int
+        ACS vintage (5-year).
+    params : dict
+        Census API geography params ("for" and "in").
+    chunk_size : int, optional
+        Variables per request, by default 49 (API limit is 50 per request).
+    max_workers : int, optional
+        Max concurrent requests, by default None (one per chunk).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Table of ACS variables (in acs_variables order) with GEOID.
+    """
+    chunks = [acs_variables[i:i + chunk_size]
+              for i in range(0, len(acs_variables), chunk_size)]
+
+    def fetch(chunk):
+        return get_census(
+            dataset="acs/acs5",
+            variables=chunk,
+            year=year,
+            params=dict(params),  # get_census adds "get" to params
+            return_geoid=True,
+            guess_dtypes=True,
+        ).set_index("GEOID")
 
+    with ThreadPoolExecutor(max_workers=max_workers or len(chunks)) as executor:
+        results = list(executor.map(fetch, chunks))
+    return concat(results, axis=1).reset_index()
+
+
+def _get_geos(state, counties=None, level="block group", year=2020, cache_dir=None,
+              cb=False):
+    """Get tract or block group geometries for counties in one state.
+
+    When cached, the state is stored as GeoParquet
+    <cache_dir>/geometry/<year>/<level>/<state>.parquet (or <level>_cb for
+    cartographic boundaries), then counties are read by predicate pushdown.
+
+    Parameters
+    ----------
+    state : str
+        Two (2) digit state FIPs.
+    counties : list, optional
+        Three (3) digit county FIPs in state, by default None (all).
+    level : str, optional
+        Census level (default "block group" or "tract")
+    year : int, optional
+        TIGER vintage, by default 2020
+    cache_dir : str, optional
+        Folder for local cache, by default None (not cached).
+    cb : bool, optional
+        Cartographic boundary (generalized) rather than TIGER/Line, by
+        default False.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        Tract or block group polygons.
+    """
     if level == "tract":
-        # Get track geos (2020)
-        tract_geos = pygris.tracts(state=state, county=county, year=year)
-        # Combine with geos
-        return tract_geos.merge(svi_results, on="GEOID")
+        get_geos = pygris.tracts
     elif level == "block group":
-        # Get block group geos (2020)
-        bg_geos = pygris.block_groups(state=state, county=county, year=year)
-        # Combine with geos
-        return bg_geos.merge(svi_results, on="GEOID")
+        get_geos = pygris.block_groups
+
+    if cache_dir is None:
+        return get_geos(state=state, county=counties, cb=cb, year=year)
+
+    level_dir = level.replace(" ", "_") + ("_cb" if cb else "")
+    cache_file = os.path.join(cache_dir, "geometry", str(year), level_dir,
+                              f"{state}.parquet")
+    if not os.path.exists(cache_file):
+        _write_cache(get_geos(state=state, cb=cb, year=year), cache_file)
+    return geopandas.read_parquet(cache_file, **_county_filters(counties))
 
 
 def infer_bg_from_tract(bg_geoid, metric_col, year=2020, method="uniform"):
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+Module to attribute households (points) from many layers in one pass
+"""
+import numpy
+import pandas
+import shapely
+from scipy.spatial import cKDTree
+from shapely import STRtree
+
+AGGREGATIONS = ["first", "count", "list", "min_distance"]
+
+
+def _parse_predicate(predicate):
+    """Split predicate spec into predicate name and distance.
+
+    Parameters
+    ----------
+    predicate : str or tuple
+        Spatial predicate (e.g., "intersects") or ("dwithin", distance).
+
+    Returns
+    -------
+    tuple
+        Predicate name and distance (None unless "dwithin").
+    """
+    if isinstance(predicate, (tuple, list)):
+        predicate, distance = predicate
+        return predicate, float(distance)
+    assert predicate != "dwithin", 'Use ("dwithin", distance) to set distance'
+    return predicate, None
+
+
+def query_pairs(tree, geoms, predicate="intersects", distance=None, chunk_size=100000):
+    """Bulk query a tree in chunks, yielding matching index pairs.
+
+    Parameters
+    ----------
+    tree : shapely.STRtree
+        Tree built from layer geometries.
+    geoms : numpy.ndarray
+        Input geometries (e.g., household points).
+    predicate : str, optional
+        Spatial predicate passed to tree.query. The default is "intersects".
+    distance : float, optional
+        Distance for "dwithin" predicate (CRS units). The default is None.
+    chunk_size : int, optional
+        Number of input geometries per query. The default is 100000.
+
+    Yields
+    ------
+    tuple
+        Arrays of input indices (into geoms) and tree indices for each match.
+    """
+    for start in range(0, len(geoms), chunk_size):
+        chunk = geoms[start:start + chunk_size]
+        if predicate == "dwithin":
+            left, right = tree.query(chunk, predicate=predicate, distance=distance)
+        else:
+            left, right = tree.query(chunk, predicate=predicate)
+        yield left + start, right
+
+
+def attribute(points, layers, chunk_size=100000):
+    """Attribute points from many layers without exploding rows.
+
+    Each layer gets one STRtree and is bulk queried in chunks of points. Matches
+    are aggregated per point as they are found so many-to-one matches never
+    multiply rows.
+
+    Aggregations:
+        "first" - layer columns for the first match (lowest layer position),
+        renamed with a "_{name}" suffix where they conflict with points.
+        "count" - number of matches as "{name}_count".
+        "list" - layer index of every match as "{name}_index".
+        "min_distance" - distance to closest match as "{name}_dist".
+
+    Parameters
+    ----------
+    points : geopandas.GeoDataFrame
+        Points to attribute (e.g., parcel centroids).
+    layers : dict
+        Dictionary where {name: (layer, predicate, agg)}, layer is a
+        geopandas.GeoDataFrame, predicate is a shapely predicate (e.g.,
+        "intersects") or ("dwithin", distance) in points CRS units, and agg is
+        one of AGGREGATIONS.
+    chunk_size : int, optional
+        Number of points per tree query, bounds memory used for match pairs.
+        The default is 100000.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        Copy of points with added columns for each layer.
+    """
+    geoms = numpy.asarray(points.geometry.values)
+    n = len(points)
+    results = []
+    for name, (layer, predicate, agg) in layers.items():
+        assert agg in AGGREGATIONS, f"'{agg}' not in {AGGREGATIONS}"
+        predicate, distance = _parse_predicate(predicate)
+        if layer.crs != points.crs:
+            layer = layer.to_crs(points.crs)
+        layer_geoms = numpy.asarray(layer.geometry.values)
+        tree = STRtree(layer_geoms)
+
+        first = numpy.full(n, len(layer), dtype="int64")  # len = no match
+        count = numpy.zeros(n, dtype="int64")
+        min_dist = numpy.full(n, numpy.nan)
+        matches = numpy.empty(n, dtype=object)
+        for left, right in query_pairs(tree, geoms, predicate, distance, chunk_size):
+            if agg == "first":
+                numpy.minimum.at(first, left, right)
+            elif agg == "count":
+                count += numpy.bincount(left, minlength=n)
+            elif agg == "list":
+                order = numpy.lexsort((right, left))
+                groups = pandas.Series(layer.index.to_numpy()[right[order]]).groupby(
+                    left[order]).agg(list)
+                matches[groups.index.to_numpy()] = groups.to_numpy()
+            elif agg == "min_distance":
+                dist = shapely.distance(geoms[left], layer_geoms[right])
+                numpy.fmin.at(min_dist, left, dist)
+
+        if agg == "first":
+            matched = first < len(layer)
+            cols = [col for col in layer.columns if col != layer.geometry.name]
+            out = layer[cols].iloc[first[matched]]
+            out.index = points.index[matched]
+            out = out.reindex(points.index)
+            out.insert(0, f"{name}_index", pandas.Series(layer.index[first[matched]],
+                                                        index=points.index[matched]))
+            taken = set(points.columns).union(*[res.columns for res in results])
+            out = out.rename(columns={col: f"{col}_{name}"
+                                      for col in cols if col in taken})
+        elif agg == "count":
+            out = pandas.DataFrame({f"{name}_count": count}, index=points.index)
+        elif agg == "list":
+            matches = [match if match is not None else [] for match in matches]
+            out = pandas.DataFrame({f"{name}_index": matches}, index=points.index)
+        else:
+            out = pandas.DataFrame({f"{name}_dist": min_dist}, index=points.index)
+        results.append(out)
+
+    return pandas.concat([points] + results, axis=1)
+
+
+def _nearest_kdtree(coords, layer_coords, k):
+    """K nearest layer points to each coordinate using a KD-tree.
+
+    Ties are resolved by lowest layer position, including ties at the k-th
+    neighbor (checked by querying k+1 and re-querying rows that tie).
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+        (n, 2) array of query coordinates.
+    layer_coords : numpy.ndarray
+        (m, 2) array of layer point coordinates.
+    k : int
+        Number of neighbors.
+
+    Returns
+    -------
+    tuple
+        (n, k) arrays of layer positions (-1 where none) and distances.
+    """
+    n, m = len(coords), len(layer_coords)
+    idx = numpy.full((n, k), -1, dtype="int64")
+    dist = numpy.full((n, k), numpy.nan)
+    if m == 0 or n == 0:
+        return idx, dist
+    tree = cKDTree(layer_coords)
+    k_query = min(k + 1, m)
+    d, i = tree.query(coords, k=k_query)
+    d, i = d.reshape(n, k_query), i.reshape(n, k_query)
+    k_out = min(k, m)
+    # Order each row by (distance, layer position)
+    order = numpy.lexsort((i, d), axis=-1)
+    d = numpy.take_along_axis(d, order, axis=-1)
+    i = numpy.take_along_axis(i, order, axis=-1)
+    idx[:, :k_out], dist[:, :k_out] = i[:, :k_out], d[:, :k_out]
+    if k_query > k:
+        # Where the k+1 neighbor ties the k-th, there may be lower positions
+        # at the same distance the tree didn't return
+        for row in numpy.flatnonzero(d[:, k - 1] == d[:, k]):
+            radius = d[row, k - 1] * (1 + 1e-9)
+            cand = numpy.array(tree.query_ball_point(coords[row], radius),
+                               dtype="int64")
+            cand_d = numpy.hypot(*(layer_coords[cand] - coords[row]).T)
+            best = numpy.lexsort((cand, cand_d))[:k]
+            idx[row], dist[row] = cand[best], cand_d[best]
+    return idx, dist
+
+
+def _nearest_strtree(geoms, layer_geoms, k):
+    """K nearest layer geometries to each geometry using an STRtree.
+
+    Ties are resolved by lowest layer position.
+
+    Parameters
+    ----------
+    geoms : numpy.ndarray
+        Query geometries.
+    layer_geoms : numpy.ndarray
+        Layer geometries.
+    k : int
+        Number of neighbors.
+
+    Returns
+    -------
+    tuple
+        (n, k) arrays of layer positions (-1 where none) and distances.
+    """
+    n, m = len(geoms), len(layer_geoms)
+    idx = numpy.full((n, k), -1, dtype="int64")
+    dist = numpy.full((n, k), numpy.nan)
+    if m == 0 or n == 0:
+        return idx, dist
+    tree = STRtree(layer_geoms)
+    # Start the search radius at an upper bound on the nearest distance
+    if (shapely.get_type_id(geoms) == 0).all():
+        # Distance to the nearest layer vertex (cheap KD-tree query)
+        radius = cKDTree(shapely.get_coordinates(layer_geoms)).query(
+            shapely.get_coordinates(geoms))[0]
+    else:
+        (left, _), d = tree.query_nearest(geoms, return_distance=True)
+        radius = numpy.zeros(n)
+        radius[left] = d
+    # Grow the radius until k are in range
+    xmin, ymin, xmax, ymax = shapely.total_bounds(layer_geoms)
+    floor = max(numpy.hypot(xmax - xmin, ymax - ymin) / m, 1e-9)
+    todo = numpy.arange(n)
+    k_out = min(k, m)
+    while len(todo) > 0:
+        left, right = tree.query(geoms[todo],
+                                 predicate="dwithin",
+                                 distance=radius[todo])
+        counts = numpy.bincount(left, minlength=len(todo))
+        done = counts >= k_out
+        keep = done[left]
+        left, right = left[keep], right[keep]
+        d = shapely.distance(geoms[todo][left], layer_geoms[right])
+        order = numpy.lexsort((right, d, left))
+        left, right, d = left[order], right[order], d[order]
+        # Rank of each pair within its input geometry
+        starts = numpy.unique(left, return_index=True)[1]
+        sizes = numpy.diff(numpy.append(starts, len(left)))
+        rank = numpy.arange(len(left)) - numpy.repeat(starts, sizes)
+        top = rank < k_out
+        rows = todo[left[top]]
+        idx[rows, rank[top]], dist[rows, rank[top]] = right[top], d[top]
+        todo = todo[~done]
+        radius[todo] = numpy.maximum(radius[todo] * 2, floor)
+    return idx, dist
+
+
+def nearest(points, layers, k=1, ids=None):
+    """Get the k nearest features and distances from many layers at once.
+
+    Point layers are searched with a KD-tree, other geometries with an STRtree.
+    Where features are equally near the one first in the layer is used, so
+    results are deterministic and there is always one row per point.
+
+    Parameters
+    ----------
+    points : geopandas.GeoDataFrame
+        Points to find nearest features for (e.g., parcel centroids).
+    layers : dict
+        Dictionary where {name: layer}, layer is a geopandas.GeoDataFrame.
+    k : int, optional
+        Number of nearest features per layer. The default is 1.
+    ids : dict, optional
+        Dictionary where {name: column} to report layer column values instead
+        of the layer index. The default is None and uses the layer index.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Table with points index and "{name}_id"/"{name}_dist" columns (k=1), or
+        "{name}_id{j}"/"{name}_dist{j}" for j in 1..k. Distances are in points
+        CRS units, NaN where a layer has fewer than k features.
+    """
+    if ids is None:
+        ids = {}
+    geoms = numpy.asarray(points.geometry.values)
+    points_are_points = (shapely.get_type_id(geoms) == 0).all()
+    if points_are_points:
+        coords = shapely.get_coordinates(geoms)
+    results = {}
+    for name, layer in layers.items():
+        if layer.crs != points.crs:
+            layer = layer.to_crs(points.crs)
+        layer_geoms = numpy.asarray(layer.geometry.values)
+        if points_are_points and (shapely.get_type_id(layer_geoms) == 0).all():
+            idx, dist = _nearest_kdtree(coords, shapely.get_coordinates(layer_geoms), k)
+        else:
+            idx, dist = _nearest_strtree(geoms, layer_geoms, k)
+
+        labels = layer[ids[name]] if name in ids else layer.index.to_series()
+        for j in range(k):
+            suffix = "" if k == 1 else str(j + 1)
+            col_ids = labels.take(numpy.maximum(idx[:, j], 0)).to_numpy()
+            if (idx[:, j] < 0).any():
+                col_ids = pandas.Series(col_ids).where(idx[:, j] >= 0).to_numpy()
+            results[f"{name}_id{suffix}"] = col_ids
+            results[f"{name}_dist{suffix}"] = dist[:, j]
+
+    return pandas.DataFrame(results, index=points.index)
+
+
+def within_distance(points, layer, distances, name="layer", ids=False,
+                    chunk_size=100000):
+    """Count features within one or more distances of each point.
+
+    The tree is queried once (per chunk of points) at the largest distance and
+    every distance is served from those pairs, which are aggregated per point
+    and dropped, so results grow with points rather than point-feature pairs.
+
+    Parameters
+    ----------
+    points : geopandas.GeoDataFrame
+        Points to summarize (e.g., parcel centroids).
+    layer : geopandas.GeoDataFrame
+        Features to count (e.g., technological hazards).
+    distances : float or list
+        Distance(s) in points CRS units.
+    name : str, optional
+        Prefix for result columns. The default is "layer".
+    ids : bool, optional
+        Whether to also list the layer index of features within each distance.
+        The default is False.
+    chunk_size : int, optional
+        Number of points per tree query. The default is 100000.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Table with points index and "{name}_count_{distance}" columns for each
+        distance, "{name}_dist" for the nearest feature within the largest
+        distance (NaN if none) and, if ids, "{name}_ids_{distance}" columns.
+    """
+    if not isinstance(distances, (list, tuple)):
+        distances = [distances]
+    distances = sorted(distances)
+    if layer.crs != points.crs:
+        layer = layer.to_crs(points.crs)
+    geoms = numpy.asarray(points.geometry.values)
+    layer_geoms = numpy.asarray(layer.geometry.values)
+    labels = layer.index.to_numpy()
+    tree = STRtree(layer_geoms)
+
+    n = len(points)
+    counts = numpy.zeros((len(distances), n), dtype="int64")
+    min_dist = numpy.full(n, numpy.nan)
+    id_lists = [numpy.empty(n, dtype=object) for _ in distances]
+    for left, right in query_pairs(tree, geoms, "dwithin", distances[-1], chunk_size):
+        dist = shapely.distance(geoms[left], layer_geoms[right])
+        numpy.fmin.at(min_dist, left, dist)
+        if ids:
+            order = numpy.lexsort((right, left))
+            left, right, dist = left[order], right[order], dist[order]
+        for i, distance in enumerate(distances):
+            within = dist <= distance
+            counts[i] += numpy.bincount(left[within], minlength=n)
+            if ids:
+                groups = pandas.Series(labels[right[within]]).groupby(
+                    left[within]).agg(list)
+                id_lists[i][groups.index.to_numpy()] = groups.to_numpy()
+
+    results = {}
+    for i, distance in enumerate(distances):
+        results[f"{name}_count_{distance:g}"] = counts[i]
+    results[f"{name}_dist"] = min_dist
+    if ids:
+        for i, distance in enumerate(distances):
+            results[f"{name}_ids_{distance:g}"] = [x if x is not None else []
+                                                   for x in id_lists[i]]
+    return pandas.DataFrame(results, index=points.index)
@@ -8,12 +8,18 @@ Created on Fri Oct 23 10:36:03 2020
 import copy
 import json
 import math
+import operator
 import warnings
+from urllib.parse import quote
 
 import geopandas
+import numpy
 import pandas
+import shapely
+from pyproj import CRS, Transformer
 
 from CHAPPIE import utils
+from CHAPPIE.aoi import AOI
 
 _basequery = {
     "where": "",  # sql query component
@@ -133,10 +139,11 @@ def get_county(aoi, in_crs=None):
     # and dropped "inSR": aoi.CRS.to_json(),
     # query from aoi object
     # if geodataframe get bbox str
-    if isinstance(aoi, geopandas.GeoDataFrame):
+    if isinstance(aoi, (geopandas.GeoDataFrame, AOI)):
+        aoi = AOI(aoi)
         bbox = ",".join(map(str, aoi.total_bounds))
         if not in_crs:
-            in_crs = aoi.crs.to_epsg()
+            in_crs = aoi.epsg
     elif isinstance(aoi, list):
         bbox = ",".join(map(str, aoi))
     else:
@@ -169,10 +176,11 @@ def get_state_by_aoi(aoi, in_crs=None):
     # and dropped "inSR": aoi.CRS.to_json(),
     # query from aoi object
     # if geodataframe get bbox str
-    if isinstance(aoi, geopandas.GeoDataFrame):
+    if isinstance(aoi, (geopandas.GeoDataFrame, AOI)):
+        aoi = AOI(aoi)
         bbox = ",".join(map(str, aoi.total_bounds))
         if not in_crs:
-            in_crs = aoi.crs.to_epsg()
+            in_crs = aoi.epsg
     elif isinstance(aoi, list):
         bbox = ",".join(map(str, aoi))
     else:
@@ -211,7 +219,8 @@ def getState(geoids):
     return feature_layer.query(**query_params)
 
 
-def get_bbox(aoi, url, layer, out_fields=None, in_crs=None, buff_dist_m=None):
+def get_bbox(aoi, url, layer, out_fields=None, in_crs=None, buff_dist_m=None,
+             where=None):
     """Query layer by bounding box.
 
     Parameters
@@ -229,6 +238,9 @@ def get_bbox(aoi, url, layer, out_fields=None, in_crs=None, buff_dist_m=None):
     buff_dist_m : int, optional
         Number of meters to buffer around the bounding box.
         The default is None and applies a buffer of 0 meters.
+    where : str, optional
+        SQL where clause to filter features on the server, e.g., from
+        get_where(). The default is None (all features in bbox).
 
     Returns
     -------
@@ -236,7 +248,8 @@ def get_bbox(aoi, url, layer, out_fields=None, in_crs=None, buff_dist_m=None):
         Table of results.
     """
     # if geodataframe get bbox str
-    if isinstance(aoi, geopandas.GeoDataFrame):
+    if isinstance(aoi, (geopandas.GeoDataFrame, AOI)):
+        aoi = AOI(aoi)
         bbox = ",".join(map(str, aoi.total_bounds))
         if not in_crs:
             in_crs = aoi.crs
@@ -268,6 +281,9 @@ def get_bbox(aoi, url, layer, out_fields=None, in_crs=None, buff_dist_m=None):
         query_params["distance"] = buff_dist_m
         query_params["units"] = "esriSRUnit_Meter"
 
+    if where:
+        query_params["where"] = quote(where)  # query string isn't encoded
+
     result = feature_layer.query(**query_params)  # Get result
 
     # Compare result against count limit
@@ -278,6 +294,48 @@ def get_bbox(aoi, url, layer, out_fields=None, in_crs=None, buff_dist_m=None):
         return _batch_query(feature_layer, query_params, maxRecordCount)
 
 
+def get_where(filters):
+    """Build SQL where clause from filters.
+
+    Parameters
+    ----------
+    filters : list
+        Filters as (field, operator, value) tuples, e.g., [('yr', '>=', 1990)].
+        The same filters work for parquet reads (pyarrow filters).
+
+    Returns
+    -------
+    str
+        Where clause with filters combined by AND.
+
+    """
+    return " AND ".join(f"{field} {oper} {value}" for field, oper, value in filters)
+
+
+def apply_filters(df, filters):
+    """Subset table using filters.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame or geopandas.GeoDataFrame
+        Table to filter.
+    filters : list
+        Filters as (field, operator, value) tuples, see get_where().
+
+    Returns
+    -------
+    pandas.DataFrame or geopandas.GeoDataFrame
+        Rows meeting all filters.
+
+    """
+    opers = {"=": operator.eq, "==": operator.eq, "!=": operator.ne,
+             ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+    mask = numpy.ones(len(df), dtype=bool)
+    for field, oper, value in filters:
+        mask &= opers[oper](df[field], value).to_numpy()
+    return df[mask]
+
+
 def get_field_where(url, layer, field, value, oper="="):
     """Query layer by where fields meet criteria.
 
@@ -502,6 +560,17 @@ class ESRIImageService(object):
         except:
             return ""
 
+    def info(self):
+        """Get the image service description (pixel size, extent, etc.).
+
+        Returns
+        -------
+        dict
+            Service properties as json.
+
+        """
+        return utils.post_request(self._baseurl + "?f=pjson")
+
     def computeStatHist(self, **kwargs):
         """Run query to compute statistics and histograms from ImageServer layers.
 
@@ -553,7 +622,83 @@ class ESRIImageService(object):
             return resp
 
 
-def get_image_by_poly(aoi, url, row):
+def get_pixel_tolerance(url, crs, bounds):
+    """Get the image service pixel size in the units of another CRS.
+
+    Parameters
+    ----------
+    url : str
+        Image Service url.
+    crs : pyproj.CRS, int, str
+        Coordinate Reference System the tolerance will be applied in.
+    bounds : list
+        Extent (xmin, ymin, xmax, ymax) in crs, the center is where the pixel
+        size is measured.
+
+    Returns
+    -------
+    float
+        Pixel size as a distance in crs units.
+
+    """
+    info = ESRIImageService(url).info()
+    pixel_size = max(info["pixelSizeX"], info["pixelSizeY"])
+    service_crs = CRS.from_user_input(info["spatialReference"].get("latestWkid",
+                                      info["spatialReference"]["wkid"]))
+    crs = CRS.from_user_input(crs)
+    if service_crs == crs:
+        return pixel_size
+    # Measure one pixel at the center of bounds in the service CRS
+    to_service = Transformer.from_crs(crs, service_crs, always_xy=True)
+    from_service = Transformer.from_crs(service_crs, crs, always_xy=True)
+    x, y = to_service.transform((bounds[0] + bounds[2]) / 2,
+                                (bounds[1] + bounds[3]) / 2)
+    xs, ys = from_service.transform([x, x + pixel_size], [y, y + pixel_size])
+    return min(abs(xs[1] - xs[0]), abs(ys[1] - ys[0]))
+
+
+def generalize_geometry(geom, tolerance=None, precision=None):
+    """Simplify and quantize a geometry to shrink its request payload.
+
+    Parameters
+    ----------
+    geom : shapely.Geometry
+        Geometry to generalize.
+    tolerance : float, optional
+        Simplification tolerance in geometry CRS units (e.g., the pixel size
+        of the raster being summarized). The default is None and does not
+        simplify.
+    precision : float, optional
+        Grid size to snap coordinates to in geometry CRS units (e.g., 1e-6
+        degrees). The default is None and does not quantize.
+
+    Returns
+    -------
+    tuple
+        Generalized geometry and dict reporting how much it was simplified.
+        If generalizing collapses the geometry the original is returned.
+
+    """
+    out_geom = geom
+    if tolerance:
+        out_geom = out_geom.simplify(tolerance, preserve_topology=True)
+    if precision:
+        out_geom = shapely.set_precision(out_geom, precision)
+        # Round so serialized coordinates don't carry float noise
+        decimals = max(0, -math.floor(math.log10(precision)))
+        out_geom = shapely.transform(out_geom,
+                                     lambda coords: numpy.round(coords, decimals))
+    if out_geom.is_empty or out_geom.area == 0:
+        out_geom = geom  # Too small to generalize, keep original
+    area_change = abs(out_geom.area - geom.area) / geom.area if geom.area else 0.0
+    report = {"vertices": shapely.get_num_coordinates(geom),
+              "vertices_sent": shapely.get_num_coordinates(out_geom),
+              "area_change": area_change,
+              }
+    return out_geom, report
+
+
+def get_image_by_poly(aoi, url, row, tolerance=None, precision=None):
     """Run query to compute statistics and histograms from ImageServer layers.
 
     Parameters
@@ -568,14 +713,33 @@ def get_image_by_poly(aoi, url, row):
     row : pandas.Series
         Row of pandas dataframe
 
+    tolerance : float, optional
+        Simplify the polygon by this distance (aoi CRS units) before sending,
+        e.g., the raster pixel size from get_pixel_tolerance().
+        The default is None and sends the full resolution polygon.
+
+    precision : float, optional
+        Grid size (aoi CRS units) to quantize coordinates to before sending.
+        The default is None and sends coordinates as they are.
+
     Returns
     -------
     JSON 
-        Post request response json.
+        Post request response json. If tolerance or precision are used the
+        "generalization" key reports vertices before/after and area change.
 
     """
+    report = None
+    if tolerance or precision:
+        # Swap in generalized geometry for the request
+        geom, report = generalize_geometry(row.geometry.iloc[0], tolerance, precision)
+        row = row.copy()
+        row[row.geometry.name] = geopandas.GeoSeries([geom],
+                                                     index=row.index,
+                                                     crs=row.crs)
     # if geodataframe, get geometry of the row
-    if isinstance(aoi, geopandas.GeoDataFrame):
+    if isinstance(aoi, (geopandas.GeoDataFrame, AOI)):
+        aoi = AOI(aoi)
         try:
             json_string = row.to_json(drop_id=True)
             data = json.loads(json_string)
@@ -586,7 +750,7 @@ def get_image_by_poly(aoi, url, row):
                 rings = data["features"][0]["geometry"]["coordinates"]
                 # Make esri geometry object (polygon)
                 geometry_object = { "rings": rings,
-                    "spatialReference": { "wkid": aoi.crs.to_epsg() }
+                    "spatialReference": { "wkid": aoi.epsg }
                     }
 
             elif geometry_type == "MultiPolygon":
@@ -604,7 +768,7 @@ def get_image_by_poly(aoi, url, row):
                     multipoly.append(rings)
 
                 geometry_object = { "rings": multipoly,
-                    "spatialReference": { "wkid": aoi.crs.to_epsg() }
+                    "spatialReference": { "wkid": aoi.epsg }
                     }
             else:
                 warnings.warn(f"Unsupported geometry type: {geometry_type}")
@@ -621,8 +785,9 @@ def get_image_by_poly(aoi, url, row):
                         "geometryType": "esriGeometryPolygon",
                         "f": "json"
                         }
-                # TODO: geometry objec is too large...make it less precise?
                 result = imagery_layer.computeStatHist(**query_params)
+                if report and isinstance(result, dict):
+                    result["generalization"] = report
                 return result
             except Exception as e:
                 warnings.warn(f"Response: {result}, Error: {e}")
@@ -3,15 +3,28 @@
 
 @author: tlomba01
 """
+import glob
+import json
+import math
 import os
+from datetime import datetime, timedelta, timezone
+from warnings import warn
+
+import geopandas
+import pandas
+from shapely.geometry import box
 
 from CHAPPIE import layer_query
+from CHAPPIE.aoi import AOI
 
 _regrid_base_url = "https://fs.regrid.com/"
 _regrid_fs_path = "/rest/services/premium/FeatureServer"
+_regrid_fields = "id,geoid,parcelnumb,fema_flood_zone"
+_store_crs = 4326  # Regrid outSR
+_manifest = "tiles.json"  # Store tile refresh times
 
 
-def get_regrid(aoi, api_key=None):
+def get_regrid(aoi, api_key=None, store_dir=None, max_age_days=None, tile_size=0.05):
     """Get Regrid parcels within AOI.
 
     Parameters
@@ -20,6 +33,15 @@ def get_regrid(aoi, api_key=None):
         Spatial definition for Area Of Interest (AOI).
     api_key : str, optional
         API key for regrid service. Default None uses os.environ['REGRID_API_KEY'].
+    store_dir : str, optional
+        Local parcel store folder. The default is None and queries the service
+        for the whole AOI bounding box. When set, parcels are served from the
+        store and only missing or stale tiles are fetched from the service.
+    max_age_days : int, optional
+        Store tiles older than this are re-fetched. The default is None and
+        never re-fetches a tile once stored.
+    tile_size : float, optional
+        Store tile size in decimal degrees. The default is 0.05.
 
     Returns
     -------
@@ -31,14 +53,193 @@ def get_regrid(aoi, api_key=None):
     if api_key is None:
         api_key = os.environ['REGRID_API_KEY']
     url = f"{_regrid_base_url}{api_key}{_regrid_fs_path}"
+
+    if store_dir:
+        update_store(aoi, url, store_dir, max_age_days, tile_size)
+        return read_store(aoi, store_dir)
+
+    aoi = AOI(aoi)
     xmin, ymin, xmax, ymax = aoi.total_bounds
     bbox = [xmin, ymin, xmax, ymax]
 
     return layer_query.get_bbox(aoi=bbox,
                                 url=url,
                                 layer=0,
-                                in_crs=aoi.crs.to_epsg(),
-                                out_fields="id,geoid,parcelnumb,fema_flood_zone")
+                                in_crs=aoi.epsg,
+                                out_fields=_regrid_fields)
+
+
+def _tiles(bounds, tile_size):
+    """List (column, row) keys for store tiles covering bounds."""
+    xmin, ymin, xmax, ymax = bounds
+    cols = range(math.floor(xmin / tile_size), math.floor(xmax / tile_size) + 1)
+    rows = range(math.floor(ymin / tile_size), math.floor(ymax / tile_size) + 1)
+    return [(col, row) for col in cols for row in rows]
+
+
+def _tile_box(tile, tile_size):
+    """Polygon for store tile (column, row) key."""
+    col, row = tile
+    return box(col * tile_size, row * tile_size,
+               (col + 1) * tile_size, (row + 1) * tile_size)
+
+
+def _read_manifest(store_dir):
+    """Read store manifest, dict where {tile_size: {"col_row": timestamp}}."""
+    manifest_file = os.path.join(store_dir, _manifest)
+    if not os.path.isfile(manifest_file):
+        return {}
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+
+def update_store(aoi, url, store_dir, max_age_days=None, tile_size=0.05):
+    """Fetch missing or stale tiles for AOI into local parcel store.
+
+    The store is GeoParquet partitioned by county GEOID (e.g.,
+    "store_dir/24039/parcels.parquet") and keyed by Regrid "id".
+
+    Parameters
+    ----------
+    aoi : geopandas.GeoDataFrame
+        Spatial definition for Area Of Interest (AOI).
+    url : str
+        Regrid FeatureServer url (including api key).
+    store_dir : str
+        Local parcel store folder.
+    max_age_days : int, optional
+        Store tiles older than this are re-fetched. The default is None and
+        never re-fetches a tile once stored.
+    tile_size : float, optional
+        Store tile size in decimal degrees. The default is 0.05.
+
+    Returns
+    -------
+    list
+        Tiles (column, row) that were fetched, including tiles with no
+        parcels. Tiles where the request failed are not recorded, so they are
+        tried again.
+
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = _read_manifest(store_dir)
+    fetched = manifest.setdefault(str(tile_size), {})
+
+    now = datetime.now(timezone.utc)
+    bounds = aoi.to_crs(_store_crs).total_bounds
+    to_fetch = []
+    for tile in _tiles(bounds, tile_size):
+        key = f"{tile[0]}_{tile[1]}"
+        if key in fetched:
+            if max_age_days is None:
+                continue
+            age = now - datetime.fromisoformat(fetched[key])
+            if age < timedelta(days=max_age_days):
+                continue
+        to_fetch.append(tile)
+
+    if not to_fetch:
+        return to_fetch
+
+    results = []
+    fetched_tiles = []
+    for tile in to_fetch:
+        try:
+            res = layer_query.get_bbox(aoi=list(_tile_box(tile, tile_size).bounds),
+                                       url=url,
+                                       layer=0,
+                                       in_crs=_store_crs,
+                                       out_fields=_regrid_fields)
+        except Exception as e:
+            warn(f"Tile {tile} failed. Error: {e}")
+            continue
+        fetched_tiles.append(tile)
+        if len(res) > 0:
+            results.append(res.to_crs(_store_crs))
+    if not fetched_tiles:
+        return fetched_tiles
+
+    # Only tiles that were fetched replace what is stored
+    tile_boxes = geopandas.GeoSeries([_tile_box(t, tile_size) for t in fetched_tiles],
+                                     crs=_store_crs)
+    if results:
+        new_gdf = pandas.concat(results, ignore_index=True)
+        # Parcels on tile edges are returned for each tile
+        new_gdf = new_gdf.drop_duplicates(subset="id", keep="last")
+        new_gdf = geopandas.GeoDataFrame(new_gdf, crs=_store_crs)
+    else:
+        new_gdf = geopandas.GeoDataFrame(columns=_regrid_fields.split(","),
+                                         geometry=[],
+                                         crs=_store_crs)
+
+    # Upsert by county, dropping stored parcels in re-fetched tiles so parcels
+    # removed from the source don't linger
+    new_counties = set(new_gdf["geoid"])
+    stored_counties = set(_partitions(store_dir).keys())
+    for geoid in new_counties | stored_counties:
+        part_file = os.path.join(store_dir, geoid, "parcels.parquet")
+        part_new = new_gdf[new_gdf["geoid"] == geoid]
+        if os.path.isfile(part_file):
+            if len(part_new) == 0:
+                # Only re-write if stored parcels overlap re-fetched tiles
+                overlap = geopandas.read_parquet(part_file,
+                                                 columns=["id", "geometry"],
+                                                 bbox=tuple(tile_boxes.total_bounds))
+                if not overlap.intersects(tile_boxes.union_all()).any():
+                    continue
+            part_old = geopandas.read_parquet(part_file).drop(columns="bbox",
+                                                              errors="ignore")
+            stale = part_old.intersects(tile_boxes.union_all())
+            part_old = part_old[~stale & ~part_old["id"].isin(part_new["id"])]
+            part_new = pandas.concat([part_old, part_new], ignore_index=True)
+        elif len(part_new) == 0:
+            continue
+        os.makedirs(os.path.dirname(part_file), exist_ok=True)
+        part_new.to_parquet(part_file, index=False, write_covering_bbox=True)
+
+    # Record refresh time for each tile fetched
+    for tile in fetched_tiles:
+        fetched[f"{tile[0]}_{tile[1]}"] = now.isoformat()
+    with open(os.path.join(store_dir, _manifest), "w") as f:
+        json.dump(manifest, f)
+
+    return fetched_tiles
+
+
+def _partitions(store_dir):
+    """Dict of county GEOID to parquet file in local parcel store."""
+    files = glob.glob(os.path.join(store_dir, "*", "parcels.parquet"))
+    return {os.path.basename(os.path.dirname(f)): f for f in files}
+
+
+def read_store(aoi, store_dir):
+    """Read Regrid parcels within AOI bounding box from local parcel store.
+
+    Parameters
+    ----------
+    aoi : geopandas.GeoDataFrame
+        Spatial definition for Area Of Interest (AOI).
+    store_dir : str
+        Local parcel store folder.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        GeoDataFrame for Regrid parcels within AOI bounding box.
+
+    """
+    bbox = tuple(aoi.to_crs(_store_crs).total_bounds)
+    # Covering bbox columns let each county file skip non-overlapping rows
+    gdfs = [geopandas.read_parquet(f, bbox=bbox)
+            for f in _partitions(store_dir).values()]
+    gdfs = [gdf for gdf in gdfs if len(gdf) > 0]
+    if not gdfs:
+        return geopandas.GeoDataFrame(columns=_regrid_fields.split(","),
+                                      geometry=[],
+                                      crs=_store_crs)
+    gdf = pandas.concat(gdfs, ignore_index=True)
+    gdf = gdf.drop(columns="bbox", errors="ignore")
+    return geopandas.GeoDataFrame(gdf, crs=_store_crs)
 
 
 def process_regrid(regrid_gdf):
@@ -6,11 +6,14 @@ Created on Mon Sep 25 16:33:15 2023
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 
 import geopandas
 import pandas
 import pytest
 from geopandas.testing import assert_geodataframe_equal
+from shapely.geometry import box
 
 from CHAPPIE.household import svi
 
@@ -113,3 +116,254 @@ def test_infer_bg_from_tract_from_preprocess():
     # Check calculated value
     expected_pct = [0.0, 0.0]
     assert actual["GrpQuarter"].to_list()==expected_pct
+
+
+@pytest.mark.unit
+def test_get_SVI_by_aoi_batched():
+    counties = pandas.DataFrame({"GEOID": ["12033", "01003", "12113"]})
+
+    def census(dataset, variables, year, params, return_geoid, guess_dtypes):
+        state, county = [x.split(":")[1] for x in params["in"].split(";")]
+        geoids = [state + c + "000100" for c in county.split(",")]
+        return pandas.DataFrame({"GEOID": geoids} | {var: 1 for var in variables})
+
+    def block_groups(state, county, cb, year):
+        geoids = [state + c + "000100" for c in county]
+        return geopandas.GeoDataFrame({"GEOID": geoids},
+                                      geometry=[box(0, 0, 1, 1)] * len(geoids),
+                                      crs=4269)
+
+    with patch.object(svi, "get_county", return_value=counties), \
+         patch.object(svi, "get_census", side_effect=census) as mock_census, \
+         patch.object(svi.pygris, "block_groups",
+                      side_effect=block_groups) as mock_bg, \
+         patch.object(svi, "preprocess", side_effect=lambda df, year: df):
+        actual = svi.get_SVI_by_aoi(None, year=2021)
+
+    # One ACS request (of 3 variable chunks) and one geometry download per state
+    assert mock_census.call_count == 2 * 3
+    assert mock_bg.call_count == 2
+    ins = sorted(set(call.kwargs["params"]["in"]
+                     for call in mock_census.call_args_list))
+    assert ins == ["state:01;county:003", "state:12;county:033,113"]
+    assert sorted(actual["GEOID"]) == ["01003000100", "12033000100", "12113000100"]
+
+
+@pytest.mark.unit
+def test_preprocess():
+    data = {var: [0, 0] for var in svi.variables()}
+    data["GEOID"] = ["510010901011", "510010901012"]
+    data["B01003_001E"] = [100, 50]  # TotPop
+    data["B29003_001E"] = [200, 0]  # Poverty150
+    data["B29003_002E"] = [50, 0]
+    data["B15003_001E"] = [40, 10]  # NoHSDiplo (inverted)
+    data["B15003_017E"] = [10, 10]
+    data["B15003_025E"] = [20, None]  # missing in sum counts as 0
+    data["B25074_001E"] = [10, 10]  # HouseBurd renter
+    data["B25074_006E"] = [5, 1]
+    data["B25091_001E"] = [20, 10]  # HouseBurd owner
+    data["B25091_022E"] = [2, 1]
+    data["B09019_002E"] = [None, 20]  # GrpQuarter inferred
+    data["B09019_026E"] = [1, 2]
+    data["B11001_002E"] = [10, 0]  # SPH
+    data["B11001_005E"] = [None, 5]  # all missing in sum is missing
+    data["B11001_006E"] = [None, 0]
+    df_in = pandas.DataFrame(data)
+
+    tract = pandas.DataFrame({"GEOID": ["51001090101"], "B09019_002E": [10]})
+    with patch.object(svi, "get_census", return_value=tract) as mock_census, \
+         pytest.warns(UserWarning, match="B09019_002E"):
+        actual = svi.preprocess(df_in, 2023)
+    assert mock_census.call_args.kwargs["variables"] == ["B09019_002E"]
+
+    assert actual["TotPop"].to_list() == [100, 50]
+    assert actual["Poverty150"].to_list()[0] == 25.0
+    assert pandas.isna(actual["Poverty150"].to_list()[1])
+    assert actual["NoHSDiplo"].to_list() == [25.0, 0.0]
+    assert actual["HouseBurd"].to_list() == [60.0, 20.0]
+    assert actual["GrpQuarter"].to_list() == [10.0, 10.0]
+    # Missing when all of numerator is missing or denominator is 0
+    assert actual["SPH"].isna().to_list() == [True, True]
+    assert actual["Unemploy"].isna().to_list() == [True, True]
+    # Input not modified
+    assert df_in["B09019_002E"].isna().to_list() == [True, False]
+
+
+@pytest.mark.unit
+def test_preprocess_tract():
+    """Missing tract metrics are left missing, not inferred"""
+    data = {var: [10, 10] for var in svi.variables()}
+    data["GEOID"] = ["51001090101", "51001090102"]
+    data["B09019_002E"] = [None, 20]  # GrpQuarter denominator
+    data["B09019_026E"] = [1, 2]
+    df_in = pandas.DataFrame(data)
+
+    with patch.object(svi, "get_census") as mock_census:
+        actual = svi.preprocess(df_in, 2023)
+    mock_census.assert_not_called()
+    assert pandas.isna(actual["GrpQuarter"].to_list()[0])
+    assert actual["GrpQuarter"].to_list()[1] == 10.0
+
+
+@pytest.mark.unit
+def test_infer_missing_batched():
+    df = pandas.DataFrame({"GEOID": ["510010901011", "510010901012",
+                                     "510010902001", "510030100001"],
+                           "B09019_002E": [None, None, None, 5],
+                           "B09019_026E": [1, None, 2, None]})
+
+    def census(dataset, variables, year, params, return_geoid, guess_dtypes):
+        county = params["in"].replace("state:", "").replace(";county:", "")
+        tracts = params["for"].split(":")[1].split(",")
+        data = {var: [int(tract) % 1000 + i for tract in tracts]
+                for i, var in enumerate(variables)}
+        return pandas.DataFrame({"GEOID": [county + tract for tract in tracts]} | data)
+
+    with patch.object(svi, "get_census", side_effect=census) as mock_census, \
+         pytest.warns(UserWarning):
+        actual = svi._infer_missing(df, ["B09019_002E", "B09019_026E"], 2023)
+
+    # One request per county for all tracts and metrics missing there
+    assert mock_census.call_count == 2
+    params = [call.kwargs["params"] for call in mock_census.call_args_list]
+    assert params[0] == {"for": "tract:090101,090200", "in": "state:51;county:001"}
+    assert params[1] == {"for": "tract:010000", "in": "state:51;county:003"}
+    assert mock_census.call_args_list[1].kwargs["variables"] == ["B09019_026E"]
+    # Tract values broadcast to missing block groups only
+    assert actual["B09019_002E"].to_list() == [101, 101, 200, 5]
+    assert actual["B09019_026E"].to_list() == [1, 102, 2, 0]
+
+
+@pytest.mark.unit
+def test_rank():
+    names = [ind for domain, inds in svi.indicators().items()
+             if domain != "Base_Data" for ind in inds]
+    df = pandas.DataFrame({name: [1.0, 2.0, 2.0, 3.0, 5.0, 4.0] for name in names})
+    df["Unemploy"] = [1.0, None, 2.0, 3.0, 5.0, 4.0]
+    df["GEOID"] = ["01", "01", "01", "01", "02", "02"]
+
+    actual = svi.rank(df, groupby="GEOID")
+    # (rank - 1) / (n - 1) within state, ties at min rank
+    assert actual["EPL_Poverty150"].to_list() == [0.0, 0.3333, 0.3333, 1.0, 1.0, 0.0]
+    # Missing not ranked and excluded from n
+    assert actual["EPL_Unemploy"].fillna(-1).to_list()[:4] == [0.0, -1, 0.5, 1.0]
+    assert pandas.isna(actual["SPL_THEME1"][1])
+    assert actual["F_Poverty150"].to_list() == [0, 0, 0, 1, 1, 0]
+    assert actual["F_THEME2"].to_list() == [0, 0, 0, 5, 5, 0]
+    assert actual["F_TOTAL"].to_list() == [0, 0, 0, 22, 22, 0]
+    assert actual["SPL_THEME2"][3] == 5.0
+    assert actual["RPL_THEMES"].to_list()[3:] == [1.0, 1.0, 0.0]
+
+    # Nation (all rows)
+    actual = svi.rank(df)
+    assert actual["EPL_Poverty150"].to_list() == [0.0, 0.2, 0.2, 0.6, 1.0, 0.8]
+
+
+@pytest.mark.unit
+def test_get_SVI_cache(tmp_path):
+    geoids = ["12033000100", "12033000200", "12113000100"]
+
+    def census(dataset, variables, year, params, return_geoid, guess_dtypes):
+        return pandas.DataFrame({"GEOID": geoids}
+                                | {var: [1, 2, 3] for var in variables})
+    tracts = geopandas.GeoDataFrame({"GEOID": geoids,
+                                     "COUNTYFP": [geoid[2:5] for geoid in geoids]},
+                                    geometry=[box(0, 0, 1, 1)] * 3,
+                                    crs=4269)
+
+    with patch.object(svi, "get_census", side_effect=census) as mock_census, \
+         patch.object(svi.pygris, "tracts", return_value=tracts) as mock_tracts, \
+         patch.object(svi, "preprocess", side_effect=lambda df, year: df):
+        first = svi.get_SVI("12033", level="tract", cache_dir=str(tmp_path))
+        second = svi.get_SVI("12113", level="tract", cache_dir=str(tmp_path))
+
+    # Whole state retrieved once (3 variable chunks), then read from cache
+    assert mock_census.call_count == 3
+    assert mock_census.call_args.kwargs["params"]["in"] == "state:12;county:*"
+    mock_tracts.assert_called_once_with(state="12", cb=False, year=2020)
+    assert first["GEOID"].to_list() == geoids[:2]
+    assert second["GEOID"].to_list() == geoids[2:]
+    assert second.crs == tracts.crs
+    assert (tmp_path / "acs" / "acs5" / "2020" / "tract" / "12.parquet").exists()
+
+
+@pytest.mark.unit
+def test_build_national(tmp_path):
+    def get_svi(state, counties, level, year, cache_dir, geometry, tolerance):
+        if state == "02":
+            raise ValueError("Census API down")
+        return geopandas.GeoDataFrame({"GEOID": [state + "001000100"]},
+                                      geometry=[box(0, 0, 1, 1)],
+                                      crs=4269)
+
+    # Previously written state is skipped
+    part_dir = tmp_path / "2021" / "tract"
+    part_dir.mkdir(parents=True)
+    svi_04 = get_svi("04", None, None, None, None, None, None)
+    svi_04.to_parquet(part_dir / "04.parquet")
+
+    # Threads in place of processes, so the patch applies in workers
+    with patch.object(svi, "ProcessPoolExecutor", ThreadPoolExecutor), \
+         patch.object(svi, "_get_SVI", side_effect=get_svi) as mock_svi, \
+         pytest.warns(UserWarning, match="02 failed"):
+        actual = svi.build_national(2021, "tract", str(tmp_path),
+                                    states=["01", "02", "04"])
+
+    assert sorted(call.args[0] for call in mock_svi.call_args_list) == ["01", "02"]
+    assert actual == [str(part_dir / "01.parquet"), str(part_dir / "04.parquet")]
+    assert geopandas.read_parquet(actual[0])["GEOID"].to_list() == ["01001000100"]
+
+
+@pytest.mark.unit
+def test_get_SVI_geometry():
+    acs = pandas.DataFrame({"GEOID": ["12033000100"], "B01003_001E": [1]})
+    bgs = geopandas.GeoDataFrame({"GEOID": ["12033000100"]},
+                                 geometry=[box(0, 0, 1, 1)],
+                                 crs=4269)
+
+    with patch.object(svi, "get_census", return_value=acs), \
+         patch.object(svi.pygris, "block_groups", return_value=bgs) as mock_bg, \
+         patch.object(svi, "preprocess", side_effect=lambda df, year: df):
+        none = svi.get_SVI("12033", geometry="none")
+        assert mock_bg.call_count == 0  # No geometry download
+        point = svi.get_SVI("12033", geometry="point")
+        simple = svi.get_SVI("12033", geometry="simplified", tolerance=0.5)
+        cb = svi.get_SVI("12033", geometry="cb")
+
+    assert not isinstance(none, geopandas.GeoDataFrame)
+    assert point.geom_type.to_list() == ["Point"]
+    assert point.geometry[0].within(box(0, 0, 1, 1))
+    assert simple.geom_type.to_list() == ["Polygon"]
+    assert mock_bg.call_args.kwargs["cb"]
+    assert cb.crs == bgs.crs
+
+
+@pytest.mark.unit
+def test_get_census_chunked():
+    acs_variables = svi.variables()
+    # Deterministic order, unique
+    assert acs_variables == svi.variables()
+    assert acs_variables[:3] == ["B01003_001E", "B25001_001E", "B11001_001E"]
+    assert len(acs_variables) == len(set(acs_variables))
+
+    def census(dataset, variables, year, params, return_geoid, guess_dtypes):
+        params["get"] = ",".join(variables)  # as get_census does
+        # Rows in different order for each chunk
+        geoids = ["12033000100", "12033000200"]
+        if variables[0] != acs_variables[0]:
+            geoids = geoids[::-1]
+        values = [int(geoid[-3]) for geoid in geoids]
+        return pandas.DataFrame({var: values for var in variables} | {"GEOID": geoids})
+
+    params = {"for": "tract:*", "in": "state:12;county:033"}
+    with patch.object(svi, "get_census", side_effect=census) as mock_census:
+        actual = svi._get_census_chunked(acs_variables, 2020, params)
+
+    chunks = [call.kwargs["variables"] for call in mock_census.call_args_list]
+    assert all(len(chunk) <= 49 for chunk in chunks)
+    assert sorted(var for chunk in chunks for var in chunk) == sorted(acs_variables)
+    assert "get" not in params  # Not shared between requests
+    assert actual.columns.to_list() == ["GEOID"] + acs_variables
+    # Rows aligned on GEOID across chunks
+    assert actual.set_index("GEOID")[acs_variables].T.nunique().to_list() == [1, 1]
+    assert actual.set_index("GEOID").loc["12033000200", acs_variables[-1]] == 2
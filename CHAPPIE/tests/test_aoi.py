@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Test aoi
+"""
+from unittest.mock import patch
+
+import geopandas
+import numpy
+import pytest
+from shapely.geometry import Point, box
+
+from CHAPPIE import layer_query
+from CHAPPIE.aoi import AOI, as_gdf
+from CHAPPIE.hazards import technological
+
+aoi_gdf = geopandas.GeoDataFrame(geometry=[box(0, 0, 10, 10), box(10, 0, 20, 10)],
+                                 crs=5070)
+
+
+@pytest.mark.unit
+def test_aoi_cache():
+    aoi = AOI(aoi_gdf)
+    assert len(aoi) == 2
+    assert aoi.epsg == 5070
+    assert aoi.authority == ('EPSG', '5070')
+    numpy.testing.assert_array_equal(aoi.total_bounds, [0, 0, 20, 10])
+    assert aoi.union.equals(box(0, 0, 20, 10))
+    # Computed once
+    assert aoi.prepared is aoi.prepared
+    assert aoi.to_crs(4326) is aoi.to_crs('EPSG:4326')
+    assert aoi.equal_area is aoi
+    assert aoi.to_crs(4326).epsg == 4326
+    numpy.testing.assert_allclose(aoi.bounds_in(4326),
+                                  aoi_gdf.to_crs(4326).total_bounds)
+    # Passthrough to GeoDataFrame
+    assert aoi['geometry'].equals(aoi_gdf['geometry'])
+    assert as_gdf(aoi) is aoi_gdf
+    # Wrapping again shares the cache
+    assert AOI(aoi).gdf is aoi_gdf
+    assert AOI(aoi).prepared is aoi.prepared
+    assert aoi.prepared is aoi.union
+
+
+@pytest.mark.unit
+def test_aoi_contains():
+    aoi = AOI(aoi_gdf)
+    # Index does not align with aoi, reprojected to aoi crs
+    points = geopandas.GeoDataFrame(geometry=[Point(5, 5), Point(15, 5),
+                                              Point(25, 5)],
+                                    index=[7, 8, 9],
+                                    crs=5070).to_crs(4326)
+    mask = aoi.contains(points)
+    numpy.testing.assert_array_equal(mask, [True, True, False])
+
+
+@pytest.mark.unit
+def test_get_bbox_aoi():
+    aoi = AOI(aoi_gdf)
+    with patch.object(layer_query, 'ESRILayer') as mock_layer:
+        mock_layer.return_value.query.return_value = []
+        mock_layer.return_value.count.return_value = 1000
+        layer_query.get_bbox(aoi, 'url', 0)
+    query = mock_layer.return_value.query.call_args.kwargs
+    assert query['geometry'] == '0.0,0.0,20.0,10.0'
+    assert query['inSR'] == aoi.crs
+
+
+@pytest.mark.unit
+@patch('CHAPPIE.layer_query.get_bbox')
+def test_get_all_aoi(mock_get_bbox):
+    """Getters run by fetch_many share one AOI, EPSG code computed once"""
+    with patch('pyproj.CRS.to_epsg', autospec=True, return_value=5070) as mock_epsg:
+        technological.get_all(aoi_gdf)
+    assert mock_get_bbox.call_count == 4
+    assert mock_epsg.call_count == 1
+    assert mock_get_bbox.call_args.kwargs['in_crs'] == 5070
+    assert mock_get_bbox.call_args.kwargs['aoi'] == [0, 0, 20, 10]
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Test areal interpolation
+"""
+import os
+from unittest.mock import patch
+
+import geopandas
+import numpy
+import pandas
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from shapely.geometry import Point, box
+
+from CHAPPIE.household import areal
+
+# Two sources (block groups) split by three zones
+sources = geopandas.GeoDataFrame({"TotPop": [100.0, 40.0], "Poverty150": [10.0, None]},
+                                 geometry=[box(0, 0, 10, 10), box(10, 0, 20, 10)],
+                                 index=pandas.Index(["bg1", "bg2"], name="GEOID"),
+                                 crs=5070)
+zones = geopandas.GeoDataFrame(geometry=[box(0, 0, 5, 10), box(5, 0, 15, 10),
+                                         box(30, 0, 40, 10)],
+                               index=[11, 12, 13],
+                               crs=5070)
+
+
+@pytest.mark.unit
+def test_build_weights_area(tmp_path):
+    out_file = os.path.join(tmp_path, "weights.npz")
+    weights = areal.build_weights(sources, zones, out_file=out_file)
+    numpy.testing.assert_allclose(weights.matrix.toarray(),
+                                  [[50, 50, 0], [0, 50, 0]])
+
+    actual = weights.allocate(sources, ["TotPop"])
+    expected = pandas.DataFrame({"TotPop": [50.0, 70.0, 0.0]}, index=zones.index)
+    pandas.testing.assert_frame_equal(actual, expected)
+
+    # Intensive values averaged by overlap, missing excluded
+    actual = weights.allocate(sources, ["TotPop", "Poverty150"], extensive=False)
+    assert actual["TotPop"].to_list()[:2] == [100.0, 70.0]
+    assert actual["Poverty150"].to_list()[:2] == [10.0, 10.0]
+    assert actual.loc[13].isna().all()
+
+    # Cached weights are loaded, not rebuilt
+    with patch.object(areal, "_overlap_areas") as mock_overlap:
+        cached = areal.build_weights(sources, zones, out_file=out_file)
+    mock_overlap.assert_not_called()
+    assert (cached.matrix != weights.matrix).nnz == 0
+    assert cached.source_ids.to_list() == ["bg1", "bg2"]
+    assert cached.zone_ids.to_list() == [11, 12, 13]
+
+    # Cached weights for other zones are rebuilt
+    with pytest.warns(UserWarning, match="rebuilding"):
+        rebuilt = areal.build_weights(sources, zones.iloc[:2], out_file=out_file)
+    assert rebuilt.zone_ids.to_list() == [11, 12]
+    numpy.testing.assert_allclose(rebuilt.matrix.toarray(), [[50, 50], [0, 50]])
+    assert areal.ArealWeights.load(out_file).zone_ids.to_list() == [11, 12]
+
+
+@pytest.mark.unit
+def test_build_weights_population():
+    points = geopandas.GeoDataFrame({"persons": [1, 2, 3, 4]},
+                                    geometry=[Point(1, 1), Point(6, 1),
+                                              Point(7, 1), Point(12, 1)],
+                                    crs=5070)
+    weights = areal.build_weights(sources, zones, "population", points)
+    numpy.testing.assert_allclose(weights.matrix.toarray(), [[1, 2, 0], [0, 1, 0]])
+    actual = weights.allocate(sources, ["TotPop"])
+    numpy.testing.assert_allclose(actual["TotPop"], [100 / 3, 200 / 3 + 40, 0])
+
+    weights = areal.build_weights(sources, zones, "population", points, "persons")
+    numpy.testing.assert_allclose(weights.matrix.toarray(), [[1, 5, 0], [0, 4, 0]])
+    numpy.testing.assert_allclose(weights.source_totals, [6, 4])
+
+
+@pytest.mark.unit
+def test_build_weights_impervious(tmp_path):
+    # 2 x 4 cells of 5 m, impervious only in the 2nd and 4th columns
+    raster = os.path.join(tmp_path, "impervious.tif")
+    data = numpy.array([[0, 50, 0, 20], [0, 50, 127, 20]], dtype="uint8")
+    with rasterio.open(raster, "w", driver="GTiff", height=2, width=4, count=1,
+                       dtype="uint8", crs="EPSG:5070", nodata=127,
+                       transform=from_origin(0, 10, 5, 5)) as dst:
+        dst.write(data, 1)
+    weights = areal.build_weights(sources, zones, "impervious", raster=raster)
+    numpy.testing.assert_allclose(weights.matrix.toarray(), [[0, 100, 0], [0, 0, 0]])
+    actual = weights.allocate(sources, ["TotPop"])
+    assert actual["TotPop"].to_list() == [0.0, 100.0, 0.0]
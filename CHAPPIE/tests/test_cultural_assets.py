@@ -5,8 +5,11 @@ Test cultural assets
 @author: tlomba01, jbousquin, edamico
 """
 import os
+from unittest.mock import patch
 
 import geopandas
+import pandas
+import pytest
 from geopandas.testing import assert_geodataframe_equal
 
 from CHAPPIE.assets import cultural
@@ -62,6 +65,26 @@ def test_get_museums():
                               expected)
 
 
+@pytest.mark.unit
+def test_get_library_museums_aoi():
+    """IMLS points are (longitude, latitude) and kept where within AOI"""
+    inside = aoi_gdf.to_crs(4326).geometry.iloc[0].representative_point()
+    libraries = pandas.DataFrame({"LIBID": ["far", "in"],
+                                  "LONGITUD": [-100.0, inside.x],
+                                  "LATITUDE": [40.0, inside.y]})
+    with patch.object(cultural.utils, "get_from_zip", return_value=libraries):
+        actual = cultural.get_library(aoi_gdf)
+    assert actual["LIBID"].to_list() == ["in"]
+    assert actual.crs == aoi_gdf.crs
+
+    museums = pandas.DataFrame({"MID": [1, 2, 3],
+                                "LONGITUDE": [" ", -100.0, inside.x],
+                                "LATITUDE": [" ", 40.0, inside.y]})
+    with patch.object(cultural.utils, "get_from_zip", return_value=museums):
+        actual = cultural.get_museums(aoi_gdf)
+    assert actual["MID"].to_list() == [3]
+
+
 def test_get_worship():
     actual = cultural.get_worship(aoi_gdf)
     actual.drop(columns=['FID'], inplace=True)
@@ -12,6 +12,7 @@ import geopandas
 import pandas
 import pytest
 from geopandas.testing import assert_geodataframe_equal
+from numpy import nan
 from pandas.testing import assert_frame_equal
 from requests.exceptions import HTTPError
 
@@ -328,3 +329,50 @@ def test_image_post_request_502_error(mock_post_request, polygon_gdf: geopandas.
 # @patch('CHAPPIE.layer_query.ESRIImageService.computeStatHist')
 # def test_get_image_by_poly_index_error():
 #     pass
+
+
+@pytest.mark.unit
+# Test generalized polygon is sent and reported, but patch the computeStatHist
+# endpoint call
+@patch('test_flood.flood.layer_query.ESRIImageService.computeStatHist')
+def test_get_image_by_poly_generalize(mock_computeStatHist,
+                                      polygon_gdf: geopandas.GeoDataFrame):
+    mock_computeStatHist.return_value = {"statistics": [{"mean": 0.5}]}
+    url = "https://fake.org/ImageServer"
+    row = polygon_gdf.iloc[[0]]
+    result = flood.layer_query.get_image_by_poly(aoi=polygon_gdf,
+                                                 url=url,
+                                                 row=row,
+                                                 tolerance=0.0001,
+                                                 precision=0.000001)
+    report = result["generalization"]
+    assert report["vertices"] == 15
+    assert report["vertices_sent"] < report["vertices"]
+    assert report["area_change"] < 0.05
+    # Quantized coordinates are sent
+    sent = mock_computeStatHist.call_args.kwargs["geometry"]
+    assert "30.328781," in sent or "30.328781]" in sent
+
+
+@pytest.mark.unit
+def test_zone_grid_lookup():
+    """ZoneGrid lookup matches exact point-in-polygon (first polygon wins)"""
+    from shapely.geometry import box
+    zones = geopandas.GeoDataFrame(
+        {"FLD_ZONE": ["AE", "X", "VE"]},
+        geometry=[box(0, 0, 100, 100), box(50, 50, 200, 150), box(120, 0, 160, 40)],
+        crs=5070)
+    grid = flood.ZoneGrid(zones, resolution=7)
+    points = geopandas.GeoDataFrame(
+        geometry=geopandas.points_from_xy([10, 75, 150, 130, 100, 300, 199.9],
+                                          [10, 75, 100, 20, 100, 300, 149.9]),
+        index=[3, 4, 5, 6, 7, 8, 9],
+        crs=5070)
+    actual = grid.lookup(points)
+    expected = pandas.Series(["AE", "AE", "X", "VE", "AE", nan, "X"],
+                             index=points.index, name="zone", dtype=object)
+    pandas.testing.assert_series_equal(actual, expected)
+    # Same answers from other CRS (away from edges, reprojection is inexact)
+    interior = points.drop(index=[7, 9])
+    pandas.testing.assert_series_equal(grid.lookup(interior.to_crs(4326)),
+                                       expected.drop(index=[7, 9]))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Test hazard frequency grid
+"""
+import geopandas
+import numpy
+import pytest
+import shapely
+
+from CHAPPIE.hazards import frequency
+
+
+@pytest.mark.unit
+def test_build_sample_grid(tmp_path):
+    """Counts by tornado magnitude / storm level and decade sampled at points"""
+    tornadoes_gdf = geopandas.GeoDataFrame(
+        {'yr': [1995, 1999, 2005, 2005],
+         'mag': [1, 1, 3, -9],
+         'wid': [100, 100, 4376, 100]},
+        geometry=[shapely.LineString([(500, 5500), (9500, 5500)]),
+                  shapely.LineString([(500, 5500), (3500, 5500)]),
+                  shapely.LineString([(5500, 500), (5500, 9500)]),  # 2km half-width
+                  shapely.LineString([(500, 8500), (9500, 8500)])],  # unknown mag
+        crs=5070)
+    cyclones_gdf = geopandas.GeoDataFrame(
+        {'SID': ['A', 'A', 'B'],
+         'year': [2001, 2001, 1890],
+         'USA_WIND': [70, 90, 30]},
+        geometry=[shapely.LineString([(-200000, 0), (0, 0)]),
+                  shapely.LineString([(0, 0), (200000, 0)]),
+                  shapely.LineString([(0, 500000), (1000, 500000)])],
+        crs=5070)
+    out_file = str(tmp_path / 'frequency.npy')
+    frequency.build_grid(out_file,
+                         tornadoes_gdf,
+                         cyclones_gdf,
+                         resolution=1000,
+                         bounds=(0, 0, 10000, 10000))
+    grid = frequency.FrequencyGrid(out_file)
+    assert grid.grid.shape == (10, 10, 2 * 6 + 2 * 7)
+
+    points = geopandas.GeoDataFrame(
+        geometry=[shapely.Point(1500, 5500),  # both mag 1 tracks, storm A
+                  shapely.Point(8500, 5500),  # one mag 1 track, storm A
+                  shapely.Point(6800, 2500),  # mag 3 (within 2km), storm A
+                  shapely.Point(9500, 9500),  # storm A
+                  shapely.Point(20000, 0)],  # outside grid
+        index=['a', 'b', 'c', 'd', 'e'],
+        crs=5070)
+    with pytest.warns(UserWarning, match="1 points outside grid"):
+        actual = grid.sample(points)
+    tornado = actual['tornado']
+    numpy.testing.assert_array_equal(tornado[('Magnitude 1', 1990)],
+                                  [2, 1, 0, 0, numpy.nan])
+    numpy.testing.assert_array_equal(tornado[('Magnitude 3', 2000)],
+                                  [0, 0, 1, 0, numpy.nan])
+    # Storm level is from max wind for storm (90 kts)
+    cyclone = actual['cyclone']
+    numpy.testing.assert_array_equal(cyclone[('Category 2', 2000)],
+                                  [1, 1, 1, 1, numpy.nan])
+    assert actual.loc[['a', 'b', 'c', 'd']].sum().sum() == 3 + 2 + 2 + 1
+
+    # Layer selection
+    actual = grid.sample(points.loc[['a']], hazard='tornado', year_range=(2000, 2010))
+    assert set(actual.columns.get_level_values('decade')) == {2000}
+    assert actual.sum().sum() == 0
+
+
+@pytest.mark.unit
+def test_build_grid_empty_archive(tmp_path):
+    """No archive files for year_range gives a grid with no cyclone layers"""
+    archive = tmp_path / 'archive'
+    (archive / 'NA').mkdir(parents=True)
+    tornadoes_gdf = geopandas.GeoDataFrame(
+        {'yr': [1995], 'mag': [1], 'wid': [100]},
+        geometry=[shapely.LineString([(500, 5500), (9500, 5500)])],
+        crs=5070)
+    out_file = str(tmp_path / 'frequency.npy')
+    frequency.build_grid(out_file,
+                         tornadoes_gdf,
+                         str(archive),
+                         resolution=1000,
+                         bounds=(0, 0, 10000, 10000),
+                         year_range=(1990, 1999))
+    grid = frequency.FrequencyGrid(out_file)
+    assert grid.grid.shape == (10, 10, 6)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Test geography
+"""
+import io
+
+import pandas
+import pytest
+
+from CHAPPIE import geography
+
+bgs = pandas.DataFrame({"GEOID": ["010010201001", "010010201002", "120330001001"],
+                        "TotPop": [10, 20, 30]})
+
+
+@pytest.mark.unit
+def test_components():
+    actual = geography.components(bgs["GEOID"])
+    assert actual["state"].to_list() == [1, 1, 12]
+    assert actual["county"].to_list() == [1, 1, 33]
+    assert actual["tract"].to_list() == [20100, 20100, 100]
+    assert actual["block group"].to_list() == [1, 2, 1]
+    assert str(actual["tract"].dtype) == "uint32"
+    assert geography.level_of(bgs["GEOID"]) == "block group"
+    keys = geography.parent(geography.to_int(bgs["GEOID"]), "block group", "county")
+    assert list(geography.to_str(keys, "county")) == ["01001", "01001", "12033"]
+
+
+@pytest.mark.unit
+def test_roll_up_down():
+    tracts = geography.roll_up(bgs, "tract")
+    assert tracts.index.to_list() == ["01001020100", "12033000100"]
+    assert tracts["TotPop"].to_list() == [30, 30]
+
+    heat = pandas.DataFrame({"geoId": ["01001020100", "01001020200"],
+                             "heat": [3, 4]})
+    actual = geography.roll_down(bgs, heat, parent_col="geoId")
+    assert actual.columns.to_list() == ["GEOID", "TotPop", "heat"]
+    assert actual["heat"].fillna(-1).to_list() == [3, 3, -1]
+
+
+@pytest.mark.unit
+def test_crosswalk():
+    # 2010 tract A split into 2020 tracts C and D, B and A part merged into D
+    rel_file = io.StringIO(
+        "GEOID_TRACT_20|GEOID_TRACT_10|AREALAND_TRACT_20|AREALAND_TRACT_10|AREALAND_PART\n"
+        "01001000300|01001000100|25|100|25\n"
+        "01001000400|01001000100|125|100|75\n"
+        "01001000400|01001000200|125|50|50\n")
+    rel = geography.get_relationship("tract", rel_file)
+    tracts_10 = pandas.DataFrame({"GEOID": ["01001000100", "01001000200"],
+                                  "TotPop": [100.0, 10.0],
+                                  "Poverty150": [20.0, 50.0]})
+
+    actual = geography.crosswalk(tracts_10, rel, columns=["TotPop"])
+    assert actual.index.to_list() == ["01001000300", "01001000400"]
+    assert actual["TotPop"].to_list() == [25.0, 85.0]
+
+    actual = geography.crosswalk(tracts_10, rel, columns=["Poverty150"],
+                                 extensive=False)
+    assert actual["Poverty150"].to_list() == [20.0, 32.0]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Test multi-layer joins
+"""
+import geopandas
+import pytest
+from shapely.geometry import Point, box
+
+from CHAPPIE import join
+
+
+@pytest.fixture(scope='session')
+def points_gdf():
+    geoms = [Point(0.6, 0.5), Point(5.5, 5.5), Point(10, 10)]
+    return geopandas.GeoDataFrame({"id": [10, 11, 12]},
+                                  geometry=geoms,
+                                  crs=5070,
+                                  index=[5, 6, 7])
+
+
+@pytest.fixture(scope='session')
+def polys_gdf():
+    geoms = [box(0, 0, 1, 1), box(0.5, 0, 2, 1), box(5, 5, 6, 6)]
+    return geopandas.GeoDataFrame({"zone": ["A", "B", "C"], "id": [1, 2, 3]},
+                                  geometry=geoms,
+                                  crs=5070,
+                                  index=[100, 101, 102])
+
+
+@pytest.mark.unit
+def test_attribute(points_gdf, polys_gdf):
+    layers = {"flood": (polys_gdf, "intersects", "first"),
+              "n": (polys_gdf, ("dwithin", 6), "count"),
+              "near": (polys_gdf, ("dwithin", 6), "list"),
+              "d": (polys_gdf, ("dwithin", 6), "min_distance")}
+    # Small chunks to check results are combined across chunks
+    actual = join.attribute(points_gdf, layers, chunk_size=2)
+
+    # One row per point, same index
+    assert actual.index.to_list() == [5, 6, 7]
+    # first (lowest layer position), conflicting column gets suffix
+    assert actual["zone"].to_list()[:2] == ["A", "C"]
+    assert actual["id"].to_list() == [10, 11, 12]
+    assert actual["id_flood"].to_list()[:2] == [1, 3]
+    assert actual["zone"].isna().to_list()[2]
+    # count/list/min_distance
+    expected_counts = points_gdf.sjoin(polys_gdf,
+                                       predicate="dwithin",
+                                       distance=6).groupby(level=0).size()
+    assert actual["n_count"].to_list() == expected_counts.to_list()
+    assert actual["near_index"].to_list() == [[100, 101], [101, 102], [102]]
+    assert actual["d_dist"].round(4).to_list() == [0.0, 0.0, 5.6569]
+
+
+@pytest.mark.unit
+def test_attribute_no_match(points_gdf, polys_gdf):
+    layers = {"far": (polys_gdf.iloc[[0]], ("dwithin", 1), "list")}
+    actual = join.attribute(points_gdf, layers)
+    assert actual["far_index"].to_list() == [[100], [], []]
+
+
+@pytest.mark.unit
+def test_nearest_ties(points_gdf):
+    # Duplicate geometries tie, first in layer should always be used
+    geoms = [Point(1, 1), Point(1, 1), Point(6, 6), Point(20, 20)]
+    assets = geopandas.GeoDataFrame({"name": ["a", "b", "c", "d"]},
+                                    geometry=geoms,
+                                    crs=5070)
+    assets_poly = assets.copy()
+    assets_poly["geometry"] = assets.buffer(0.1)
+    layers = {"pt": assets, "poly": assets_poly}
+    actual = join.nearest(points_gdf, layers, k=2, ids={"pt": "name"})
+
+    assert len(actual) == len(points_gdf)
+    assert actual["pt_id1"].to_list() == ["a", "c", "c"]
+    assert actual["pt_id2"].to_list() == ["b", "a", "a"]
+    assert actual["poly_id1"].to_list() == [0, 2, 2]
+    assert actual["poly_id2"].to_list() == [1, 0, 0]
+    # Distances from KD-tree and STRtree agree (less the buffer)
+    diff = actual["pt_dist1"] - actual["poly_dist1"]
+    assert diff.round(2).to_list() == [0.1, 0.1, 0.1]
+
+
+@pytest.mark.unit
+def test_nearest_k_exceeds_layer(points_gdf, polys_gdf):
+    actual = join.nearest(points_gdf, {"zone": polys_gdf}, k=4)
+    assert actual["zone_id1"].to_list() == [100, 102, 102]
+    assert actual["zone_id4"].isna().all()
+    assert actual["zone_dist4"].isna().all()
+
+
+@pytest.mark.unit
+def test_within_distance(points_gdf, polys_gdf):
+    actual = join.within_distance(points_gdf,
+                                  polys_gdf,
+                                  [1, 6],
+                                  name="zone",
+                                  ids=True,
+                                  chunk_size=2)
+    assert actual.index.to_list() == points_gdf.index.to_list()
+    assert actual["zone_count_1"].to_list() == [2, 1, 0]
+    assert actual["zone_count_6"].to_list() == [2, 2, 1]
+    assert actual["zone_ids_1"].to_list() == [[100, 101], [102], []]
+    assert actual["zone_ids_6"].to_list() == [[100, 101], [101, 102], [102]]
+    assert actual["zone_dist"].round(4).to_list() == [0.0, 0.0, 5.6569]
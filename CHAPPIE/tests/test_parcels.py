@@ -4,9 +4,12 @@ Test get and process Regrid parcels.
 @author: tlomba01
 """
 import os
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
 
 import geopandas
 import pytest
+from shapely.geometry import box
 
 #from geopandas.testing import assert_geodataframe_equal
 from CHAPPIE import parcels
@@ -52,3 +55,52 @@ def test_process_regrid(parcels_gdf: geopandas.GeoDataFrame):
     assert len(actual_centroids[mask_points])==len(parcels_gdf)
     mask_polys = actual_centroids['geometry'].geom_type == 'Polygon'
     assert len(actual_centroids[mask_polys])==0
+
+
+@pytest.mark.unit
+def test_get_regrid_store():
+    # Fake service parcels in two counties
+    src = geopandas.GeoDataFrame(
+        {"id": [1, 2, 3],
+         "geoid": ["24039", "24039", "24047"],
+         "parcelnumb": ["a", "b", "c"],
+         "fema_flood_zone": ["X", "AE", "X"]},
+        geometry=[box(-75.90, 38.00, -75.899, 38.001),
+                  box(-75.86, 38.02, -75.859, 38.021),
+                  box(-75.70, 38.10, -75.699, 38.101)],
+        crs=4326)
+
+    failed, service_down = [], [True]
+
+    def fake_get_bbox(aoi, url, layer, out_fields=None, in_crs=None, buff_dist_m=None):
+        if service_down[0] and box(*aoi).contains(src.geometry[1]):
+            failed.append(tuple(aoi))
+            raise ConnectionError("Service unavailable")
+        return src[src.intersects(box(*aoi))]
+
+    aoi = geopandas.GeoDataFrame(geometry=[box(-75.95, 37.98, -75.80, 38.05)],
+                                 crs=4326)
+    with TemporaryDirectory() as temp_dir, patch('CHAPPIE.parcels.layer_query.get_bbox',
+                                                 side_effect=fake_get_bbox) as mock_get:
+        # Tile with parcel 2 fails, parcel 1 is on the edge of other tiles
+        with pytest.warns(UserWarning, match="Service unavailable"):
+            actual = parcels.get_regrid(aoi, api_key="fake", store_dir=temp_dir)
+        assert sorted(actual["id"]) == [1]
+        assert os.path.isfile(os.path.join(temp_dir, "24039", "parcels.parquet"))
+        # Second run only re-fetches the failed tile, not empty tiles
+        service_down[0] = False
+        mock_get.reset_mock()
+        actual = parcels.get_regrid(aoi, api_key="fake", store_dir=temp_dir)
+        retried = [tuple(call.kwargs["aoi"]) for call in mock_get.call_args_list]
+        assert retried == failed
+        assert sorted(actual["id"]) == [1, 2]
+        # Third run is served from the store
+        mock_get.reset_mock()
+        actual = parcels.get_regrid(aoi, api_key="fake", store_dir=temp_dir)
+        mock_get.assert_not_called()
+        assert sorted(actual["id"]) == [1, 2]
+        # Stale tiles are re-fetched without duplicating parcels
+        actual = parcels.get_regrid(aoi, api_key="fake", store_dir=temp_dir,
+                                    max_age_days=0)
+        assert mock_get.called
+        assert sorted(actual["id"]) == [1, 2]
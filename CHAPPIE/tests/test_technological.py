@@ -5,14 +5,14 @@ Test technological
 @author: thultgre
 """
 import os
+from unittest.mock import patch
 
 import geopandas
+import pytest
 from geopandas.testing import assert_geodataframe_equal
 
 from CHAPPIE.hazards import technological
 
-#import pytest
-
 # CI inputs/expected
 DIRPATH = os.path.dirname(os.path.realpath(__file__))
 
@@ -91,3 +91,16 @@ def test_get_tri():
     expected = expected_32('get_tri.parquet')
 
     assert_geodataframe_equal(actual, expected, normalize=True)
+
+
+@pytest.mark.unit
+@patch('CHAPPIE.layer_query.get_bbox')
+def test_get_all(mock_get_bbox):
+    """All layers requested for AOI extent, keyed like the demos"""
+    mock_get_bbox.side_effect = lambda aoi, url, layer, in_crs: url
+    actual = technological.get_all(aoi_gdf)
+    assert list(actual.keys()) == ["superfund", "brownfields", "landfills", "tri"]
+    assert mock_get_bbox.call_count == 4
+    assert "FRS_INTERESTS_ACRES" in actual["brownfields"]
+    bbox = mock_get_bbox.call_args.kwargs['aoi']
+    assert bbox == list(aoi_gdf.total_bounds)
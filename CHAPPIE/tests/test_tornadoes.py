@@ -5,9 +5,13 @@ Test tornadoes
 @author: jbousqui
 """
 import os
+from unittest.mock import patch
+from urllib.parse import quote
 
 import geopandas
+import pandas
 import pytest
+import shapely
 from geopandas.testing import assert_geodataframe_equal
 
 from CHAPPIE.hazards import tornadoes
@@ -127,3 +131,141 @@ def test_max_buffer():
     max_buffer = tornadoes.max_buffer()
     expected_max_buffer = 2092
     assert max_buffer == expected_max_buffer, f"Expected max buffer of {expected_max_buffer}, got {max_buffer}"
+
+
+@pytest.mark.unit
+def test_get_tornadoes_index(tmp_path):
+    """Local index query by AOI extent plus buffer and year range"""
+    aoi = geopandas.GeoDataFrame(geometry=[shapely.box(0, 0, 10000, 10000)],
+                                 crs=5070)
+    tracks = geopandas.GeoDataFrame(
+        {'yr': [1990, 2000, 2010, 2020],
+         'date': ['1990-05-01', '2000-05-01', '2010-05-01', '2020-05-01'],
+         'om': [1, 2, 3, 4],
+         'mag': [0, 1, 2, 3],
+         'wid': [100, 2188, 100, 100]},
+        geometry=[shapely.LineString([(5000, 5000), (6000, 6000)]),  # inside
+                  shapely.LineString([(10500, 0), (10500, 5000)]),  # 500m away
+                  shapely.LineString([(11500, 0), (11500, 5000)]),  # 1500m away
+                  shapely.LineString([(50000, 0), (50000, 5000)])],  # far
+        crs=5070)
+    index_file = str(tmp_path / 'tornadoes.parquet')
+    tornadoes.build_index(tracks, index_file)
+
+    # Buffer is max wid / 2.188 = 1000m
+    actual = tornadoes.get_tornadoes(aoi, index=index_file)
+    assert sorted(actual['om']) == [1, 2]
+    assert actual.crs.to_epsg() == 4326
+    assert str(actual['date'].dtype) == 'datetime64[ms]'
+    actual = tornadoes.get_tornadoes(aoi, index=index_file, year_range=(1995, 2020))
+    assert list(actual['om']) == [2]
+
+    # In memory index gives same results
+    index = tornadoes.TornadoIndex(index_file)
+    assert index.max_buffer == 1000
+    actual = tornadoes.get_tornadoes(aoi, index=index)
+    assert sorted(actual['om']) == [1, 2]
+    actual = index.query(aoi, buff_dist_m=2000, year_range=(2000, 2010))
+    assert sorted(actual['om']) == [2, 3]
+
+    # Magnitude filter also narrows buffer to widest matching track (45.7m)
+    actual = tornadoes.get_tornadoes(aoi, index=index_file, min_magnitude=2)
+    assert len(actual) == 0
+    actual = index.query(aoi, buff_dist_m=2000, min_magnitude=2)
+    assert list(actual['om']) == [3]
+
+
+@pytest.mark.unit
+def test_get_tornadoes_index_cache(tmp_path):
+    """Local index buffer fields are read once per index file version"""
+    aoi = geopandas.GeoDataFrame(geometry=[shapely.box(0, 0, 10000, 10000)],
+                                 crs=5070)
+    tracks = geopandas.GeoDataFrame(
+        {'yr': [1990, 2000], 'date': ['1990-05-01', '2000-05-01'],
+         'om': [1, 2], 'mag': [0, 1], 'wid': [100, 2188]},
+        geometry=[shapely.LineString([(5000, 5000), (6000, 6000)]),
+                  shapely.LineString([(10500, 0), (10500, 5000)])],
+        crs=5070)
+    index_file = str(tmp_path / 'tornadoes.parquet')
+    tornadoes.build_index(tracks, index_file)
+    with patch('CHAPPIE.hazards.tornadoes.pandas.read_parquet',
+               wraps=pandas.read_parquet) as mock_read:
+        actual = tornadoes.get_tornadoes(aoi, index=index_file)
+        assert sorted(actual['om']) == [1, 2]
+        actual = tornadoes.get_tornadoes(aoi, index=index_file, min_magnitude=1)
+        assert list(actual['om']) == [2]
+        assert mock_read.call_count == 1
+        # Rebuilt index is read again
+        tornadoes.build_index(tracks.iloc[[0]], index_file)
+        os.utime(index_file, (0, 0))
+        actual = tornadoes.get_tornadoes(aoi, index=index_file)
+        assert list(actual['om']) == [1]
+        assert mock_read.call_count == 2
+
+
+@pytest.mark.unit
+@patch('CHAPPIE.layer_query.get_bbox')
+@patch('CHAPPIE.layer_query.ESRILayer')
+def test_get_tornadoes_where(mock_layer, mock_get_bbox):
+    """Filters sent to service as where clause, one query per magnitude"""
+    mock_layer.return_value.query.return_value = pandas.DataFrame(
+        {'mag': [3, 2], 'max_wid': [4376, 2188]})
+    mock_get_bbox.side_effect = lambda *args, **kwargs: geopandas.GeoDataFrame(
+        {'mag': [int(kwargs['where'][-1])]},
+        geometry=[shapely.LineString([(0, 0), (1, 1)])], crs=5070)
+    aoi = geopandas.GeoDataFrame(geometry=[shapely.box(0, 0, 10000, 10000)],
+                                 crs=5070)
+    actual = tornadoes.get_tornadoes(aoi, year_range=(1990, 2000), min_magnitude=2)
+    expected = "yr >= 1990 AND yr <= 2000 AND mag >= 2"
+    params = mock_layer.return_value.query.call_args.kwargs
+    assert params['where'] == quote(expected)
+    assert params['groupByFieldsForStatistics'] == 'mag'
+    # Each magnitude buffered by its own widest track
+    calls = mock_get_bbox.call_args_list
+    assert [call.kwargs['where'] for call in calls] == [f"{expected} AND mag = 2",
+                                                        f"{expected} AND mag = 3"]
+    assert [call.args[5] for call in calls] == [1000, 2000]
+    assert list(actual['mag']) == [2, 3]
+
+
+@pytest.mark.unit
+@patch('CHAPPIE.layer_query.get_bbox')
+@patch('CHAPPIE.layer_query.ESRILayer')
+def test_get_tornadoes_where_empty(mock_layer, mock_get_bbox):
+    """No tracks meet filters, nothing fetched and empty result"""
+    mock_layer.return_value.query.return_value = pandas.DataFrame()
+    aoi = geopandas.GeoDataFrame(geometry=[shapely.box(0, 0, 10000, 10000)],
+                                 crs=5070)
+    actual = tornadoes.get_tornadoes(aoi, year_range=(2030, 2031))
+    mock_get_bbox.assert_not_called()
+    assert len(actual) == 0
+    assert set(tornadoes._out_fields) <= set(actual.columns)
+    assert actual.crs == aoi.crs
+    assert tornadoes.max_buffer("yr >= 2030") == 0
+
+
+@pytest.mark.unit
+def test_get_exposure():
+    """Parcel exposure by distance to track within track half-width"""
+    tracks = geopandas.GeoDataFrame(
+        {'yr': [2000, 2001, 2002],
+         'date': ['2000-05-01', '2001-05-01', '2002-05-01'],
+         'om': [1, 2, 3],
+         'mag': [1, 3, -9],
+         'wid': [2188, 4376, 2188]},  # 1000m, 2000m, 1000m half-widths
+        geometry=[shapely.LineString([(0, 0), (10000, 0)]),
+                  shapely.LineString([(0, 3000), (10000, 3000)]),
+                  shapely.LineString([(0, -1500), (10000, -1500)])],
+        crs=5070)
+    parcels = geopandas.GeoDataFrame(
+        geometry=[shapely.Point(5000, 500),  # track 1
+                  shapely.Point(5000, 1500),  # track 2
+                  shapely.box(4900, -1100, 5100, -900),  # track 1, 3 (polygon)
+                  shapely.Point(5000, 9000)],  # none
+        index=[10, 11, 12, 13],
+        crs=5070)
+    actual = tornadoes.get_exposure(tracks, parcels)
+    assert list(actual.index) == [10, 11, 12, 13]
+    assert list(actual['TornCount']) == [1, 1, 2, 0]
+    assert actual['MaxMagnitude'].tolist()[:3] == [1, 3, 1]
+    assert actual['MaxMagnitude'].isna().tolist()[3]
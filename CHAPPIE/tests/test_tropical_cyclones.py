@@ -5,9 +5,11 @@ Test tropical cyclones
 @author: jbousqui
 """
 import os
+from unittest.mock import patch
 
 import geopandas
 import pytest
+import shapely
 from geopandas.testing import assert_geodataframe_equal
 from pandas import DataFrame
 
@@ -86,6 +88,78 @@ def test_process_cyclones(static_cyclones: DataFrame):
                               check_less_precise=True)
 
 
+@pytest.mark.unit
+def test_get_exposure():
+    """Unique storms within distance of parcels, storm wind is max for storm"""
+    cyclones = geopandas.GeoDataFrame(
+        {'SID': ['A', 'A', 'B', 'C'],
+         'USA_WIND': [50, 100, 30, 150]},
+        geometry=[shapely.LineString([(0, 0), (10000, 0)]),
+                  shapely.LineString([(10000, 0), (20000, 0)]),
+                  shapely.LineString([(0, 5000), (20000, 5000)]),
+                  shapely.LineString([(0, 900000), (20000, 900000)])],
+        crs=5070)
+    parcels = geopandas.GeoDataFrame(
+        geometry=[shapely.Point(10000, 1000),  # A (both segments), B
+                  shapely.Point(10000, -160000),  # A only
+                  shapely.Point(10000, 500000)],  # none
+        index=['p1', 'p2', 'p3'],
+        crs=5070)
+    actual = tropical_cyclones.get_exposure(cyclones, parcels)
+    assert list(actual['StormCount']) == [2, 1, 0]
+    assert actual['MaxWindSpdKts'].tolist()[:2] == [100, 100]
+    assert list(actual['MaxStormLevel']) == ["Category 3", "Category 3", None]
+
+
+@pytest.mark.unit
+def test_get_cyclones_archive(tmp_path):
+    """Local archive read by AOI extent plus buffer, years and basins"""
+    aoi = geopandas.GeoDataFrame(geometry=[shapely.box(0, 0, 10000, 10000)],
+                                 crs=5070)
+    cyclones = geopandas.GeoDataFrame(
+        {'SID': ['A', 'B', 'C', 'D'],
+         'NAME': ['a', 'b', 'c', 'd'],
+         'USA_WIND': [50, 100, 30, 150],
+         'USA_PRES': [990, 960, 1000, 920],
+         'year': [1955, 1961, 2005, 2005],
+         'month': [8, 9, 10, 8],
+         'day': [1, 2, 3, 4],
+         'BASIN': ['NA', 'NA', 'EP', 'NA']},
+        geometry=[shapely.LineString([(0, 20000), (0, 30000)]),  # near
+                  shapely.LineString([(160000, 0), (170000, 0)]),  # near
+                  shapely.LineString([(-100000, 0), (-100000, 10000)]),  # near
+                  shapely.LineString([(500000, 0), (500000, 10000)])],  # far
+        crs=5070)
+    archive = str(tmp_path / 'ibtracs')
+    files = tropical_cyclones.build_archive(cyclones, archive)
+    assert len(files) == 4  # NA 1950, 1960, 2000 and EP 2000
+
+    actual = tropical_cyclones.get_cyclones(aoi, archive=archive)
+    assert sorted(actual['SID']) == ['A', 'B', 'C']
+    assert list(actual.columns) == tropical_cyclones._out_fields + ['geometry']
+    actual = tropical_cyclones.get_cyclones(aoi, archive=archive,
+                                            year_range=(1960, 2010))
+    assert sorted(actual['SID']) == ['B', 'C']
+    actual = tropical_cyclones.get_cyclones(aoi, archive=archive, basins=['EP'])
+    assert list(actual['SID']) == ['C']
+    actual = tropical_cyclones.get_cyclones(aoi, archive=archive,
+                                            year_range=(1900, 1910))
+    assert len(actual) == 0
+    actual = tropical_cyclones.get_cyclones(aoi, archive=archive, min_wind=50)
+    assert sorted(actual['SID']) == ['A', 'B']
+
+
+@pytest.mark.unit
+@patch('CHAPPIE.layer_query.get_bbox')
+def test_get_cyclones_where(mock_get_bbox):
+    """Year and wind filters sent to service as where clause"""
+    aoi = geopandas.GeoDataFrame(geometry=[shapely.box(0, 0, 10000, 10000)],
+                                 crs=5070)
+    tropical_cyclones.get_cyclones(aoi, year_range=(1990, 2000), min_wind=64)
+    expected = "year >= 1990 AND year <= 2000 AND USA_WIND >= 64"
+    assert mock_get_bbox.call_args.kwargs['where'] == expected
+
+
 @pytest.mark.skip(reason="depricating")
 def test_get_cyclones_all():
     actual = tropical_cyclones.get_cyclones_all(DATA_DIR, ['points'])
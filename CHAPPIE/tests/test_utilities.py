@@ -1,9 +1,12 @@
 import os
+import time
 from tempfile import TemporaryDirectory
 from unittest.mock import MagicMock, patch
 
+import geopandas
 import pygris
 import pytest
+import shapely
 from geopandas import read_parquet
 from pyarrow.parquet import ParquetFile
 from requests.exceptions import ConnectionError, HTTPError
@@ -112,3 +115,34 @@ def test_post_request_502_error(mock_post):
     # Ensures the mocked method was called once, no retries
     assert mock_post.call_count == 1
     assert result == {"url": url, "data": data, "status": 502}
+
+
+@pytest.mark.unit
+def test_fetch_many():
+    """Getters run concurrently on one prepared AOI, failures raise or warn"""
+    aoi = geopandas.GeoDataFrame(geometry=[shapely.Point(0, 0).buffer(10),
+                                           shapely.Point(50, 50).buffer(10)],
+                                 crs=5070)
+
+    def get_slow(aoi):
+        time.sleep(0.5)
+        return len(aoi)
+
+    def get_bounds(aoi):
+        time.sleep(0.5)
+        return list(aoi.total_bounds)
+
+    def get_broken(aoi):
+        raise ValueError("bad layer")
+
+    start = time.time()
+    with pytest.warns(UserWarning, match="get_broken failed"):
+        actual = utils.fetch_many(aoi, [get_slow, get_bounds, get_broken],
+                                  extent_only=True, errors="warn")
+    assert time.time() - start < 0.9  # Not the sum of getters
+    assert actual == {"get_slow": 1,
+                      "get_bounds": [-10.0, -10.0, 60.0, 60.0]}
+    with pytest.raises(ValueError, match="bad layer"):
+        utils.fetch_many(aoi, [get_slow, get_broken])
+    actual = utils.fetch_many(aoi, {"slow": get_slow})
+    assert actual == {"slow": 2}
@@ -3,10 +3,13 @@ Test natural hazards weather
 
 @author: jbousqui
 """
+import json
 import os
+from unittest.mock import MagicMock, patch
 
 import geopandas
 import pandas
+import pytest
 from pandas.testing import assert_frame_equal
 
 from CHAPPIE import layer_query
@@ -47,3 +50,56 @@ def test_get_heat_events():
     #actual.to_parquet(expected_file, index=False)
 
     assert_frame_equal(actual, expected, check_like=True)
+
+
+@pytest.mark.unit
+@patch('CHAPPIE.utils.time.sleep')
+@patch('CHAPPIE.utils.requests.post')
+@patch('CHAPPIE.layer_query.getTract')
+def test_get_heat_events_chunks_cache(mock_tract, mock_post, mock_sleep, tmp_path):
+    """Tracts requested in chunks, 429 retried and cached results reused"""
+    tracts = [f"12005{i:06d}" for i in range(5)]
+    mock_tract.return_value = pandas.DataFrame({"GEOID": tracts})
+    responses = []
+
+    def fake_post(url, data=None, headers=None):
+        body = json.loads(data)
+        resp = MagicMock()
+        if not responses:  # First request is rate limited
+            resp.status_code = 429
+            resp.headers = {"Retry-After": "1"}
+            resp.raise_for_status.side_effect = Exception("429")
+        else:
+            resp.status_code = 200
+            resp.json.return_value = {"tableResult": [
+                {"geoId": tract, "temporal": year, "dataValue": "1"}
+                for tract in body["geographicItemsFilter"].split(",")
+                for year in body["temporalItemsFilter"].split(",")]}
+        responses.append(body)
+        return resp
+    mock_post.side_effect = fake_post
+
+    actual = weather.get_heat_events(aoi_gdf,
+                                     years=["2022", "2023"],
+                                     chunk_size=2,
+                                     cache_dir=str(tmp_path))
+    assert len(actual) == 10
+    assert set(actual['geoId']) == set(tracts)
+    assert mock_post.call_count == 4  # 3 chunks plus 1 retry
+    mock_sleep.assert_any_call(1.0)  # Retry-After
+
+    # Only the missing year is requested from cache
+    actual = weather.get_heat_events(aoi_gdf,
+                                     years=["2021", "2023"],
+                                     chunk_size=5,
+                                     cache_dir=str(tmp_path))
+    assert len(actual) == 10
+    assert mock_post.call_count == 5
+    assert responses[-1]["temporalItemsFilter"] == "2021"
+
+    # Multiple stratifications in one plan are labeled
+    actual = weather.get_heat_events(aoi_gdf,
+                                     stratificationLevelId=[2194, 2195],
+                                     years=["2023"])
+    assert len(actual) == 10
+    assert set(actual['stratificationLevelId']) == {2194, 2195}
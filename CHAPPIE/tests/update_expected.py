@@ -36,6 +36,30 @@ except AssertionError as ae:
     print(ae)
     actual.to_parquet(expected_file)
 
+### test_get_library()
+actual = cultural.get_library(aoi_gdf)
+actual.sort_values(by=['LIBID', 'geometry'], inplace=True, ignore_index=True)
+
+expected_file = os.path.join(EXPECTED_DIR, 'cultural_lib.parquet')
+expected = geopandas.read_parquet(expected_file)
+try:
+    assert_geodataframe_equal(actual, expected)
+except AssertionError as ae:
+    print(ae)
+    actual.to_parquet(expected_file)
+
+### test_get_museums()
+actual = cultural.get_museums(aoi_gdf)
+actual.sort_values(by=['MID', 'geometry'], inplace=True, ignore_index=True)
+
+expected_file = os.path.join(EXPECTED_DIR, 'cultural_museum.parquet')
+expected = geopandas.read_parquet(expected_file)
+try:
+    assert_geodataframe_equal(actual, expected)
+except AssertionError as ae:
+    print(ae)
+    actual.to_parquet(expected_file)
+
 ### test_get_worship()
 actual = cultural.get_worship(aoi_gdf)
 actual.drop(columns=['FID'], inplace=True)
@@ -4,9 +4,11 @@
 @author: jbousquin
 """
 import os
+import threading
 import time
 import urllib.request
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from tempfile import TemporaryDirectory
 from warnings import warn
@@ -14,7 +16,12 @@ from warnings import warn
 import pandas
 import py7zr
 import requests
-from geopandas import read_file
+import shapely
+from geopandas import GeoDataFrame, read_file
+
+from CHAPPIE.aoi import AOI
+
+_retries_429 = 5  # Max retries for 429 (Too Many Requests) responses
 
 
 def get_zip(url, temp_file):
@@ -175,9 +182,43 @@ def write_results_dict(results_dict, out_dir):
         val.to_parquet(os.path.join(out_dir, key, f"{key}.parquet"))
 
 
-def post_request(url, data=None, headers=None):
+class RateLimiter(object):
+    """Thread-safe limit on the rate of requests.
+
+    Parameters
+    ----------
+    per_second : float
+        Max requests per second across all threads.
+    """
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        """Block until the next request is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _retry_after(response, count):
+    """Seconds to wait before retry, from Retry-After header or backoff."""
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return 2 ** count
+
+
+def post_request(url, data=None, headers=None, limiter=None):
     """ Generate post request from url and data.
 
+    Note: 429 (Too Many Requests) responses are retried with backoff.
+
     Parameters
     ----------
     url : str
@@ -186,6 +227,8 @@ def post_request(url, data=None, headers=None):
         Data dictionary for post request body.
     headers : dict, optional
         Custom HTTP headers to pass with the request, deault None adds none
+    limiter : RateLimiter, optional
+        Rate limiter shared by concurrent requests. The default is None.
 
     Returns
     -------
@@ -194,8 +237,11 @@ def post_request(url, data=None, headers=None):
 
     """
     count = 0
+    count_429 = 0
 
     while True:
+        if limiter:
+            limiter.wait()
         try:
             if headers:
                 r = requests.post(url, data=data, headers=headers)
@@ -216,5 +262,57 @@ def post_request(url, data=None, headers=None):
                         "reason": f"Connection error, {count} attempts",
                         "text": ""}
         except Exception as e:
+            if r.status_code == 429 and count_429 < _retries_429:
+                count_429 += 1
+                time.sleep(_retry_after(r, count_429))
+                continue
             warn(f"Response: {r}, Error: {e}")
             return {"url": url, "data": data, "status": r.status_code}
+
+
+def fetch_many(aoi, getters, max_workers=None, extent_only=False, errors="raise"):
+    """Run getters for the same AOI concurrently.
+
+    Parameters
+    ----------
+    aoi : geopandas.GeoDataFrame
+        Spatial definition for Area Of Interest (AOI).
+    getters : dict or list
+        Getter functions taking aoi, as dict of name: getter or list (named
+        by function name).
+    max_workers : int, optional
+        Max concurrent getters. The default is None (one per getter).
+    extent_only : bool, optional
+        Prepare AOI once as a single extent polygon (AOI), for getters that
+        only use the AOI bounds and CRS. The default is False.
+    errors : str, optional
+        "raise" to raise the first getter error (after all getters finish) or
+        "warn" to warn and leave failed getters out of the results. The
+        default is "raise".
+
+    Returns
+    -------
+    dict
+        Result for each getter name.
+
+    """
+    assert errors in ["raise", "warn"], f"'{errors}' not in ['raise', 'warn']"
+    if not isinstance(getters, dict):
+        getters = {getter.__name__: getter for getter in getters}
+    if extent_only:
+        # Bounds and CRS codes computed once for all getters
+        aoi = AOI(GeoDataFrame(geometry=[shapely.box(*aoi.total_bounds)], crs=aoi.crs))
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(getters) or 1) as executor:
+        futures = {name: executor.submit(getter, aoi)
+                   for name, getter in getters.items()}
+
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            if errors == "raise":
+                raise
+            warn(f"{name} failed. Error: {e}")
+    return results
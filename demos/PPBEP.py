@@ -43,15 +43,10 @@ assets_dict["museums"] = cultural.get_museums(aoi_gdf)
 assets_dict["worship"] = cultural.get_worship(aoi_gdf)
 
 # Get educational assets
-assets_dict["schools_public"] = education.get_schools_public(aoi_gdf)
-assets_dict["schools_private"] = education.get_schools_private(aoi_gdf)
-assets_dict["child_care"] = education.get_child_care(aoi_gdf)
-assets_dict["colleges_uni"] = education.get_colleges_universities(aoi_gdf)
-assets_dict["colleges_sup"] = education.get_supplemental_colleges(aoi_gdf)
+assets_dict.update(education.get_all(aoi_gdf))  # All layers concurrently
 
 # Get emergency assets
-assets_dict["fire_ems"] = emergency.get_fire_ems(aoi_gdf)
-assets_dict["police"] = emergency.get_police(aoi_gdf)
+assets_dict.update(emergency.get_all(aoi_gdf))
 
 # Get food assets
 assets_dict["agritourism"] = food.get_agritourism(aoi_gdf, usda_API)
@@ -88,10 +83,7 @@ hazards_dict["tropical_cyclones"] = tropical_cyclones.process_cyclones(cyclones,
 hazards_dict["heat"] = weather.get_heat_events(aoi_gdf)
 
 # Get tech hazards
-hazards_dict["superfund"] = technological.get_superfund_npl(aoi_gdf)
-hazards_dict["brownfields"] = technological.get_FRS_ACRES(aoi_gdf)
-hazards_dict["landfills"] = technological.get_landfills(aoi_gdf)
-hazards_dict["tri"] = technological.get_tri(aoi_gdf)
+hazards_dict.update(technological.get_all(aoi_gdf))  # All layers concurrently
 
 # Get hazard endpoints
 #hazards_dict["losses"] = hazard_losses.get_hazard_losses
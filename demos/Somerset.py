@@ -9,7 +9,7 @@ import os
 
 import geopandas
 
-from CHAPPIE import parcels, utils
+from CHAPPIE import geography, join, parcels, utils
 from CHAPPIE.assets import (
     cultural,
     education,
@@ -37,9 +37,10 @@ house_dict = {}
 usda_API = os.environ["usda_API"]
 
 # Start by getting intersecting parcels to relate all characteristics to
-parcel_gdf = parcels.get_regrid(aoi_gdf)
-parcel_gdf.drop_duplicates(inplace=True)  # Drop duplicates
-parcel_gdf.reset_index(inplace=True, drop=True)  # Fix index
+# Parcels are kept in a local store (by county, unique on Regrid id) so only
+# tiles not already stored are requested from the service on re-runs
+parcel_store = os.path.join(main_dir, "parcel_store")
+parcel_gdf = parcels.get_regrid(aoi_gdf, store_dir=parcel_store)
 # Get a generalized representation to join results to
 parcel_centroids = parcels.process_regrid(parcel_gdf)
 
@@ -67,27 +68,30 @@ hazards_dict["flood_EA"] = flood.get_flood(parcel_gdf)
 # either as those that intersect the parcel polygon or centroid. We use centroid
 # to avoid one-to-many relationships, but the most relevant relationship is if
 # the building footprint itself intersects the flood zone.
-for key, gdf in hazards_dict.items():
-    # TODO: faster/better join on parcelID?
-    households = households.sjoin(gdf, how="left")
-    # TODO: can likely drop the index but may be useful for one vs many
-    households = households.rename(columns={"index_right": f"{key}_index"})
+households = join.attribute(households,
+                            {"flood_FEMA": (hazards_dict["flood_FEMA"],
+                                            "intersects",
+                                            "first")})
+# EnviroAtlas flood results are already by parcel (parcelnumb)
+flood_EA = hazards_dict["flood_EA"].rename(columns={"mean": "flood_EA_mean"})
+households = households.merge(flood_EA, on="parcelnumb", how="left")
 
 # Get event hazards
 in_crs = "ESRI:102005"
 parcel_gdf = parcel_gdf.to_crs(in_crs)
-tornadoes_gdf = tornadoes.get_tornadoes(parcel_gdf)
-hazards_dict["tornadoes"] = tornadoes.process_tornadoes(tornadoes_gdf,
-                                                        parcel_gdf)
-cyclones = tropical_cyclones.get_cyclones(parcel_gdf)
-hazards_dict["cyclones"] = tropical_cyclones.process_cyclones(cyclones,
-                                                              parcel_gdf)
+hazards_dict["tornadoes"] = tornadoes.get_tornadoes(parcel_gdf)
+hazards_dict["cyclones"] = tropical_cyclones.get_cyclones(parcel_gdf)
 
 # Wind event hazards cover large areas and likely impact a household when
 # the parcel is in their path. Here we used the parcel, but because the path is
 # buffered based on wind speed, using centroids shouldn't impact most results.
-parcel_results = parcel_gdf.sjoin(hazards_dict["tornadoes"], how="left")
-parcel_results = parcel_results.sjoin(hazards_dict["cyclones"], how="left")
+# Tornado exposure compares parcel distance to each track against the track
+# half-width, so the buffered paths are never built (one row per parcel).
+parcel_results = parcel_gdf.join(
+    tornadoes.get_exposure(hazards_dict["tornadoes"], parcel_gdf))
+# Cyclone exposure is distance to un-buffered storm tracks (within 100 miles).
+parcel_results = parcel_results.join(
+    tropical_cyclones.get_exposure(hazards_dict["cyclones"], parcel_gdf))
 
 # Back to original GCS for queries
 parcel_gdf = parcel_gdf.to_crs(4326)
@@ -98,11 +102,8 @@ hazards_dict["heat"] = weather.get_heat_events(parcel_gdf)
 # Heat hazards are gatherd by census tract (11 digit ID)
 # This allows them to be joined (many parcels to one heat vale) on SVI geoid
 hazards_dict["heat"] = hazards_dict["heat"].rename(columns={"id": "heat_id"})
-households["tract_id"] = [id[:11] for id in households["GEOID"]]  # Add tract_id
-households = households.set_index("tract_id").join(
-    hazards_dict["heat"].set_index("geoId")
-)
-households.reset_index(inplace=True)  # Fix it after the join
+# Block group GEOID rolled up to tract (integer keys) to join tract values
+households = geography.roll_down(households, hazards_dict["heat"], parent_col="geoId")
 
 # Get hazard endpoints
 # hazards_dict["losses"] = hazard_losses.get_hazard_losses
@@ -110,48 +111,23 @@ households.reset_index(inplace=True)  # Fix it after the join
 
 # Note: these may have spatial relations other than overlap (e.g., range)
 # Get tech hazards
-hazards_dict["superfund"] = technological.get_superfund_npl(parcel_gdf)  #n=1
-hazards_dict["brownfields"] = technological.get_FRS_ACRES(parcel_gdf)  #n=8
-hazards_dict["landfills"] = technological.get_landfills(parcel_gdf)  #n=5
-hazards_dict["tri"] = technological.get_tri(parcel_gdf)  #n=8
+# superfund n=1, brownfields n=8, landfills n=5, tri n=8 (all concurrently)
+hazards_dict.update(technological.get_all(parcel_gdf))
 
 # For demonstration purposes we used a 5 km buffer around centroids
-# Note index_right is added in first sjoin, not the pandas.join and then each
-# subsequent sjoin TODO: figure out if it is needed?
-households = households.to_crs("ESRI:102005")  # Use CONUS equidistant conic
-for key in ["superfund", "brownfields", "landfills", "tri"]:
-    join_params = {
-        "df": hazards_dict[key].to_crs(households.crs),
-        "how": "left",
-        "predicate": "dwithin",
-        "distance": "5000",
-        "rsuffix": f"{key}",
-    }
-    households = households.sjoin(**join_params)
-    #households = households.rename(columns={"index_right": f"{key}_index"})
-
-# Aggregating - of the results above we expect:
-# NOTE: superfund result wasn't in range (ACCOMACK county, VA)
-# NOTE: landfills didnt generate more duplicate parcel points (all one-to-one)
-# NOTE: TRI didn't generate more duplciate parcel points, OBJECTID_left warning
 # NOTE: 5700 parcel points fall in range of multiple brownfields,
 # REGISTRY_ID '110038762416' & '110002476614'
-# Multiple tech hazards can be in range of each parcel centroid, ideally some
-# aggregation method would be used for each field. Luckily it's just the one
-# dataset that isn't one-to-one and we can use duplicated index to groupby.
-# the demonstrated agg method concats values into a list.
-# List fields from joined
-cols = hazards_dict["brownfields"].columns
-
-suf = "_brownfields"  # Imitate rsuffix
-cols = [f"{col}{suf}" if f"{col}{suf}" in households else col for col in cols]
-cols.pop(cols.index('geometry'))  # drop geometry (not joined)
-
-for col in cols:
-    households[col] = households.groupby(households.index)[col].apply(list)
-
-# drop duplicates beyond first occurance (based on index)
-households = households[~households.index.duplicated()]
+# Multiple tech hazards can be in range of each parcel centroid, rather than
+# one row per parcel-hazard pair each hazard is aggregated to a count, nearest
+# distance and list of the hazard index values in range (one row per household)
+households = households.to_crs("ESRI:102005")  # Use CONUS equidistant conic
+for key in ["superfund", "brownfields", "landfills", "tri"]:
+    tech_df = join.within_distance(households,
+                                   hazards_dict[key],
+                                   [5000],
+                                   name=key,
+                                   ids=True)
+    households = households.join(tech_df)
 
 # Get community level characteristics
 # Note: these will be accessed by networks, for now just get nearest
@@ -169,8 +145,7 @@ assets_dict["worship"] = cultural.get_worship(parcel_gdf)
 #assets_dict["colleges_sup"] = education.get_supplemental_colleges(parcel_gdf)
 
 # Get emergency assets
-assets_dict["fire_ems"] = emergency.get_fire_ems(parcel_gdf)  # check url
-assets_dict["police"] = emergency.get_police(parcel_gdf)
+assets_dict.update(emergency.get_all(parcel_gdf))  # check fire_ems url
 
 # Get food assets
 assets_dict["agritourism"] = food.get_agritourism(parcel_gdf, usda_API)
@@ -187,53 +162,11 @@ assets_dict["hospitals"] = health.get_hospitals(parcel_gdf)
 
 households = households.to_crs("ESRI:102005")
 
-# When two points are nearest it results in multiple rows, we can check for
-# these by getting len() of results
-for key, df in assets_dict.items():
-    x = households.sjoin_nearest(df.to_crs(households.crs),
-                                 how="left",
-                                 rsuffix=f"{key}",
-                                 distance_col=f"{key}_dist"
-                                 )
-    print(f'{key}: {len(x)}')
-# We can then explore each (historic_sites, worship) to see why this happened
-key, df = "historic_sites", assets_dict["historic_sites"]
-test_join = households.sjoin_nearest(df.to_crs(households.crs),
-                                     how="left",
-                                     rsuffix=f"{key}",
-                                     distance_col=f"{key}_dist"
-                                     )
-test_join[test_join.index.duplicated()]  # Examine duplicates (e.g., 1304)
-test_prop_ids = test_join.loc[1304]['PROPERTY_ID'].to_list()
-# Look at original geometry for the duplicates
-df[df['PROPERTY_ID'].isin(test_prop_ids)]['geometry']
-# In a full evaluation the best row/point should be chosen, arbitrary here
-# assets_dict["historic_sites0"] = assets_dict["historic_sites"]  # Retain OG
-assets_dict["historic_sites"] = df.drop_duplicates(subset=['geometry'])
-
-# Now look at worship
-key, df = "worship", assets_dict["worship"]
-test_join = households.sjoin_nearest(df.to_crs(households.crs),
-                                     how="left",
-                                     rsuffix=f"{key}",
-                                     distance_col=f"{key}_dist"
-                                     )
-test_join[test_join.index.duplicated()]  # Examine duplicates (e.g., 1024)
-test_join.loc[1024, "NAME"] # Unique places
-test_join.loc[1024, ["STREET", "MATCH_ADDR"]]  # PO Box -> address used
-test_ids = test_join.loc[1024, "GlobalID_worship"].to_list()
-# Look at original geometry for the duplicates
-df[df['GlobalID'].isin(test_ids)]['geometry']
-# assets_dict["worship0"] = assets_dict["worship"]  # Retain OG
-assets_dict["worship"] = df.drop_duplicates(subset=['geometry'])  # 104 -> 83
-
-for key, df in assets_dict.items():
-    #route?
-    households = households.sjoin_nearest(df.to_crs(households.crs),
-                                          how="left",
-                                          rsuffix=f"{key}",
-                                          distance_col=f"{key}_dist"
-                                          )
+# When two assets are equally near (e.g., historic sites and worship locations
+# sharing a geometry) the first in the layer is used, so there is still one
+# row per household. The id is the asset layer index, distance is in meters.
+#TODO: route?
+households = households.join(join.nearest(households, assets_dict, k=1))
 
 # Get hazard infrastructure assets (floods were assessed to households)
 assets_dict["dams"] = hazard_infrastructure.get_dams(parcel_gdf)
@@ -242,15 +175,8 @@ assets_dict["dams"] = hazard_infrastructure.get_dams(parcel_gdf)
 # NOTE: Ecosystem services characteristics may be accessed by other networks,
 # e.g., downstream from dams along stream networks, but here we'll keep distance
 #for key in ["dams", "levees"]:
-key = 'dams'
-join_params = {
-    "df": assets_dict[key].to_crs(households.crs),
-    "how": "left",
-    "predicate": "dwithin",
-    "distance": "5000",
-    "rsuffix": f"{key}",
-}
-households = households.sjoin(**join_params)
+households = join.attribute(households,
+                            {"dams": (assets_dict["dams"], ("dwithin", 5000), "list")})
 
 # Intermediate query results from the dictionary can be QA-ed/saved
 utils.write_QA(assets_dict, os.path.join(out_dir, "assets2.csv"))